@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Append-only SQLite journal of panel events.
+
+record() only puts the event on a queue, so the plugin's receive path never waits on
+the disk. A background thread owns the writing connection and commits the queued
+events in batches, at most kCommitInterval seconds after they were recorded, and
+deletes events older than the retention period once a day. Queries open their own
+read connection; the database uses WAL mode so they don't block the writer.
+
+Zone and partition numbers are per panel, so every event records the panel it came
+from: the Alarm Panel device id, or 0 for the panel in the plugin config.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+kCommitInterval = 1.0
+kBatchSize = 500
+kPruneInterval = 24 * 60 * 60
+kQueryLimit = 1000
+kStopTimeout = 5
+
+# Put on the queue to stop the writer thread
+kStop = None
+
+kSchema = """
+	CREATE TABLE IF NOT EXISTS events (
+		id INTEGER PRIMARY KEY,
+		time REAL NOT NULL,
+		code TEXT NOT NULL,
+		data TEXT NOT NULL,
+		zone INTEGER,
+		partition INTEGER,
+		user INTEGER,
+		description TEXT,
+		panel INTEGER NOT NULL DEFAULT 0
+	);
+	CREATE INDEX IF NOT EXISTS eventsTime ON events (time);
+	CREATE INDEX IF NOT EXISTS eventsZone ON events (zone, time);
+	CREATE INDEX IF NOT EXISTS eventsPartition ON events (partition, time);
+	CREATE INDEX IF NOT EXISTS eventsCode ON events (code, time);
+"""
+
+kColumns = ('time', 'code', 'data', 'zone', 'partition', 'user', 'description', 'panel')
+
+
+class EventJournal(object):
+
+	def __init__(self, fileName, logger, retentionDays=0):
+		self.fileName = fileName
+		self.logger = logger
+		self.retentionDays = retentionDays
+		self.queue = queue.SimpleQueue()
+		self.nextPrune = 0
+		self.thread = None
+
+
+	def start(self):
+		os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+		# create the schema here so a bad path is reported to the caller
+		connection = sqlite3.connect(self.fileName)
+		try:
+			connection.execute("PRAGMA journal_mode=WAL")
+			connection.executescript(kSchema)
+			# journals written before events had a panel only have the plugin config's
+			if 'panel' not in [row[1] for row in connection.execute("PRAGMA table_info(events)")]:
+				connection.execute("ALTER TABLE events ADD COLUMN panel INTEGER NOT NULL DEFAULT 0")
+				connection.commit()
+		finally:
+			connection.close()
+		self.thread = threading.Thread(target=self._run, name="DSC event journal", daemon=True)
+		self.thread.start()
+
+
+	def stop(self, timeout=kStopTimeout):
+		if self.thread is None:
+			return
+		self.queue.put(kStop)
+		self.thread.join(timeout)
+		self.thread = None
+
+
+	def record(self, eventTime, code, data, zone=None, partition=None, user=None, description=None, panel=0):
+		self.queue.put((eventTime, code, data, zone, partition, user, description, panel))
+
+
+	# Returns matching events, newest first, as dicts with the kColumns keys.
+	# codes is a list of TPI command codes, or None for all.
+	#
+	def query(self, since=None, until=None, panel=None, zone=None, partition=None, user=None, codes=None, limit=kQueryLimit):
+		where = []
+		params = []
+		for (column, value) in (('panel', panel), ('zone', zone), ('partition', partition), ('user', user)):
+			if value is not None:
+				where.append(f"{column} = ?")
+				params.append(value)
+		if since is not None:
+			where.append("time >= ?")
+			params.append(since)
+		if until is not None:
+			where.append("time < ?")
+			params.append(until)
+		if codes:
+			where.append(f"code IN ({','.join('?' * len(codes))})")
+			params += codes
+		sql = f"SELECT {', '.join(kColumns)} FROM events"
+		if where:
+			sql += " WHERE " + " AND ".join(where)
+		sql += " ORDER BY time DESC LIMIT ?"
+		params.append(limit)
+
+		connection = sqlite3.connect(f"file:{self.fileName}?mode=ro", uri=True)
+		try:
+			return [dict(zip(kColumns, row)) for row in connection.execute(sql, params)]
+		finally:
+			connection.close()
+
+
+	def _run(self):
+		connection = sqlite3.connect(self.fileName)
+		try:
+			while True:
+				batch = []
+				stopping = False
+				try:
+					item = self.queue.get(timeout=kPruneInterval if self.retentionDays else None)
+					# give the rest of a burst a moment to arrive and go in the same commit
+					commitBy = time.time() + kCommitInterval
+					while True:
+						if item is kStop:
+							stopping = True
+							break
+						batch.append(item)
+						if len(batch) >= kBatchSize:
+							break
+						item = self.queue.get(timeout=max(0, commitBy - time.time()))
+				except queue.Empty:
+					pass
+
+				if batch:
+					self._write(connection, batch)
+				if self.retentionDays and time.time() >= self.nextPrune:
+					self._prune(connection)
+				if stopping:
+					return
+		finally:
+			connection.close()
+
+
+	def _write(self, connection, batch):
+		try:
+			with connection:
+				connection.executemany(f"INSERT INTO events ({', '.join(kColumns)}) VALUES ({', '.join('?' * len(kColumns))})", batch)
+		except sqlite3.Error as err:
+			self.logger.error(f"Unable to write {len(batch)} events to the event journal: {str(err)}")
+
+
+	def _prune(self, connection):
+		self.nextPrune = time.time() + kPruneInterval
+		try:
+			with connection:
+				connection.execute("DELETE FROM events WHERE time < ?", (time.time() - self.retentionDays * 86400,))
+		except sqlite3.Error as err:
+			self.logger.error(f"Unable to prune the event journal: {str(err)}")
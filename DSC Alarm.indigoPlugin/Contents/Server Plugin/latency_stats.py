@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Rolling latency histograms and queue depth gauges for the plugin's hot paths.
+
+Times are recorded per (stage, key), where the key is usually a TPI command code,
+into histograms with fixed, roughly logarithmic buckets so recording is a bisect and
+an increment. Statistics cover the current window plus the previous complete one, so
+a report always spans between one and two windows of recent activity.
+"""
+
+import bisect
+import time
+
+
+kWindowSeconds = 600
+
+# Bucket upper bounds in seconds, 1-2-5 steps from 10 us to 10 s
+kBucketBounds = [mantissa * 10 ** exponent for exponent in range(-5, 1) for mantissa in (1, 2, 5)] + [10]
+
+
+def formatSeconds(seconds):
+	if seconds < 0.001:
+		return f"{seconds * 1e6:.0f}us"
+	if seconds < 1:
+		return f"{seconds * 1e3:.1f}ms"
+	return f"{seconds:.2f}s"
+
+
+class Histogram(object):
+
+	def __init__(self):
+		self.buckets = [0] * (len(kBucketBounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+
+	def add(self, seconds):
+		self.buckets[bisect.bisect_left(kBucketBounds, seconds)] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+
+	def merge(self, other):
+		for i, count in enumerate(other.buckets):
+			self.buckets[i] += count
+		self.count += other.count
+		self.total += other.total
+		self.max = max(self.max, other.max)
+
+
+	# Upper bound of the bucket holding the pct percentile, or the maximum if that
+	# is smaller
+	#
+	def percentile(self, pct):
+		rank = self.count * pct / 100
+		seen = 0
+		for i, count in enumerate(self.buckets):
+			seen += count
+			if seen >= rank and count:
+				if i < len(kBucketBounds):
+					return min(kBucketBounds[i], self.max)
+				break
+		return self.max
+
+
+class Gauge(object):
+
+	def __init__(self):
+		self.value = 0
+		self.max = 0
+
+
+	def set(self, value):
+		self.value = value
+		if value > self.max:
+			self.max = value
+
+
+class LatencyStats(object):
+
+	def __init__(self, window=kWindowSeconds):
+		self.window = window
+		self.reset()
+
+
+	def reset(self):
+		self.current = {}
+		self.previous = {}
+		self.gauges = {}
+		self.windowStart = time.time()
+
+
+	# Starts a new window once the current one is complete. The previous window is
+	# dropped, and gauge maximums start again from their current values.
+	#
+	def rotate(self, timeNow=None):
+		timeNow = timeNow or time.time()
+		if timeNow - self.windowStart < self.window:
+			return
+		self.previous = self.current
+		self.current = {}
+		self.windowStart = timeNow
+		for gauge in self.gauges.values():
+			gauge.max = gauge.value
+
+
+	def record(self, stage, key, seconds):
+		histogram = self.current.get((stage, key))
+		if histogram is None:
+			histogram = self.current[(stage, key)] = Histogram()
+		histogram.add(seconds)
+
+
+	def setGauge(self, name, value):
+		gauge = self.gauges.get(name)
+		if gauge is None:
+			gauge = self.gauges[name] = Gauge()
+		gauge.set(value)
+
+
+	# Returns {(stage, key): Histogram} covering the previous and current windows
+	#
+	def histograms(self):
+		merged = {}
+		for window in (self.previous, self.current):
+			for (stageKey, histogram) in window.items():
+				if stageKey not in merged:
+					merged[stageKey] = Histogram()
+				merged[stageKey].merge(histogram)
+		return merged
+
+
+	def stageTotals(self):
+		totals = {}
+		for ((stage, key), histogram) in self.histograms().items():
+			if stage not in totals:
+				totals[stage] = Histogram()
+			totals[stage].merge(histogram)
+		return totals
+
+
+	def report(self, stages):
+		histograms = self.histograms()
+		lines = []
+		for (stage, description) in stages:
+			keys = sorted((key for (histStage, key) in histograms if histStage == stage), key=lambda key: histograms[(stage, key)].count, reverse=True)
+			if not keys:
+				continue
+			lines.append(f"{description}:")
+			lines.append(f"{'':4}{'cmd':<6}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+			for key in keys:
+				histogram = histograms[(stage, key)]
+				lines.append(f"{'':4}{key:<6}{histogram.count:>8}{formatSeconds(histogram.total / histogram.count):>10}"
+					+ "".join(f"{formatSeconds(histogram.percentile(pct)):>10}" for pct in (50, 90, 99))
+					+ f"{formatSeconds(histogram.max):>10}")
+		if self.gauges:
+			lines.append("Queue depths (now / max):")
+			for (name, gauge) in sorted(self.gauges.items()):
+				lines.append(f"{'':4}{name:<28}{gauge.value:>6} / {gauge.max}")
+		return lines
@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Minimal HTTP endpoint serving metrics in the Prometheus text exposition format.
+
+MetricsServer answers GET /metrics on its own thread with the text returned by the
+render callback, so the plugin only has to collect its counters when a scrape
+arrives. MetricsText builds that text from counters and gauges with optional labels.
+"""
+
+import http.server
+import threading
+
+
+kContentType = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escapeLabel(value):
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsText(object):
+
+	def __init__(self, prefix=''):
+		self.prefix = prefix
+		self.lines = []
+
+
+	# samples is a number, or a list of ({label: value}, number) tuples
+	#
+	def add(self, name, metricType, helpText, samples):
+		name = self.prefix + name
+		self.lines.append(f"# HELP {name} {helpText}")
+		self.lines.append(f"# TYPE {name} {metricType}")
+		if not isinstance(samples, list):
+			samples = [({}, samples)]
+		for (labels, value) in samples:
+			if labels:
+				labelText = ",".join(f'{key}="{escapeLabel(labelValue)}"' for (key, labelValue) in sorted(labels.items()))
+				self.lines.append(f"{name}{{{labelText}}} {value}")
+			else:
+				self.lines.append(f"{name} {value}")
+
+
+	def counter(self, name, helpText, samples):
+		self.add(name, 'counter', helpText, samples)
+
+
+	def gauge(self, name, helpText, samples):
+		self.add(name, 'gauge', helpText, samples)
+
+
+	def text(self):
+		return "\n".join(self.lines) + "\n"
+
+
+class MetricsServer(object):
+
+	def __init__(self, address, port, render, logger):
+		self.address = address
+		self.port = port
+		self.render = render
+		self.logger = logger
+		self.httpd = None
+		self.thread = None
+
+
+	# Raises OSError if the port cannot be opened
+	#
+	def start(self):
+		metricsServer = self
+
+		class Handler(http.server.BaseHTTPRequestHandler):
+
+			def do_GET(self):
+				if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+					self.send_error(404)
+					return
+				try:
+					body = metricsServer.render().encode('utf-8')
+				except Exception as err:
+					metricsServer.logger.error(f"Unable to render metrics: {str(err)}")
+					self.send_error(500)
+					return
+				self.send_response(200)
+				self.send_header('Content-Type', kContentType)
+				self.send_header('Content-Length', str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, format, *args):
+				pass
+
+		self.httpd = http.server.ThreadingHTTPServer((self.address, self.port), Handler)
+		self.httpd.daemon_threads = True
+		self.thread = threading.Thread(target=self.httpd.serve_forever, name="DSC metrics server", daemon=True)
+		self.thread.start()
+
+
+	def stop(self):
+		if self.httpd is None:
+			return
+		self.httpd.shutdown()
+		self.httpd.server_close()
+		self.thread.join()
+		self.httpd = None
+		self.thread = None
@@ -0,0 +1,97 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Background delivery of email and speech notifications.
+
+A NotificationWorker owns a bounded queue of pending notifications for one channel
+and a thread that delivers them, so the plugin thread reading the TPI socket never
+waits on indigo.server.sendEmailTo or indigo.server.speak. Failed deliveries are
+retried a configurable number of times. A notification posted with a merge key
+replaces one with the same key that is still waiting, and when the queue is full
+the oldest pending notification is dropped.
+"""
+
+import collections
+import threading
+
+
+kMaxPending = 20
+kStopTimeout = 10
+
+
+class NotificationWorker(object):
+
+	def __init__(self, name, deliver, logger, maxPending=kMaxPending, retries=0, retryDelay=5):
+		self.name = name
+		self.deliver = deliver
+		self.logger = logger
+		self.maxPending = maxPending
+		self.retries = retries
+		self.retryDelay = retryDelay
+		self.pending = collections.deque()
+		self.condition = threading.Condition()
+		self.stopping = False
+		self.thread = threading.Thread(target=self._run, name=f"DSC {name} notifications", daemon=True)
+		self.thread.start()
+
+
+	# Queue a notification. Returns False if the worker has been stopped.
+	#
+	def post(self, payload, mergeKey=None):
+		with self.condition:
+			if self.stopping is True:
+				self.logger.warning(f"Dropping {self.name} notification, the plugin is shutting down.")
+				return False
+
+			if mergeKey is not None:
+				for item in self.pending:
+					if item[0] == mergeKey:
+						self.logger.debug(f"Merged {self.name} notification with one already waiting.")
+						item[1] = payload
+						return True
+
+			if len(self.pending) >= self.maxPending:
+				self.pending.popleft()
+				self.logger.warning(f"Too many {self.name} notifications waiting, dropped the oldest one.")
+
+			self.pending.append([mergeKey, payload])
+			self.condition.notify()
+		return True
+
+
+	# Deliver what is still waiting and end the worker thread
+	#
+	def stop(self, timeout=kStopTimeout):
+		with self.condition:
+			self.stopping = True
+			self.condition.notify()
+		self.thread.join(timeout)
+		if self.thread.is_alive():
+			self.logger.warning(f"{self.name.capitalize()} notifications did not finish before shutdown.")
+
+
+	def _run(self):
+		while True:
+			with self.condition:
+				while not self.pending and self.stopping is False:
+					self.condition.wait()
+				if not self.pending:
+					return
+				(mergeKey, payload) = self.pending.popleft()
+
+			for attempt in range(self.retries + 1):
+				try:
+					self.deliver(payload)
+					break
+				except Exception as err:
+					if attempt < self.retries:
+						self.logger.warning(f"Unable to send {self.name} notification, retrying: {str(err)}")
+						with self.condition:
+							# don't keep retrying once a shutdown has been asked for
+							if self.condition.wait_for(lambda: self.stopping, self.retryDelay):
+								self.logger.error(f"Unable to send {self.name} notification: {str(err)}")
+								break
+					else:
+						self.logger.error(f"Unable to send {self.name} notification: {str(err)}")
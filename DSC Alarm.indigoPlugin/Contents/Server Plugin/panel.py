@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Connection and alarm state of one DSC panel.
+
+The plugin talks to every panel on its own thread: the panel configured in the plugin
+config on the concurrent thread, and each Alarm Panel device on a thread started by
+deviceStartComm. The attributes in kPanelAttributes are per panel. Plugin classes
+decorated with withPanelAttributes get a property for each of them that reads and
+writes the panel the calling thread is working for, so the state machine and the
+packet handlers use self.port, self.zoneList and so on exactly as with a single panel.
+"""
+
+import threading
+from tpi_codec import FrameBuffer
+from zone_table import ZoneTable
+
+
+kPanelAttributes = (
+	# connection and state machine
+	'state', 'port', 'useSerial', 'useAsyncTransport', 'timeNow', 'nextPingTime', 'nextRetryTime',
+	'reconnectAttempts', 'connectedSince', 'rxLastPacketTime', 'rxBuffer', 'lastPingRtt',
+	# command queue
+	'txCmdList', 'txInFlight', 'txSerializeUntil', 'txLastSendTime',
+	'thermoSteps', 'thermoSensor', 'thermoDeadline',
+	# zone, partition and thermostat numbers to device ids, zone states and buffered state writes
+	'zoneList', 'keypadList', 'tempList', 'zoneTable', 'stateBuffer',
+	# alarm, trouble and time sync
+	'repeatAlarmTripped', 'repeatAlarmTrippedNext',
+	'trippedEmailHoldUntil', 'trippedEmailSuppressed', 'troubleCode', 'troubleClearedTime', 'timesyncflag',
+	# warm start
+	'snapshot', 'staleStates', 'reconcileTime',
+)
+
+
+class Panel(object):
+
+	# devId is the Alarm Panel device, or 0 for the panel in the plugin config. prefs
+	# are the connection settings, None for the plugin config.
+	#
+	def __init__(self, devId, name, initialState, prefs=None):
+		self.devId = devId
+		self.name = name
+		self.prefs = prefs
+		self.thread = None
+		self.stopping = False
+
+		self.state = initialState
+		self.port = None
+		self.useSerial = False
+		self.useAsyncTransport = False
+		self.timeNow = 0
+		self.nextPingTime = 0
+		self.nextRetryTime = 0
+		self.reconnectAttempts = 0
+		self.connectedSince = 0
+		self.rxLastPacketTime = 0
+		self.rxBuffer = FrameBuffer()
+		self.lastPingRtt = None
+
+		self.txCmdList = []
+		self.txInFlight = []
+		self.txSerializeUntil = 0
+		self.txLastSendTime = 0
+		# thermostat adjustment in progress, its remaining (tx, error text) steps
+		self.thermoSteps = []
+		self.thermoSensor = None
+		self.thermoDeadline = 0
+
+		self.zoneList = {}
+		self.keypadList = {}
+		self.tempList = {}
+		self.zoneTable = ZoneTable()
+		self.stateBuffer = {}
+
+		self.repeatAlarmTripped = False
+		self.repeatAlarmTrippedNext = 0
+		self.trippedEmailHoldUntil = 0
+		self.trippedEmailSuppressed = 0
+		self.troubleCode = 0
+		self.troubleClearedTime = 0
+		self.timesyncflag = True
+
+		self.snapshot = None
+		self.staleStates = {}
+		self.reconcileTime = 0
+
+
+# Every thread starts out working for the default panel, threading.local calls
+# __init__ with the same arguments the first time a thread uses the context.
+#
+class PanelContext(threading.local):
+
+	def __init__(self, defaultPanel):
+		self.panel = defaultPanel
+
+
+def panelAttribute(name):
+	return property(
+		lambda plugin: getattr(plugin.panelContext.panel, name),
+		lambda plugin, value: setattr(plugin.panelContext.panel, name, value))
+
+
+def withPanelAttributes(cls):
+	for name in kPanelAttributes:
+		setattr(cls, name, panelAttribute(name))
+	return cls
@@ -16,13 +16,26 @@ This plugin requires Python 3.10 and Indigo 2022.1.x and higher.
 """
 
 import os
+import contextlib
+import functools
+import json
 import platform
+import random
 import sys
 import re
+import threading
 import time
 from datetime import datetime
 import logging
 import serial
+from tpi_transport import AsyncSocketPort, readAvailable
+from notify_worker import NotificationWorker
+from latency_stats import LatencyStats
+from metrics_server import MetricsServer, MetricsText
+from event_journal import EventJournal
+from panel import Panel, PanelContext, withPanelAttributes
+from tpi_codec import decodeFrame, encodeFrame, packKeystrings, kMaxKeystringKeys
+from zone_table import maskZones, zonesMask
 try:
     import indigo
 except ImportError:
@@ -73,14 +86,187 @@ kPanicTypeList = ['None', 'Fire', 'Ambulance', 'Panic']
 kMonthList = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
 kLogLevelList = ['Detailed Debug', 'Debug', 'Info', 'Warning', 'Error', 'Critical']
 
+# System error/warning sub codes received with cmd 502
+kSystemErrorDict = {
+	'001': 'Receive Buffer Overrun (a command is received while another is still being processed)',
+	'002': 'Receive Buffer Overflow',
+	'003': 'Transmit Buffer Overflow',
+	'010': 'Keybus Transmit Buffer Overrun',
+	'011': 'Keybus Transmit Time Timeout',
+	'012': 'Keybus Transmit Mode Timeout',
+	'013': 'Keybus Transmit Keystring Timeout',   # this error is sometimes received after disarming a tripped partition with TPI disarm command 040
+	'014': 'Keybus Interface Not Functioning (the TPI cannot communicate with the security system)',
+	'015': 'Keybus Busy (Attempting to Disarm or Arm with user code)',
+	'016': 'Keybus Busy – Lockout (The panel is currently in Keypad Lockout – too many disarm attempts)',
+	'017': 'Keybus Busy – Installers Mode (Panel is in installers mode, most functions are unavailable)',
+	'018': 'Keybus Busy – General Busy (The requested partition is busy)',
+	'020': 'API Command Syntax Error',
+	'021': 'API Command Partition Error (Requested Partition is out of bounds)',
+	'022': 'API Command Not Supported',
+	'023': 'API System Not Armed (sent in response to a disarm command)',
+	'024': 'API System Not Ready to Arm (not secure, in delay, or already armed)',
+	'025': 'API Command Invalid Length',
+	'026': 'API User Code not Required',
+	'027': 'API Invalid Characters in Command',
+}
+
+# Trouble notices that are logged and emailed: cmd -> (log level, log text, email text, trigger event)
+kTroubleNoticeDict = {
+	'800': (logging.WARNING, "Alarm Panel Battery is low.", "Alarm panel battery is low.", None),
+	'801': (logging.INFO, "Alarm Panel Battery is now ok.", "Alarm panel battery is now ok.", None),
+	'802': (logging.WARNING, "AC Power Lost.", "AC Power Lost.", 'eventNoticeAC_Trouble'),
+	'803': (logging.INFO, "AC Power Restored.", "AC Power Restored.", 'eventNoticeAC_Restore'),
+	'806': (logging.WARNING, "An open circuit has been detected across the bell terminals.", "An open circuit has been detected across the bell terminals.", None),
+	'807': (logging.INFO, "The bell circuit has been restored.", "The bell circuit has been restored.", None),
+	'814': (logging.WARNING, "FTC Trouble.", "The panel has failed to communicate successfully to the monitoring station.", None),
+	'815': (logging.INFO, "FTC Trouble Restore.", "The panel has resumed communications.", None),
+}
+
+# Status notices that are only written to the debug log
+kDebugNoticeDict = {
+	'851': "Partition Busy Restore.",
+	'896': "Keybus Fault",
+	'897': "Keybus Fault Restore",
+	'904': "Beep Status",
+	'905': "Tone Status",
+	'906': "Buzzer Status",
+	'907': "Door Chime Status",
+}
+
+# Event journal. Packets are journaled unless their code is in kJournalSkipCodes, with
+# the zone, partition and user code read from the data of the codes listed here.
+kJournalRetentionDefault = 365
+kJournalQueryLimitDefault = 50
+kJournalSkipCodes = {'500', '505', '510', '511', '550', '561', '562', '563', '900', '901', '903', '908', '921', '922'} | set(kDebugNoticeDict)
+kJournalZoneCodes = {'605', '606', '609', '610'}            # data is the zone
+kJournalPartitionZoneCodes = {'601', '602', '603', '604'}   # partition then zone
+kJournalUserCodes = {'700', '750'}                          # partition then 4 digit user code
+kJournalPartitionCodes = {'650', '651', '652', '653', '654', '655', '656', '657', '663', '664', '672', '673', '701', '702', '751', '840', '841'}
+
+# Event types offered by the Query Event Journal action, None is all events
+kJournalEventTypes = {
+	'all': None,
+	'zoneOpen': ['609'],
+	'zoneClosed': ['610'],
+	'alarm': ['601', '620', '621', '623', '625', '631', '654'],
+	'armed': ['652', '700', '701', '702'],
+	'disarmed': ['655', '750', '751'],
+	'trouble': sorted(kTroubleNoticeDict) + ['840', '841', '849'],
+}
+
 
 kCmdNormal = 0
 kCmdThermoSet = 1
 kPingInterval = 301
-kHoldRetryTimeMinutes = 3
+
+# Reconnecting. The first kReconnectFastRetries attempts after a failure are made
+# kReconnectFastDelay seconds apart, then the delay doubles from kReconnectBaseDelay
+# up to the configured maximum, with +/- kReconnectJitter of randomness so several
+# plugins or panels don't retry in step.
+kReconnectFastRetries = 3
+kReconnectFastDelay = 1
+kReconnectBaseDelay = 5
+kReconnectMaxDelayDefault = 180
+kReconnectJitter = 0.2
+
+# A socket connection that has been silent this many seconds is probed with a 000
+# ping. A ping that is never acknowledged means the connection is half-open.
+kRxIdleProbeSeconds = 30
+
+# Pipelined command queue. Up to kTxMaxInFlight commands may wait for their 500 ACK at
+# the same time. After a buffer overrun the queue falls back to one command at a time
+# for kTxSerializeSeconds.
+kTxMaxInFlight = 4
+kTxAckTimeout = 3
+kTxRetries = 3
+kTxSerializeSeconds = 30
+# A thermostat adjustment step that gets no 563 reply within this time is aborted
+kThermoStepTimeout = kTxAckTimeout * kTxRetries
+kTxOverrunErrors = {'001', '002', '010'}
+# Errors the panel sends after it has acknowledged the command, e.g. not ready to arm
+kTxPostAckErrors = {'023', '024'}
+# Keystrings toggle zone bypass, sending one twice undoes it, so they are never resent
+# after an error
+kTxNoResendCmds = {'071'}
+
+# Warm start. Zone and keypad states are snapshotted every minute while connected and
+# restored at start up, marked stale, if the snapshot is newer than kWarmStartMaxAge.
+# kReconcileSeconds after the 001 status dump has been requested, restored keypad states
+# the dump did not confirm fall back to the cold start values in kKeypadColdStates.
+kWarmStartMaxAge = 3600
+kReconcileSeconds = 15
+kSnapshotZoneStates = ('state', 'bypass')
+kSnapshotKeypadStates = ('state', 'ArmedState', 'ReadyState', 'PanicState', 'LEDTrouble', 'LEDBypass')
+kKeypadColdStates = {'state': kAlarmStateDisarmed, 'ReadyState': kReadyStateTrue, 'PanicState': kPanicStateNone}
+
+# Alarm Panel devices. Each runs its own connection on a thread of its own, which
+# deviceStopComm waits up to kPanelStopTimeout seconds for when the device is stopped.
+kPanelStopTimeout = 5
+kPanelStateConnected = 'connected'
+kPanelStateDisconnected = 'disconnected'
+# Events whose triggers select a panel, as partitions and user codes are per panel
+kPanelTriggerEvents = {'eventPartitionArmed', 'userArmed', 'userDisarmed', 'eventPartitionDisarmed', 'userDisarmedPartition'}
+
+# Prometheus metrics endpoint, off unless enabled in the plugin config
+kMetricsPortDefault = 9105
+
+# Latency statistics stages in the order they are reported
+kLatencyStages = [
+	('read', "Socket receive to readPort"),
+	('parse', "Decode, parse and checksum"),
+	('handler', "Command handler"),
+	('write', "Indigo state writes"),
+	('total', "Receive to device states updated"),
+	('queue', "Time in the command queue"),
+	('ack', "Send to 500 ACK"),
+]
+
+# Send scheduler pacing. A queued command can ask for a minimum gap (seconds) after the
+# previous command was sent, e.g. between keystrings that the Keybus has to process.
+kKeybusPacingDefault = 1.25
+kKeybusArmExtraGap = 0.25
+kLongKeypressTime = 2
+kRxPollTimeout = 1
+kRxMinPollTimeout = 0.05
+
+# Elapsed time states of zones and zone groups, and the short display state for each.
+# With lazy timer states a timer is only written when its short display changes, or
+# every minute if a Device State Changed trigger watches it.
+kTimerShortStates = {
+	'LastChangedTimer': 'LastChangedShort',
+	'AnyMemberLastChangedTimer': 'AnyMemberLastChangedShort',
+	'EntireGroupLastChangedTimer': 'EntireGroupLastChangedShort',
+}
+kWatchedTimersRefresh = 600
+
+# Email and speech are sent by background workers. Emails are retried, speech that
+# could not be spoken straight away is not worth repeating later.
+kEmailRetries = 3
+kEmailRetryDelay = 10
+kSpeechMaxPending = 5
+
+# Zones tripped within this many seconds of the last tripped zone email are sent
+# together in one follow up email
+kEmailDigestWindowDefault = 60
+
+
+# Decorates action callbacks so they work for the panel of the action's device, or
+# for the panel selected in the action for actions without a device.
+#
+def panelAction(method):
+	@functools.wraps(method)
+	def wrapper(self, action, *args):
+		if action.props.get('panel'):
+			panel = self.getPanel(int(action.props['panel']))
+		else:
+			panel = self.devicePanels.get(action.deviceId, self.defaultPanel)
+		with self.usePanel(panel):
+			return method(self, action, *args)
+	return wrapper
 
 
 ##########################################################################################
+@withPanelAttributes
 class Plugin(indigo.PluginBase):
 
 	########################################
@@ -88,7 +274,13 @@ class Plugin(indigo.PluginBase):
 		indigo.PluginBase.__init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
 
 		self.States = self.enum(STARTUP=1, HOLD=2, HOLD_RETRY=3, HOLD_RETRY_LOOP=4, BOTH_INIT=5, SO_CONNECT=6, ENABLE_TIME_BROADCAST=7, BOTH_PING=8, BOTH_POLL=9)
-		self.state = self.States.STARTUP
+
+		# The panel in the plugin config. Alarm Panel devices add more in deviceStartComm.
+		self.defaultPanel = Panel(0, "Alarm Panel", self.States.STARTUP)
+		self.panelContext = PanelContext(self.defaultPanel)
+		self.panels = {0: self.defaultPanel}
+		self.devicePanels = {}
+		self.handlerLock = threading.Lock()
 
 		# ============================ Configure Logging =================================
 		try:
@@ -108,20 +300,31 @@ class Plugin(indigo.PluginBase):
 		self.shutdown = False
 		self.configRead = False
 		self.interfaceState = 0
-		self.zoneList = {}
-		self.tempList = {}
 		self.zoneGroupList = {}
-		self.trippedZoneList = []
-		self.triggerList = []
-		self.keypadList = {}
+		self.zoneGroupIndex = {}
+		self.zoneGroupCounts = {}
+		self.timerStarted = {}
+		self.watchedTimers = set()
+		self.watchedTimersNext = 0
+		self.triggerIndex = {}
+		self.triggerKeys = {}
+		self.devMirror = {}
+		self.stateMirror = {}
 		self.createVariables = False
-		self.port = None
-		self.repeatAlarmTripped = False
 		self.isPortOpen = False
-		self.useSerial = False
-		self.txCmdList = []
-		self.closeTheseZonesList = []
-		self.currentHoldRetryTime = kHoldRetryTimeMinutes
+		self.latencyStats = LatencyStats()
+		self.rxChecksumErrors = 0
+		self.systemErrorCount = {}
+		self.connectionEventCount = {}
+		self.indigoCallCount = {}
+		self.metricsServer = None
+		self.journal = None
+		self.startTime = time.time()
+		self.rxCapture = None
+		self.rxCaptureLast = 0
+		self.configKeybusPacing = kKeybusPacingDefault
+		self.configLazyTimers = False
+		self.configReconnectMaxDelay = kReconnectMaxDelayDefault
 		self.ourVariableFolder = None
 		self.configEmailUrgent = ""
 		self.configEmailNotice = ""
@@ -133,11 +336,12 @@ class Plugin(indigo.PluginBase):
 		self.userLabel = ""
 		self.userLabelDict = {}
 		self.configSpeakVariable = None
+		self.configEmailDigestWindow = kEmailDigestWindowDefault
+		self.emailWorker = None
+		self.speechWorker = None
 		self.configKeepTimeSynced = True
 		self.configUseCustomIcons = True
-		self.timesyncflag = True
-		self.troubleCode = 0
-		self.troubleClearedTimer = 0
+		self.registerCmdHandlers()
 		
 		try:
 			self.pluginPrefs["TwoDS_Port"]
@@ -158,6 +362,8 @@ class Plugin(indigo.PluginBase):
 			indigo.variable.create("DSC_Last_Zone_Active", value="", folder="DSC")
 		if "DSC_Last_Motion_Active" not in indigo.variables:
 			indigo.variable.create("DSC_Last_Motion_Active", value="", folder="DSC")
+		if "DSC_Journal_Result" not in indigo.variables:
+			indigo.variable.create("DSC_Journal_Result", value="", folder="DSC")
 
 
 
@@ -185,6 +391,10 @@ class Plugin(indigo.PluginBase):
 		environment_state += spacer + f"{'Process ID:':<20} {os.getpid()}\n"
 		environment_state += spacer + f"{'':{'='}^107}\n"
 		self.logger.info(environment_state)
+
+		self.emailWorker = NotificationWorker("email", self.deliverEmail, self.logger, retries=kEmailRetries, retryDelay=kEmailRetryDelay)
+		self.speechWorker = NotificationWorker("speech", self.deliverSpeech, self.logger, maxPending=kSpeechMaxPending)
+		self.loadSnapshot()
 		
 
 	def shutdown(self):
@@ -195,15 +405,36 @@ class Plugin(indigo.PluginBase):
 	# Indigo Device Start/Stop
 	######################################################################################
 
+	# Alarm Panel devices start their own connection. Zones, keypads and thermostats
+	# are numbered within their panel; zone groups can have zones of any panel.
+	#
 	def deviceStartComm(self, dev):
 		self.logger.threaddebug(f"<<-- entering deviceStartComm: {dev.name} ({dev.id} - {dev.deviceTypeId})")
 
+		# Device lists, zone groups and timers are shared with the packet handlers of
+		# every panel, so they are only changed under handlerLock
+		if dev.deviceTypeId == 'alarmPanel':
+			self.startPanel(dev)
+		elif dev.deviceTypeId in ('alarmZone', 'alarmKeypad', 'alarmTemp'):
+			panel = self.getDevicePanel(dev)
+			self.devicePanels[dev.id] = panel
+			with self.usePanel(panel), self.handlerLock:
+				self.startAlarmDevice(dev)
+		else:
+			with self.handlerLock:
+				self.startAlarmDevice(dev)
+
+		self.logger.threaddebug("exiting deviceStartComm -->>")
+
+
+	def startAlarmDevice(self, dev):
 		props = dev.pluginProps
 
 		if dev.deviceTypeId == 'alarmZoneGroup':
 
 			if dev.id not in self.zoneGroupList:
 				self.zoneGroupList[dev.id] = props['devList']
+				self.indexZoneGroup(dev.id)
 
 			if dev.states['state'] == 0:
 				dev.updateStateOnServer(key="state", value=kZoneGroupStateClosed)
@@ -214,6 +445,9 @@ class Plugin(indigo.PluginBase):
 			if 'EntireGroupLastChangedShort' not in dev.states:
 				dev.stateListOrDisplayStateIdChanged()
 
+			self.startTimer(dev.id, 'AnyMemberLastChangedTimer', dev.states.get('AnyMemberLastChangedTimer', 0))
+			self.startTimer(dev.id, 'EntireGroupLastChangedTimer', dev.states.get('EntireGroupLastChangedTimer', 0))
+
 		elif dev.deviceTypeId == 'alarmZone':
 			if 'zoneNumber' not in props:
 				return
@@ -229,10 +463,15 @@ class Plugin(indigo.PluginBase):
 			if 'LastChangedShort' not in dev.states:
 				dev.stateListOrDisplayStateIdChanged()
 
+			if 'StaleState' not in dev.states:
+				dev.stateListOrDisplayStateIdChanged()
+
 			# If state is invalid or not there, set to closed
 			if dev.states['state'] == 0:
 				dev.updateStateOnServer(key='state', value=kZoneStateClosed)
 
+			self.restoreSnapshotStates(dev, 'zones', zone, kSnapshotZoneStates)
+
 			# If plugin is v2.x we won't have a bypass key so set it to default
 			if 'bypass' not in dev.states or dev.states['bypass'] == 0:
 				dev.stateListOrDisplayStateIdChanged()
@@ -244,6 +483,19 @@ class Plugin(indigo.PluginBase):
 				dev.replacePluginPropsOnServer(props)
 
 			dev.updateStateOnServer(key="LastChangedShort", value=self.getShortTime(dev.states["LastChangedTimer"]))
+			self.startTimer(dev.id, 'LastChangedTimer', dev.states["LastChangedTimer"])
+
+			# Start the zone table from the device, so the status and bypass dumps only
+			# update the zones they change
+			zoneTable = self.zoneTable
+			if zoneTable.hasZone(zone):
+				zoneTable.setPartition(zone, int(props['zonePartition']))
+				zoneTable.setOpen(zone, self.getState(dev.id, 'state') == kZoneStateOpen)
+				zoneBit = 1 << (zone - 1)
+				if self.getState(dev.id, 'bypass') == kZoneBypassYes:
+					zoneTable.bypassMask |= zoneBit
+				else:
+					zoneTable.bypassMask &= ~zoneBit
 
 
 			# Check for new version properties to see if we need to refresh the device
@@ -275,14 +527,18 @@ class Plugin(indigo.PluginBase):
 				props['partitionName'] = 'Default'
 				dev.replacePluginPropsOnServer(props)
 
-			dev.updateStateOnServer(key='state', value=kAlarmStateDisarmed)
-			dev.updateStateOnServer(key='ReadyState', value=kReadyStateTrue)
-			dev.updateStateOnServer(key='PanicState', value=kPanicStateNone)
-			if self.configUseCustomIcons is True:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
-				#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
-			else:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+			if 'StaleState' not in dev.states:
+				dev.stateListOrDisplayStateIdChanged()
+
+			# Without a recent snapshot assume the partition is disarmed until the panel
+			# reports otherwise
+			if not self.restoreSnapshotStates(dev, 'partitions', partition, kSnapshotKeypadStates):
+				dev.updateStatesOnServer([{'key': key, 'value': value} for key, value in kKeypadColdStates.items()])
+				if self.configUseCustomIcons is True:
+					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
+					#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
+				else:
+					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
 
 			# Check for new keypad states.
 			# If they're not present tell Indigo to reread the Devices.xml file
@@ -303,14 +559,32 @@ class Plugin(indigo.PluginBase):
 			if sensor not in list(self.tempList.keys()):
 				self.tempList[sensor] = dev
 
-		self.logger.threaddebug("exiting deviceStartComm -->>")
+		# Keep a local copy of the device states now that they have been initialised
+		if dev.deviceTypeId in ('alarmZoneGroup', 'alarmZone', 'alarmKeypad', 'alarmTemp'):
+			self.mirrorDevice(indigo.devices[dev.id])
+
+		# Zone groups started before this zone counted its state before any restore
+		for groupId in self.zoneGroupIndex.get(dev.id, ()):
+			self.indexZoneGroup(groupId)
 
 
 	def deviceStopComm(self, dev):
 		self.logger.threaddebug(f"<<-- entering deviceStopComm: {dev.name} ({dev.id} - {dev.deviceTypeId})")
 
+		if dev.deviceTypeId == 'alarmPanel':
+			self.stopPanel(self.getPanel(dev.id))
+			self.unmirrorDevice(dev.id)
+		else:
+			with self.usePanel(self.devicePanels.pop(dev.id, self.defaultPanel)), self.handlerLock:
+				self.stopAlarmDevice(dev)
+
+		self.logger.threaddebug("exiting deviceStopComm -->>")
+
+
+	def stopAlarmDevice(self, dev):
 		if dev.deviceTypeId == 'alarmZoneGroup':
 			if dev.id in self.zoneGroupList:
+				self.unindexZoneGroup(dev.id)
 				del self.zoneGroupList[dev.id]
 
 		elif dev.deviceTypeId == 'alarmZone':
@@ -318,6 +592,7 @@ class Plugin(indigo.PluginBase):
 				zone = int(dev.pluginProps['zoneNumber'])
 				if zone in list(self.zoneList.keys()):
 					del self.zoneList[zone]
+					self.zoneTable.setPartition(zone, 0)
 				#self.logger.debug(f"ZoneList is now: {self.zoneList}")
 
 		elif dev.deviceTypeId == 'alarmKeypad':
@@ -332,23 +607,51 @@ class Plugin(indigo.PluginBase):
 				if tmp in self.tempList:
 					del self.tempList[int(dev.pluginProps['sensorNumber'])]
 
-		self.logger.threaddebug("exiting deviceStopComm -->>")
+		self.unmirrorDevice(dev.id)
+		self.staleStates.pop(dev.id, None)
+		for timerKey in kTimerShortStates:
+			self.timerStarted.pop((dev.id, timerKey), None)
+
+
+	# Refresh the local copy when a device is changed on the server, either by
+	# our own state updates or by the user editing it.
+	#
+	def deviceUpdated(self, origDev, newDev):
+		indigo.PluginBase.deviceUpdated(self, origDev, newDev)
+		if newDev.id in self.devMirror:
+			self.mirrorDevice(newDev)
 
 
 	######################################################################################
 	# Indigo Trigger Start/Stop
 	######################################################################################
 
+	# Triggers are indexed by (event type, panel, partition number, user code) so firing
+	# an event is a single lookup. Panel, partition and user code are None for event
+	# types that don't have them in Events.xml. Partition and user code triggers saved
+	# before they had a panel menu are for the panel in the plugin config.
+	#
 	def triggerStartProcessing(self, trigger):
 		self.logger.threaddebug(f"<<-- entering triggerStartProcessing: {trigger.name} ({trigger.id})")
-		self.triggerList.append(trigger.id)
+		props = trigger.pluginProps
+		panelId = None
+		if trigger.pluginTypeId in kPanelTriggerEvents:
+			panelId = int(props.get('panel') or 0)
+		key = (trigger.pluginTypeId, panelId, props.get('partitionNum'), props.get('userCode'))
+		self.triggerKeys[trigger.id] = key
+		self.triggerIndex.setdefault(key, []).append(trigger.id)
 		self.logger.threaddebug("exiting triggerStartProcessing -->>")
 
 	def triggerStopProcessing(self, trigger):
 		self.logger.threaddebug(f"<<-- entering triggerStopProcessing: {trigger.name} ({trigger.id})")
-		if trigger.id in self.triggerList:
+		key = self.triggerKeys.pop(trigger.id, None)
+		if key is not None:
 			self.logger.threaddebug("TRIGGER FOUND")
-			self.triggerList.remove(trigger.id)
+			trigIds = [trigId for trigId in self.triggerIndex[key] if trigId != trigger.id]
+			if trigIds:
+				self.triggerIndex[key] = trigIds
+			else:
+				del self.triggerIndex[key]
 		self.logger.threaddebug("exiting triggerStopProcessing -->>")
 
 
@@ -356,12 +659,16 @@ class Plugin(indigo.PluginBase):
 	# Indigo Trigger Firing
 	######################################################################################
 
-	def triggerEvent(self, eventId):
+	def triggerEvent(self, eventId, partition=None, user=None):
 		self.logger.threaddebug(f"<<-- entering triggerEvent: {eventId} ")
-		for trigId in self.triggerList:
-			trigger = indigo.triggers[trigId]
-			if trigger.pluginTypeId == eventId:
-				indigo.trigger.execute(trigger)
+		if partition is not None:
+			partition = str(partition)
+		panelId = None
+		if eventId in kPanelTriggerEvents:
+			panelId = self.currentPanel().devId
+		for trigId in self.triggerIndex.get((eventId, panelId, partition, user), ()):
+			self.countIndigoCall('trigger.execute')
+			indigo.trigger.execute(trigId)
 		return
 
 
@@ -369,68 +676,49 @@ class Plugin(indigo.PluginBase):
 	# Indigo Action Methods
 	######################################################################################
 	#These are partition specific commands, except global and panic alarms.
+	#They are sent to the panel of the action's keypad, zone or thermostat device.
 
+	@panelAction
 	def methodDisarmAlarm(self, action, dev):
 		keypname = str(dev.pluginProps['partitionName'])
 		keyp = dev.pluginProps["partitionNumber"]
 		self.logger.info(f"Disarming Alarm. (Partition {keyp} '{keypname}')")
 		#tx = f"040{keyp}{self.pluginPrefs['code']:0<6}"
-		tx = f"040{keyp}{self.pluginPrefs['code']}"
-		self.txCmdList.append((kCmdNormal, tx))
+		tx = f"040{keyp}{self.panelPrefs['code']}"
+		self.queueCommand(tx)
 
 
+	@panelAction
 	def methodArmStay(self, action, dev):
 		keypname = str(dev.pluginProps['partitionName'])
 		keyp = dev.pluginProps["partitionNumber"]
 		self.logger.info(f"Arming Alarm in Stay Mode. (Partition {keyp} '{keypname}')")
-		self.txCmdList.append((kCmdNormal, '031' + keyp))
+		self.queueCommand('031' + keyp)
 
 
+	@panelAction
 	def methodArmAway(self, action, dev):
 		keypname = str(dev.pluginProps['partitionName'])
 		keyp = dev.pluginProps["partitionNumber"]
 		self.logger.info(f"Arming Alarm in Away Mode. (Partition {keyp} '{keypname}')")
-		self.txCmdList.append((kCmdNormal, '030' + keyp))
+		self.queueCommand('030' + keyp)
 
 
+	@panelAction
 	def methodArmStayForce(self, action, dev):
-		keypname = str(dev.pluginProps['partitionName'])
-		keypname = f" '{keypname}'"
-		keyp = dev.pluginProps["partitionNumber"]
-		keypstate = str(dev.states['state'])
-		if self.useSerial is True:
-			self.logger.error("This Action does not work with IT-100.")
-			return
-		if keypstate in (kAlarmStateArmedStay, kAlarmStateArmedAway):
-			self.logger.warning("The Selected Partition is Already Armed.")
-			return
-		tx = f"071{keyp}*1" #starts bypass mode
-		self.txCmdList.append((kCmdNormal, tx))
-		self.sleep(1.25) #increase delay if keybus buffer overruns			
-		if keyp != "1": #this sets all zones to nobypass if they are in partition 2-8, since those partitions do not report zone bypass status
-			tx = f"071{keyp}00"  #cancels all zone bypass for this partition
-			self.logger.debug("We have partition 2-8 and will cancel all bypass")
-			self.txCmdList.append((kCmdNormal, tx))
-			self.sleep(1.25) #increase delay if keybus buffer overruns
-		for zoneNum in self.zoneList.keys():
-			zone = indigo.devices[self.zoneList[zoneNum]]
-			zonePartition = zone.pluginProps['zonePartition']
-			if zone.states['state.open'] is True and zone.states['bypass'] == kZoneBypassNo and zonePartition == keyp:
-				self.logger.info(f"Bypassing Zone '{zone.name}' in Partition {keyp}{keypname}.")
-				zoneNum = str(zoneNum).zfill(2)
-				tx = f"071{keyp}{zoneNum}"
-				self.txCmdList.append((kCmdNormal, tx))
-				self.sleep(1.25) #increase delay if keybus buffer overruns
-		tx = f"071{keyp}1#" #ends bypass mode
-		self.txCmdList.append((kCmdNormal, tx))
-		self.sleep(1.5) #increase delay if keybus buffer overruns				
-		self.logger.info(f"Arming Alarm in Forced Stay Mode. (Partition {keyp}{keypname})")
-		self.txCmdList.append((kCmdNormal, '031' + keyp))
+		self.armForced(dev, '031', "Stay")
 
 
+	@panelAction
 	def methodArmAwayForce(self, action, dev):
+		self.armForced(dev, '030', "Away")
+
+
+	# Bypasses the open zones of the keypad's partition, then arms it with armCmd
+	#
+	def armForced(self, dev, armCmd, modeName):
 		keypname = str(dev.pluginProps['partitionName'])
-		keypname = " '{keypname}'"
+		keypname = f" '{keypname}'"
 		keyp = dev.pluginProps["partitionNumber"]
 		keypstate = str(dev.states['state'])
 		if self.useSerial is True:
@@ -439,68 +727,88 @@ class Plugin(indigo.PluginBase):
 		if keypstate in (kAlarmStateArmedStay, kAlarmStateArmedAway):
 			self.logger.warning("The Selected Partition is Already Armed.")
 			return
-		tx = f"071{keyp}*1" #starts bypass mode
-		self.txCmdList.append((kCmdNormal, tx))
-		self.sleep(1.25) #increase delay if keybus buffer overruns			
-		if keyp != "1": #this sets all zones to nobypass if they are in partition 2-8, since those partitions do not report zone bypass status
-			tx = f"071{keyp}00"  #cancels all zone bypass for this partition
+		# Keystrings are paced by the send scheduler so the Keybus buffer does not overrun.
+		# Increase the Keybus pacing in the plugin configuration if it still does.
+		pacing = self.configKeybusPacing
+		(zones, keystrings) = self.planForcedArmBypass(int(keyp))
+		if keyp != "1":
 			self.logger.debug("We have partition 2-8 and will cancel all bypass")
-			self.txCmdList.append((kCmdNormal, tx))
-			self.sleep(1.25) #increase delay if keybus buffer overruns
-		for zoneNum in self.zoneList.keys():
-			zone = indigo.devices[self.zoneList[zoneNum]]
-			zonePartition = zone.pluginProps['zonePartition']
-			if zone.states['state.open'] is True and zone.states['bypass'] == kZoneBypassNo and zonePartition == keyp:
-				self.logger.info(f"Bypassing Zone '{zone.name}' in Partition {keyp}{keypname}.")
-				zoneNum = str(zoneNum).zfill(2)
-				tx = f"071{keyp}{zoneNum}"
-				self.txCmdList.append((kCmdNormal, tx))
-				self.sleep(1.25) #increase delay if keybus buffer overruns
-		tx = f"071{keyp}1#" #ends bypass mode
-		self.txCmdList.append((kCmdNormal, tx))
-		self.sleep(1.5) #increase delay if keybus buffer overruns				
-		self.logger.info(f"Arming Alarm in Forced Away Mode. (Partition {keyp}{keypname})")
-		self.txCmdList.append((kCmdNormal, '030' + keyp))
+		for zoneNum in zones:
+			zone = self.getDevice(self.zoneList[zoneNum])
+			self.logger.info(f"Bypassing Zone '{zone.name}' in Partition {keyp}{keypname}.")
+		gap = 0
+		for keys in keystrings:
+			self.queueCommand(f"071{keyp}{keys}", gap=gap)
+			gap = pacing
+		self.logger.info(f"Arming Alarm in Forced {modeName} Mode. (Partition {keyp}{keypname})")
+		self.queueCommand(armCmd + keyp, gap=pacing + kKeybusArmExtraGap)
+
+
+	# Returns the open zones a forced arm of partition has to bypass, found with the
+	# zone table's partition index, and the 071 keystrings that bypass them. The keys
+	# are the same as sending one group per keystring, packed into as few keystrings
+	# as the length limit allows.
+	#
+	def planForcedArmBypass(self, partition):
+		groups = ['*1']    #starts bypass mode
+		if partition == 1:
+			zones = maskZones(self.zoneTable.getUnbypassedOpenMask(partition))
+		else:
+			# partitions 2-8 do not report zone bypass status, so cancel all zone bypass
+			# for the partition and bypass all of its open zones
+			zones = maskZones(self.zoneTable.getOpenMask(partition))
+			groups.append('00')
+		groups.extend(str(zone).zfill(2) for zone in zones)
+		groups.append('1#')    #ends bypass mode
+		return (zones, packKeystrings(groups))
 
 
+	@panelAction
 	def methodArmGlobal(self, action):
 		#this action arms all defined partitions in away mode.
 		self.logger.info("Arming Alarm in Global Mode (All Partitions).")
+		gap = 0
 		for i in range(1, 9):
 			if i in list(self.keypadList.keys()):
 				key = str(i)
-				self.txCmdList.append((kCmdNormal, '030' + key))
-				self.sleep(1)
+				self.queueCommand('030' + key, gap=gap)
+				gap = self.configKeybusPacing
 
 
+	@panelAction
 	def methodPanicAlarm(self, action):
 		panicType = action.props['panicAlarmType']
 		self.logger.info(f"Activating Panic Alarm! ({kPanicTypeList[int(panicType)]})")
-		self.txCmdList.append((kCmdNormal, '060' + panicType))
+		self.queueCommand('060' + panicType)
 
 
+	@panelAction
 	def methodSendKeypress070(self, action):
 		self.logger.debug("Received Send Keypress 070 Action")
 		keys = action.props['keys']
 		firstChar = True
 		sendBreak = False
+		gap = 0
 		for char in keys:
 			if char == 'L':
-				self.sleep(2)
+				# hold the previous key by delaying the following break
+				gap = kLongKeypressTime
 				sendBreak = False
 
 			if firstChar is False:
-				self.txCmdList.append((kCmdNormal, '070^'))
+				self.queueCommand('070^', gap=gap)
+				gap = 0
 
 			if char != 'L':
-				self.txCmdList.append((kCmdNormal, '070' + char))
+				self.queueCommand('070' + char)
 				sendBreak = True
 
 			firstChar = False
 		if sendBreak is True:
-			self.txCmdList.append((kCmdNormal, '070^'))
+			self.queueCommand('070^')
 
 
+	@panelAction
 	def methodSendKeypress071(self, action, dev):
 		keypname = f" '{str(dev.pluginProps['partitionName'])}' "
 		keyp = dev.pluginProps["partitionNumber"]
@@ -513,13 +821,14 @@ class Plugin(indigo.PluginBase):
 		if len(keys) != len(cleanKeys) or "*8" in keys:
 			self.logger.warning("There are Invalid Keys in your Command.")
 			return
-		if len(keys) > 6:
+		if len(keys) > kMaxKeystringKeys:
 			self.logger.warning("The Key Command is too long.")
 			return
 		tx = f"071{keyp}{keys}"
-		self.txCmdList.append((kCmdNormal, tx))
+		self.queueCommand(tx)
 
 
+	@panelAction
 	def methodSendKeypressVariable(self, action):
 		keys = indigo.variables["DSC_Command"]
 		keys = keys.value
@@ -537,9 +846,10 @@ class Plugin(indigo.PluginBase):
 		if keys[0] < "0" or keys[0] > "8":
 			self.logger.warning("The First Character in your DSCcommand Needs to be a Valid Partition (1-8).")
 		else:
-			self.txCmdList.append((kCmdNormal, '071' + keys))
+			self.queueCommand('071' + keys)
 
 
+	@panelAction
 	def methodBypassZone(self, action, dev):
 		key = dev.pluginProps["zoneNumber"]
 		keyp = dev.pluginProps["zonePartition"]
@@ -556,11 +866,12 @@ class Plugin(indigo.PluginBase):
 		self.logger.info(f"Received Zone Bypass Action for Zone '{zone.name}' in Partition {keyp}{keypname}.")
 		key = str(key).zfill(2)
 		tx = f"071{keyp}*1{key}#"
-		self.txCmdList.append((kCmdNormal, tx))
+		self.queueCommand(tx)
 		#This is a toggle action, i.e. already bypassed zones will turn to non-bypassed state.
 		#Zones in partition 2-8 do not report bypass status, therefore there will be no zone state update.
 
 
+	@panelAction
 	def methodBypassZoneCancel(self, action, dev):
 		keyp = dev.pluginProps["partitionNumber"]
 		dev = indigo.devices[self.keypadList[int(keyp)]]
@@ -574,9 +885,10 @@ class Plugin(indigo.PluginBase):
 			return
 		self.logger.info(f"Received All Zones Bypass Cancel for Partition {keyp}{keypname}.")
 		tx = f"071{keyp}*100#"
-		self.txCmdList.append((kCmdNormal, tx))
+		self.queueCommand(tx)
 
 
+	@panelAction
 	def methodBypassZoneRecall(self, action, dev):
 		keyp = dev.pluginProps["partitionNumber"]
 		dev = indigo.devices[self.keypadList[int(keyp)]]
@@ -590,9 +902,10 @@ class Plugin(indigo.PluginBase):
 			return
 		self.logger.info(f"Received Zone(s) Bypass Recall for Partition {keyp}{keypname}.")
 		tx = f"071{keyp}*199#"
-		self.txCmdList.append((kCmdNormal, tx))
+		self.queueCommand(tx)
 
 
+	@panelAction
 	def methodDoorChimeEnable(self, action, dev):
 		keyp = dev.pluginProps["partitionNumber"]
 		dev = indigo.devices[self.keypadList[int(keyp)]]
@@ -604,10 +917,11 @@ class Plugin(indigo.PluginBase):
 		self.logger.info(f"Received Keypad Chime Enable for Partition {keyp}{keypname}.")
 		if keypstate != kKeypadStateChimeEnabled:
 			tx = f"071{keyp}*4"
-			self.txCmdList.append((kCmdNormal, tx))
+			self.queueCommand(tx)
 			return
 
 
+	@panelAction
 	def methodDoorChimeDisable(self, action, dev):
 		keyp = dev.pluginProps["partitionNumber"]
 		dev = indigo.devices[self.keypadList[int(keyp)]]
@@ -619,61 +933,81 @@ class Plugin(indigo.PluginBase):
 		self.logger.info(f"Received Keypad Chime Disable for Partition {keyp}{keypname}.")
 		if keypstate == kKeypadStateChimeEnabled:
 			tx = f"071{keyp}*4"
-			self.txCmdList.append((kCmdNormal, tx))
+			self.queueCommand(tx)
 			return
 
 
 	def methodSyncTime(self, action):
 		d = datetime.now()
-		self.logger.info("Setting alarm panel time and date.")
-		self.txCmdList.append((kCmdNormal, f"010{d.strftime('%H%M%m%d%y')}"))
+		for panel in self.getActivePanels():
+			self.logger.info(f"Setting {panel.name} time and date.")
+			with self.usePanel(panel):
+				self.queueCommand(f"010{d.strftime('%H%M%m%d%y')}")
 
 
     # Queue a command to set DSC Thermostat Setpoints
 	#
+	@panelAction
 	def methodAdjustThermostat(self, action):
 		self.logger.debug(f"Device {action}:")
-		self.txCmdList.append((kCmdThermoSet, action))
+		self.queueCommand(action, cmdType=kCmdThermoSet)
 
 
 	# The command queued above calls this routine to create the packet
 	#
+	# A thermostat adjustment is a 095 (read setpoints), 096 (adjust) and 097 (save)
+	# sequence, each answered by a 563 with the thermostat's setpoints. The first step
+	# is queued here and rxThermostatSetPoints queues the next one when the 563 for the
+	# previous one arrives, so the command queue keeps running in between.
+	#
 	def setThermostat(self, action):
 		#find this thermostat in our list to get the number
-		for sensorNum in self.tempList.keys():
-			if self.tempList[sensorNum].id == action.deviceId:
+		sensorNum = None
+		for (num, dev) in self.tempList.items():
+			if dev.id == action.deviceId:
+				sensorNum = num
 				break
+		if sensorNum is None:
+			self.logger.error("Thermostat is not known to the panel, aborting adjustment.")
+			return
 
 		self.logger.debug(f"SensorNum = {sensorNum}")
 
-		#send 095 for thermostat in question, wait for 563 response
-		#self.logger.debug('095' + str(sensorNum))
-		rx = self.sendPacket('095' + str(sensorNum), waitFor='563')
-		if not rx:
-			self.logger.error("Error getting current thermostat setpoints, aborting adjustment.")
-			return
-
 		if (action.props['thermoAdjustmentType'] == '+') or (action.props['thermoAdjustmentType'] == '-'):
 			sp = 0
 		else:
 			sp = int(action.props['thermoSetPoint'])
 
+		# 095 for thermostat in question,
 		# then 096TC+000 to inc cool,
 		#      096Th-000 to dec heat
 		#      096Th=### to set setpoint
-		# wait for 563 response
-		#self.logger.debug('096%u%c%c%03u' % (sensorNum, action.props['thermoAdjustWhich'], action.props['thermoAdjustmentType'],sp) )
-		rx = self.sendPacket('096%u%c%c%03u' % (sensorNum, action.props['thermoAdjustWhich'], action.props['thermoAdjustmentType'], sp), waitFor='563')
-		if not rx:
-			self.logger.error("Error changing thermostat setpoints, aborting adjustment.")
-			return
+		# then 097T to save the setting
+		self.thermoSensor = sensorNum
+		self.thermoSteps = [
+			('095' + str(sensorNum), "Error getting current thermostat setpoints, aborting adjustment."),
+			('096%u%c%c%03u' % (sensorNum, action.props['thermoAdjustWhich'], action.props['thermoAdjustmentType'], sp), "Error changing thermostat setpoints, aborting adjustment."),
+			('097' + str(sensorNum), "Error saving thermostat setpoints, aborting adjustment."),
+		]
+		self.queueThermostatStep()
+
 
-		# send 097T
-		#send 097 for thermostat in question to save setting, wait for 563 response
-		rx = self.sendPacket('097' + str(sensorNum), waitFor='563')
-		if not rx:
-			self.logger.error("Error saving thermostat setpoints, aborting adjustment.")
+	def queueThermostatStep(self):
+		self.thermoDeadline = time.time() + kThermoStepTimeout
+		self.txCmdList.insert(0, (kCmdNormal, self.thermoSteps[0][0], 0, time.perf_counter()))
+
+
+	# Called with the sensor of every 563 received, moves the adjustment in progress
+	# on to its next step
+	#
+	def continueThermostatAdjustment(self, sensor):
+		if not self.thermoSteps or sensor != self.thermoSensor:
 			return
+		del self.thermoSteps[0]
+		if self.thermoSteps:
+			self.queueThermostatStep()
+		else:
+			self.thermoDeadline = 0
 
 
 	# Reset an Alarm Zone Group's timer to 0
@@ -682,10 +1016,14 @@ class Plugin(indigo.PluginBase):
 		if action.deviceId in indigo.devices:
 			zoneGrp = indigo.devices[action.deviceId]
 			self.logger.debug(f"Manual timer reset for alarm zone group \"{zoneGrp.name}\"")
-			zoneGrp.updateStateOnServer(key="AnyMemberLastChangedTimer", value=0)
-			zoneGrp.updateStateOnServer(key="EntireGroupLastChangedTimer", value=0)
-			zoneGrp.updateStateOnServer(key="AnyMemberLastChangedShort", value="0m")
-			zoneGrp.updateStateOnServer(key="EntireGroupLastChangedShort", value="0m")
+			zoneGrp.updateStatesOnServer([
+				{'key': 'AnyMemberLastChangedTimer', 'value': 0},
+				{'key': 'EntireGroupLastChangedTimer', 'value': 0},
+				{'key': 'AnyMemberLastChangedShort', 'value': "0m"},
+				{'key': 'EntireGroupLastChangedShort', 'value': "0m"}
+			])
+			self.startTimer(zoneGrp.id, 'AnyMemberLastChangedTimer')
+			self.startTimer(zoneGrp.id, 'EntireGroupLastChangedTimer')
 
 
 	######################################################################################
@@ -698,42 +1036,41 @@ class Plugin(indigo.PluginBase):
 	def validatePrefsConfigUi(self, valuesDict):
 		self.logger.debug("validating Prefs called")
 		errorMsgDict = indigo.Dict()
-		wasError = False
-
-		if valuesDict['configInterface'] == 'serial':
-			if not (valuesDict['serialPort']):
-				errorMsgDict['serialPort'] = "Select a valid serial port."
-				wasError = True
-		else:
-			if not (valuesDict['TwoDS_Address']):
-				errorMsgDict['TwoDS_Address'] = "Enter a valid IP address or host name."
-				wasError = True
-			if not (valuesDict['TwoDS_Port'].isdigit()):
-				errorMsgDict['TwoDS_Port'] = "Enter a valid port number, default 4025."
-				wasError = True
-			elif not 0 < int(float(valuesDict['TwoDS_Port'])) < 65536:
-				errorMsgDict['TwoDS_Port'] = "Enter a valid port number, default 4025."
-				wasError = True
-			if not (valuesDict['TwoDS_Password']):
-				errorMsgDict['TwoDS_Password'] = "Enter the password for the Envisalink."
-				wasError = True
+		wasError = self.validatePanelConfig(valuesDict, errorMsgDict)
 
-		if not (valuesDict['code'].isdigit()):
-			errorMsgDict['code'] = "The access code must numerical."
+		try:
+			if not 0 <= float(valuesDict.get('keybusPacing', kKeybusPacingDefault)) <= 10:
+				raise ValueError
+		except ValueError:
+			errorMsgDict['keybusPacing'] = "Enter a delay between 0 and 10 seconds, default 1.25."
 			wasError = True
-			
-		if not 3 < len(valuesDict['code']) < 7:
-			errorMsgDict['code'] = "The access code must be 4-6 digits."
+
+		try:
+			if not 10 <= int(valuesDict.get('reconnectMaxDelay', kReconnectMaxDelayDefault)) <= 3600:
+				raise ValueError
+		except ValueError:
+			errorMsgDict['reconnectMaxDelay'] = f"Enter a number of seconds between 10 and 3600, default {kReconnectMaxDelayDefault}."
 			wasError = True
 
-		if int(float(valuesDict['code'])) == 0:
-			errorMsgDict['code'] = "The access code cannot be 0000."
+		try:
+			if not 0 <= int(valuesDict.get('emailDigestWindow', kEmailDigestWindowDefault)) <= 3600:
+				raise ValueError
+		except ValueError:
+			errorMsgDict['emailDigestWindow'] = "Enter a number of seconds between 0 and 3600, default 60."
 			wasError = True
 
-		if not (valuesDict['code']):
-			errorMsgDict['code'] = "You must enter the alarm's arm/disarm code."
+		try:
+			if not 0 <= int(valuesDict.get('journalRetentionDays', kJournalRetentionDefault)) <= 3650:
+				raise ValueError
+		except ValueError:
+			errorMsgDict['journalRetentionDays'] = f"Enter a number of days between 0 and 3650, default {kJournalRetentionDefault}."
 			wasError = True
 
+		if valuesDict.get('metricsEnabled', False) is True:
+			if not valuesDict.get('metricsPort', '').isdigit() or not 0 < int(valuesDict['metricsPort']) < 65536:
+				errorMsgDict['metricsPort'] = f"Enter a valid port number, default {kMetricsPortDefault}."
+				wasError = True
+
 		if (valuesDict['emailUrgent']):
 			if not re.match(r"[^@]+@[^@]+\.[^@]+", valuesDict['emailUrgent']):
 				errorMsgDict['emailUrgent'] = "Please enter a valid email address."
@@ -782,6 +1119,48 @@ class Plugin(indigo.PluginBase):
 		# User choices look good, so return True (client will then close the dialog window).
 		return (True, valuesDict)
 
+	# Checks the interface and disarm code settings of the plugin config or of an Alarm
+	# Panel device. Returns True if there was an error.
+	#
+	def validatePanelConfig(self, valuesDict, errorMsgDict):
+		wasError = False
+
+		if valuesDict['configInterface'] == 'serial':
+			if not (valuesDict['serialPort']):
+				errorMsgDict['serialPort'] = "Select a valid serial port."
+				wasError = True
+		else:
+			if not (valuesDict['TwoDS_Address']):
+				errorMsgDict['TwoDS_Address'] = "Enter a valid IP address or host name."
+				wasError = True
+			if not (valuesDict['TwoDS_Port'].isdigit()):
+				errorMsgDict['TwoDS_Port'] = "Enter a valid port number, default 4025."
+				wasError = True
+			elif not 0 < int(float(valuesDict['TwoDS_Port'])) < 65536:
+				errorMsgDict['TwoDS_Port'] = "Enter a valid port number, default 4025."
+				wasError = True
+			if not (valuesDict['TwoDS_Password']):
+				errorMsgDict['TwoDS_Password'] = "Enter the password for the Envisalink."
+				wasError = True
+
+		if not (valuesDict['code'].isdigit()):
+			errorMsgDict['code'] = "The access code must numerical."
+			wasError = True
+
+		if not 3 < len(valuesDict['code']) < 7:
+			errorMsgDict['code'] = "The access code must be 4-6 digits."
+			wasError = True
+
+		if int(float(valuesDict['code'])) == 0:
+			errorMsgDict['code'] = "The access code cannot be 0000."
+			wasError = True
+
+		if not (valuesDict['code']):
+			errorMsgDict['code'] = "You must enter the alarm's arm/disarm code."
+			wasError = True
+
+		return wasError
+
 	def validateActionConfigUi(self, valuesDict, typeId, actionId):
 		self.logger.debug("validating Action Config called")
 		if typeId == 'actionSendKeypress':
@@ -813,27 +1192,45 @@ class Plugin(indigo.PluginBase):
 	def validateDeviceConfigUi(self, valuesDict, typeId, devId):
 		self.logger.debug("validating Device Config called")
 		#self.logger.debug(f"Type: {typeID}, Id: {eventID}, Dict: {valuesDict}")
+		if typeId == 'alarmPanel':
+			errorMsgDict = indigo.Dict()
+			if self.validatePanelConfig(valuesDict, errorMsgDict) is True:
+				return (False, valuesDict, errorMsgDict)
+		panel = self.getConfigPanel(valuesDict)
 		if typeId == 'alarmZone':
 			zoneNum = int(valuesDict['zoneNumber'])
-			if zoneNum in list(self.zoneList.keys()) and devId != indigo.devices[self.zoneList[zoneNum]].id:
+			if zoneNum in list(panel.zoneList.keys()) and devId != indigo.devices[panel.zoneList[zoneNum]].id:
 				#self.logger.debug("ZONEID: {self.DSC.zoneList[zone].id}")
 				errorMsgDict = indigo.Dict()
 				errorMsgDict['zoneNumber'] = "This zone has already been assigned to a different device."
 				return (False, valuesDict, errorMsgDict)
 		if typeId == 'alarmKeypad':
 			partitionNum = int(valuesDict['partitionNumber'])
-			if partitionNum in list(self.keypadList.keys()) and devId != indigo.devices[self.keypadList[partitionNum]].id:
+			if partitionNum in list(panel.keypadList.keys()) and devId != indigo.devices[panel.keypadList[partitionNum]].id:
 				errorMsgDict = indigo.Dict()
 				errorMsgDict['partitionNumber'] = "This partition has already been assigned to a different device."
 				return (False, valuesDict, errorMsgDict)
 		return (True, valuesDict)
 
+	# The panel selected in a device or action dialog
+	#
+	def getConfigPanel(self, valuesDict):
+		if not valuesDict or not valuesDict.get('panel'):
+			return self.defaultPanel
+		return self.getPanel(int(valuesDict['panel']))
+
+	# Called when a menu that other fields depend on changes, so their lists reload
+	#
+	def menuChanged(self, valuesDict, typeId="", devId=0):
+		return valuesDict
+
 	def getZoneList(self, filter="", valuesDict=None, typeId="", targetId=0):
 		myArray = []
+		zoneList = self.getConfigPanel(valuesDict).zoneList
 		for i in range(1, 65):
 			zoneName = str(i)
-			if i in list(self.zoneList.keys()):
-				zoneDev = indigo.devices[self.zoneList[i]]
+			if i in list(zoneList.keys()):
+				zoneDev = indigo.devices[zoneList[i]]
 				zoneName = f"{str(i)} - {zoneDev.name}"
 			myArray.append((str(i), zoneName))
 		return myArray
@@ -851,10 +1248,11 @@ class Plugin(indigo.PluginBase):
 
 	def getKeypadList(self, filter="", valuesDict=None, typeId="", targetId=0):
 		myArray = []
+		keypadList = self.getConfigPanel(valuesDict).keypadList
 		for i in range(1, 9):
 			keypadName = str(i)
-			if i in list(self.keypadList.keys()):
-				keypDev = indigo.devices[self.keypadList[i]]
+			if i in list(keypadList.keys()):
+				keypDev = indigo.devices[keypadList[i]]
 				keypadName = str(keypDev.pluginProps['partitionName'])
 				keypadName = f"{str(i)} - {keypadName}"
 			myArray.append((str(i), keypadName))
@@ -897,13 +1295,14 @@ class Plugin(indigo.PluginBase):
 			if valuesDict.get('variableFolder') not in indigo.variables.folders:
 				self.createVariables = False
 
-			self.useSerial = False
-			if valuesDict.get('configInterface', 'twods') == 'serial':
-				# using older serial port interface IT-100 or similar
-				self.useSerial = True
+			self.configurePanelInterface(self.defaultPanel, valuesDict)
 
 			self.configKeepTimeSynced = valuesDict.get('syncTime', True)
+			self.configKeybusPacing = float(valuesDict.get('keybusPacing', kKeybusPacingDefault))
 			self.configUseCustomIcons = valuesDict.get('customStateIcons', True)
+			self.configLazyTimers = valuesDict.get('lazyTimerStates', False)
+			self.configReconnectMaxDelay = int(valuesDict.get('reconnectMaxDelay', kReconnectMaxDelayDefault))
+			self.watchedTimersNext = 0
 
 			self.configSpeakVariable = None
 			if 'speakToVariableEnabled' in valuesDict:
@@ -919,11 +1318,15 @@ class Plugin(indigo.PluginBase):
 			self.configEmailUrgentSubject = valuesDict.get('emailUrgentSubject', 'Alarm Tripped')
 			self.configEmailNoticeSubject = valuesDict.get('emailNoticeSubject', 'Alarm Trouble')
 			self.configEmailDisarmSubject = valuesDict.get('DisarmEmailSubject', 'Who Disarmed')
+			self.configEmailDigestWindow = int(valuesDict.get('emailDigestWindow', kEmailDigestWindowDefault))
 
 			self.userCodeList = valuesDict.get('userCode', '').split(",")
 			self.userLabelList = valuesDict.get('userLabel', '').split(",")
 			self.userLabelDict = dict(list(zip(self.userCodeList, self.userLabelList)))
 
+			self.configureMetricsServer(valuesDict)
+			self.configureJournal(valuesDict)
+
 			self.logger.debug("Configuration read successfully")
 
 			return True
@@ -938,14 +1341,8 @@ class Plugin(indigo.PluginBase):
 	# Communication Routines
 	######################################################################################
 
-	def calcChecksum(self, s):
-		calcSum = 0
-		for c in s:
-			calcSum += ord(c)
-		calcSum %= 256
-		return calcSum
-
 	def closePort(self):
+		self.rxBuffer.clear()
 		if self.port is None:
 			return
 		if self.port.isOpen() is True:
@@ -954,25 +1351,30 @@ class Plugin(indigo.PluginBase):
 
 	def openPort(self):
 		self.closePort()
+		prefs = self.panelPrefs
 		if self.useSerial is False:
 			#adr = self.pluginPrefs['TwoDS_Address'] + ':4025'
-			adr = f"{self.pluginPrefs['TwoDS_Address']}:{int(float(self.pluginPrefs['TwoDS_Port']))}"
+			adr = f"{prefs['TwoDS_Address']}:{int(float(prefs['TwoDS_Port']))}"
 			self.logger.info(f"Initializing communication at address: {adr}")
 			try:
-				self.port = serial.serial_for_url('socket://' + adr, baudrate=115200)
+				if self.useAsyncTransport is True:
+					self.port = AsyncSocketPort(prefs['TwoDS_Address'], int(float(prefs['TwoDS_Port'])))
+				else:
+					self.port = serial.serial_for_url('socket://' + adr, baudrate=115200)
 			except Exception as err:
 				self.logger.error(f"Error opening socket: {str(err)}")
 				return False
 		else:
-			self.logger.info(f"Initializing communication on port {self.pluginPrefs['serialPort']}")
+			self.logger.info(f"Initializing communication on port {prefs['serialPort']}")
 			try:
-				self.port = serial.Serial(self.pluginPrefs['serialPort'], 9600, writeTimeout=1)
+				self.port = serial.Serial(prefs['serialPort'], 9600, writeTimeout=1)
 			except Exception as err:
 				self.logger.error(f"Error opening serial port: {str(err)}")
 				return False
 
 		if self.port.isOpen() is True:
 			self.port.flushInput()
+			self.rxBuffer.clear()
 			self.port.timeout = 1
 			self.logger.info("Communication established")
 			return True
@@ -980,14 +1382,23 @@ class Plugin(indigo.PluginBase):
 		return False
 
 
+	# Returns the next received frame. Everything the port has received is read at
+	# once into rxBuffer, so the frames of a burst after the first are returned
+	# without reading the port again.
+	#
 	def readPort(self):
+		rxBuffer = self.rxBuffer
+		if rxBuffer.frames:
+			return rxBuffer.frames.popleft()
+
 		if self.port.isOpen() is False:
 			self.state = self.States.BOTH_INIT
 			return ""
 
 		data = ""
 		try:
-			data = self.port.readline()
+			if rxBuffer.feed(readAvailable(self.port)):
+				data = rxBuffer.frames.popleft()
 		except Exception as err:
 			self.logger.error(f"Connection RX Error: {str(err)}")
 			data = '-'.encode('utf-8')   #encode in bytes to be compatible with how data are received from serial port
@@ -997,16 +1408,21 @@ class Plugin(indigo.PluginBase):
 		return data
 
 
+	def setRxTimeout(self, timeout):
+		if self.port is not None and self.port.timeout != timeout:
+			self.port.timeout = timeout
+
+
 	def writePort(self, data):
 		self.port.write(data)
 
 
 	def sendPacketOnly(self, data):
-		pkt = "{}{:02X}\r\n".format(data, self.calcChecksum(data))
-		self.logger.threaddebug(f"TX: {pkt}")
+		pkt = encodeFrame(data)
+		self.logger.threaddebug(f"TX: {pkt.decode('ascii')}")
 		try:
 			#All data is send as two-digit hex ASCII codes.
-			self.writePort(pkt.encode("utf-8"))
+			self.writePort(pkt)
 		except Exception as err:
 			self.logger.error(f"Connection TX Error: {str(err)}")
 			exit()
@@ -1021,6 +1437,7 @@ class Plugin(indigo.PluginBase):
 
 		while txRetries > 0:
 			self.sendPacketOnly(tx)
+			sentTime = time.perf_counter()
 			ourTimeout = time.time() + rxTimeout
 			txRetries -= 1
 			while time.time() < ourTimeout:
@@ -1040,8 +1457,10 @@ class Plugin(indigo.PluginBase):
 				if rxCmd:
 					if waitFor == '500':
 						if (rxCmd == '500') and (rxData == txCmd):
+							self.recordAck(txCmd, time.perf_counter() - sentTime)
 							return rxData
 					elif rxCmd == waitFor:
+						self.recordAck(txCmd, time.perf_counter() - sentTime)
 						return rxData
 			if txCmd != '000':
 				self.logger.error(f"Timed out after waiting for response to command {tx} for {rxTimeout} seconds, retrying.")
@@ -1049,753 +1468,1357 @@ class Plugin(indigo.PluginBase):
 		return ''
 
 
-	def readPacket(self):
+	######################################################################################
+	# Reconnect Policy
+	######################################################################################
 
-		data = self.readPort()
-		data = data.decode("utf-8")
-		if not data:
-			return ('', '')
-		elif data == '-':
-			self.logger.debug("Socket has closed")
-			# socket has closed, return with signal to re-initialize
-			return ('-', '')
+	def getReconnectDelay(self, attempt):
+		if attempt <= kReconnectFastRetries:
+			return kReconnectFastDelay
+		retryDelay = min(kReconnectBaseDelay * 2 ** (attempt - kReconnectFastRetries - 1), self.configReconnectMaxDelay)
+		return retryDelay * random.uniform(1 - kReconnectJitter, 1 + kReconnectJitter)
 
-		data = data.strip()
 
-		m = re.search(r'^(...)(.*)(..)$', data)
-		if not m:
-			return ('', '')
+	def connectionLost(self):
+		if self.connectedSince:
+			upTime = int(time.time() - self.connectedSince)
+			self.logger.info(f"Connection to {self.currentPanel().name} lost after {upTime // 3600}h {upTime // 60 % 60}m {upTime % 60}s.")
+		self.connectedSince = 0
+		self.requeueTxInFlight()
+		self.updatePanelDevice(False)
 
-		# This try block catches exceptions when non-ascii characters were received. 
-		# Not sure why they are being received.
+
+	# Queued thermostat commands hold the action, not a command string, so only normal
+	# entries can be a ping
+	#
+	def isPingPending(self):
+		return any(entry[0][:3] == '000' for entry in self.txInFlight) or \
+			any(cmdType == kCmdNormal and data[:3] == '000' for (cmdType, data, gap, queuedTime) in self.txCmdList)
+
+
+	######################################################################################
+	# Alarm Panels
+	######################################################################################
+
+	# Returns the panel the calling thread is working for. Indigo's callbacks work for
+	# the panel in the plugin config unless they select another one with usePanel.
+	#
+	def currentPanel(self):
+		return self.panelContext.panel
+
+
+	@contextlib.contextmanager
+	def usePanel(self, panel):
+		previous = self.panelContext.panel
+		self.panelContext.panel = panel
 		try:
-			self.logger.threaddebug(f"RX: {data}")
-			(cmd, dat, sum) = (m.group(1), m.group(2), int(m.group(3), 16))
-		except:
-			self.logger.error("IT-100/Envisalink Error: Received a response with invalid characters")
-			return ('', '')
+			yield panel
+		finally:
+			self.panelContext.panel = previous
 
-		if sum != self.calcChecksum("".join([cmd, dat])):
-			self.logger.error("Checksum did not match on a received packet.")
-			return ('', '')
 
-		##################################################################################
-		# Parse responses based on cmd value received from panel
-		##################################################################################
+	# The connection settings of the current panel: the plugin config, or the props of
+	# its Alarm Panel device.
+	#
+	@property
+	def panelPrefs(self):
+		panel = self.currentPanel()
+		if panel.prefs is None:
+			return self.pluginPrefs
+		return panel.prefs
 
-		if cmd == '500':
-			self.logger.threaddebug(f"ACK for cmd {dat}.")
-			self.cmdAck = dat
-
-		elif cmd == '501':
-			self.logger.error("IT-100/Envisalink Error: Received a command with a bad checksum")
-
-		elif cmd == '502':
-			errText = 'Unknown'
-
-			if dat == '001':
-				errText = 'Receive Buffer Overrun (a command is received while another is still being processed)'
-			elif dat == '002':
-				errText = 'Receive Buffer Overflow'
-			elif dat == '003':
-				errText = 'Transmit Buffer Overflow'
-
-			elif dat == '010':
-				errText = 'Keybus Transmit Buffer Overrun'
-			elif dat == '011':
-				errText = 'Keybus Transmit Time Timeout'
-			elif dat == '012':
-				errText = 'Keybus Transmit Mode Timeout'
-			elif dat == '013':
-				errText = 'Keybus Transmit Keystring Timeout'
-				# this error is sometimes received after disarming a tripped partition with TPI disarm command 040
-			elif dat == '014':
-				errText = 'Keybus Interface Not Functioning (the TPI cannot communicate with the security system)'
-			elif dat == '015':
-				errText = 'Keybus Busy (Attempting to Disarm or Arm with user code)'
-			elif dat == '016':
-				errText = 'Keybus Busy – Lockout (The panel is currently in Keypad Lockout – too many disarm attempts)'
-			elif dat == '017':
-				errText = 'Keybus Busy – Installers Mode (Panel is in installers mode, most functions are unavailable)'
-			elif dat == '018':
-				errText = 'Keybus Busy – General Busy (The requested partition is busy)'
-
-			elif dat == '020':
-				errText = 'API Command Syntax Error'
-			elif dat == '021':
-				errText = 'API Command Partition Error (Requested Partition is out of bounds)'
-			elif dat == '022':
-				errText = 'API Command Not Supported'
-			elif dat == '023':
-				errText = 'API System Not Armed (sent in response to a disarm command)'
-			elif dat == '024':
-				errText = 'API System Not Ready to Arm (not secure, in delay, or already armed)'
-				self.triggerEvent('eventFailToArm')
-				self.speak('speakTextFailedToArm')
-			elif dat == '025':
-				errText = 'API Command Invalid Length'
-			elif dat == '026':
-				errText = 'API User Code not Required'
-			elif dat == '027':
-				errText = 'API Invalid Characters in Command'
-
-			if dat in {'023', '024'}:
-				self.logger.warning(f"IT-100/Envisalink Warning ({dat}): {errText}")
-			else:
-				self.logger.error(f"IT-100/Envisalink Error ({dat}): {errText}")
 
-		elif cmd == '505':
-			if dat == '3':
-				self.logger.debug("Received login request")
+	# Panels are created by whichever Indigo starts first, the Alarm Panel device or
+	# a zone, keypad or thermostat that belongs to it. Panel 0 is the plugin config.
+	#
+	def getPanel(self, panelId):
+		panel = self.panels.get(panelId)
+		if panel is None:
+			panel = self.panels[panelId] = Panel(panelId, f"Alarm Panel {panelId}", self.States.STARTUP, {})
+			with self.usePanel(panel):
+				self.loadSnapshot()
+		return panel
 
-		elif cmd == '510':
-			# Keypad LED State Updates for Partition 1 only
-			leds = int(dat, 16)
 
-			if leds & 1 > 0:
-				self.updateKeypad(1, 'LEDReady', 'on')
-			else:
-				self.updateKeypad(1, 'LEDReady', 'off')
+	# The panel in the plugin config and the panels of running Alarm Panel devices
+	#
+	def getActivePanels(self):
+		return [panel for panel in list(self.panels.values()) if panel is self.defaultPanel or panel.thread is not None]
 
-			if leds & 2 > 0:
-				self.updateKeypad(1, 'LEDArmed', 'on')
-			else:
-				self.updateKeypad(1, 'LEDArmed', 'off')
 
-			if leds & 16 > 0:
-				self.updateKeypad(1, 'LEDTrouble', 'on')
-			else:
-				self.updateKeypad(1, 'LEDTrouble', 'off')
+	def getDevicePanel(self, dev):
+		return self.getPanel(int(dev.pluginProps.get('panel') or 0))
 
-			if leds & 4 > 0:
-				self.updateKeypad(1, 'LEDMemory', 'on')
-			else:
-				self.updateKeypad(1, 'LEDMemory', 'off')
 
-			if leds & 8 > 0:
-				self.updateKeypad(1, 'LEDBypass', 'on')
-			else:
-				self.updateKeypad(1, 'LEDBypass', 'off')
+	def configurePanelInterface(self, panel, valuesDict):
+		# using older serial port interface IT-100 or similar
+		panel.useSerial = valuesDict.get('configInterface', 'twods') == 'serial'
+		# The asyncio stream reader is only available for the Envisalink socket
+		panel.useAsyncTransport = panel.useSerial is False and valuesDict.get('configTransport', 'pyserial') == 'asyncio'
 
-		elif cmd == '511':
-			# Keypad LED Flashing State Update
-			# Same as 510 above but means an LED is flashing
-			# We don't use this right now
-			pass
 
-		elif cmd == '550':
-			# This command is send by DSC panel every 4 min
-			m = re.search(r'^(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)$', dat)
-			if m:
-				tHour = m.group(1).zfill(2)   #padding str objects to two digits
-				tMin = m.group(2).zfill(2)
-				dMonth = m.group(3).zfill(2)
-				dMonthDay = m.group(4).zfill(2)
-				dYear = m.group(5)
-				self.logger.debug(f"Received alarm panel time and date {tHour}:{tMin} {dMonth}-{dMonthDay}-{dYear}")
-
-				if self.configKeepTimeSynced is True:
-					# Is it around 3 am and the time has not recently been synced?
-					d = datetime.now()
-					if self.timesyncflag is True and (d.hour == 3) and (d.minute in range(0, 6)):
-						self.logger.debug("Syncing alarm panel time and date.")
-						self.txCmdList.append((kCmdNormal, f"010{d.strftime('%H%M%m%d%y')}"))
-						self.timesyncflag = False
-					else:
-						self.timesyncflag = True
-						self.logger.debug("No time sync necessary.")
+	def startPanel(self, dev):
+		panel = self.getPanel(dev.id)
+		self.stopPanel(panel)
+		panel.name = dev.name
+		panel.prefs = dev.pluginProps
+		self.configurePanelInterface(panel, panel.prefs)
+		panel.state = self.States.STARTUP
+		panel.stopping = False
+		if 'alarmState' not in dev.states:
+			dev.stateListOrDisplayStateIdChanged()
+		dev.updateStateOnServer(key='state', value=kPanelStateDisconnected)
+		self.mirrorDevice(indigo.devices[dev.id])
+		panel.thread = threading.Thread(target=self.runPanelThread, args=(panel,), name=f"DSC {dev.name}", daemon=True)
+		panel.thread.start()
 
-				# If this is a 2DS/Envisalink interface then lets insert the time in the virtual keypad 
-				# Time is updated only every 4 minutes, so not very useful to use
-				if self.useSerial is False:
-					tAmPm = 'a'
-					tHour = int(tHour)
-					if tHour >= 12:
-						tAmPm = 'p'
-
-					if tHour > 12:
-						tHour -= 12
-					elif tHour == 0:
-						tHour = 12
-					str(tHour).zfill(2)
-					self.updateKeypad(0, 'LCDLine1', '  Date     Time ')
-					self.updateKeypad(0, 'LCDLine2', f"{kMonthList[int(dMonth)-1]} {dMonthDay}/{dYear} {tHour}:{tMin}{tAmPm}")
-					self.logger.debug(f"{kMonthList[int(dMonth)-1]} {dMonthDay}/{dYear} {tHour}:{tMin}{tAmPm}")
-
-		elif cmd == '560':
-			self.logger.info("Telephone Ring Tone Has Been Detected.")
-			for trig in self.triggerList:
-				trigger = indigo.triggers[trig]
-				if trigger.pluginTypeId == 'eventNoticeTelephone_Ring':
-					indigo.trigger.execute(trigger.id)
-
-		elif cmd == '561' or cmd == '562':
-			m = re.search(r'^(.)(...)$', dat)
-			if m:
-				(sensor, temp) = (int(m.group(1)), int(m.group(2)))
-				if cmd == '562':
-					self.updateSensorTemp(sensor, 'outside', temp)
-				else:
-					self.updateSensorTemp(sensor, 'inside', temp)
 
-		elif cmd == '563':
-			m = re.search(r'^(.)(...)(...)$', dat)
-			if m:
-				(sensor, cool, heat) = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
-				self.updateSensorTemp(sensor, 'cool', cool)
-				self.updateSensorTemp(sensor, 'heat', heat)
+	def stopPanel(self, panel):
+		if panel.thread is None:
+			return
+		panel.stopping = True
+		panel.thread.join(kPanelStopTimeout)
+		panel.thread = None
 
-		elif cmd == '601':
-			# a zone goes into alarm/is tripped
-			m = re.search(r'^(.)(...)$', dat)
-			if m:
-				(partition, zone) = (int(m.group(1)), int(m.group(2)))
-				self.updateZoneState(zone, kZoneStateTripped)
-				if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is True:
-					dev = indigo.devices[self.zoneList[zone]]
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)
-
-				if not (self.trippedZoneList):
-					if "DSC_Alarm_Memory" in indigo.variables:
-						indigo.variable.updateValue("DSC_Alarm_Memory", value="")
-				if zone not in self.trippedZoneList:
-					self.trippedZoneList.append(zone)
-					self.sendZoneTrippedEmail()
-					indigoVar = ""
-					for zoneNum in self.trippedZoneList:
-						zone = indigo.devices[self.zoneList[zoneNum]]
-						indigoVar += (zone.name + "; ")
-					if "DSC_Alarm_Memory" in indigo.variables:
-						indigo.variable.updateValue("DSC_Alarm_Memory", indigoVar)
-					self.triggerEvent('eventZoneTripped')
-
-		elif cmd == '602':
-			m = re.search(r'^(.)(...)$', dat)
-			if m:
-				(partition, zone) = (int(m.group(1)), int(m.group(2)))
-				dev = indigo.devices[self.keypadList[partition]]
-				zonedev = indigo.devices[self.zoneList[zone]]
-				keyp = str(dev.pluginProps['partitionName'])
-				self.logger.info(f"Zone '{zonedev.name}' Restored. (Partition {partition} '{keyp}')")
 
-		elif cmd == '603':
-			m = re.search(r'^(.)(...)$', dat)
-			if m:
-				(partition, zone) = (int(m.group(1)), int(m.group(2)))
-				self.logger.debug(f"Zone Number {zone} Has a Tamper Condition.")
+	# Runs the state machine of an Alarm Panel device until the device or the plugin
+	# is stopped.
+	#
+	def runPanelThread(self, panel):
+		with self.usePanel(panel):
+			self.logger.debug(f"Starting the connection to {panel.name}")
+			try:
+				while self.shutdown is False and panel.stopping is False:
+					self.timeNow = time.time()
+					self.runStateMachine()
+					self.runPanelTimers()
+			except self.StopThread:
+				pass
+			finally:
+				if self.state == self.States.BOTH_POLL:
+					self.saveSnapshot()
+				self.closePort()
+				self.updatePanelDevice(False)
+			self.logger.debug(f"Stopped the connection to {panel.name}")
 
-		elif cmd == '604':
-			m = re.search(r'^(.)(...)$', dat)
-			if m:
-				(partition, zone) = (int(m.group(1)), int(m.group(2)))
-				self.logger.debug(f"Zone Number {zone} Tamper Condition has been Restored.")
-
-		elif cmd == '605':
-			zone = int(dat)
-			self.logger.debug(f"Zone Number {zone} Has a Fault Condition.".format(zone))
-
-		elif cmd == '606':
-			zone = int(dat)
-			self.logger.debug(f"Zone Number {zone} Fault Condition has been Restored.".format(zone))
-
-		elif cmd == '609':
-			zone = int(dat)
-			self.logger.debug(f"Zone Number {zone} Open.".format(zone))
-			self.updateZoneState(zone, kZoneStateOpen)
-			if self.repeatAlarmTripped is True:
-				if zone in self.closeTheseZonesList:
-					self.closeTheseZonesList.remove(zone)
-
-			# Custom state image icons are shown in Indigo Touch and Indigo Client UI if selected in Config Prefs.
-			# Not all icons are working yet in Indigo. Feel free to change icons to your liking.
-			if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is True:
-				self.logger.debug("We are using custom state icons.")
-				dev = indigo.devices[self.zoneList[zone]]
-				zoneType = dev.pluginProps['zoneType']
-				if zoneType == "zoneTypeMotion":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensorTripped)
-				elif zoneType == "zoneTypeDoor":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.DoorSensorOpened)
-				elif zoneType == "zoneTypeWindow":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.WindowSensorOpened)
-				elif zoneType == "zoneTypeFire":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.HvacHeating)
-				elif zoneType == "zoneTypeWater":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SprinklerOn)
-				elif zoneType == "zoneTypeGas":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.HvacFanOn)
-				elif zoneType == "zoneTypeGlass":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
-				elif zoneType == "zoneTypeShock":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
-				elif zoneType == "zoneTypeCO":
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
-				else:
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
 
-			# This refreshes image icons after unchecking the custom settings in Config window
-			if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is False:
-				dev = indigo.devices[self.zoneList[zone]]
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+	def updatePanelDevice(self, connected):
+		devId = self.currentPanel().devId
+		if devId in self.stateMirror:
+			self.bufferState(devId, 'state', kPanelStateConnected if connected else kPanelStateDisconnected)
+			self.flushStates()
 
-		elif cmd == '610':
-			zone = int(dat)
-			self.logger.debug(f"Zone Number {zone} Closed.")
-			# Update the zone to closed ONLY if the alarm is not tripped. We want the 
-			# tripped states to be preserved so someone looking at their control page will 
-			# see all the zones that have been opened since the break in.
-			if self.repeatAlarmTripped is False:
-				self.updateZoneState(zone, kZoneStateClosed)
-				if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is True:
-					dev = indigo.devices[self.zoneList[zone]]
-					zoneType = dev.pluginProps['zoneType']
-					if zoneType == "zoneTypeMotion":
-						dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
-					else:
-						dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
 
-				# This refreshes image icons after unchecking the custom settings in Config window
-				if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is False:
-					dev = indigo.devices[self.zoneList[zone]]
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+	# Alarm Panel menu for device and action dialogs
+	#
+	def getPanelList(self, filter="", valuesDict=None, typeId="", targetId=0):
+		myArray = [("0", "Plugin Configuration")]
+		for dev in indigo.devices.iter("self.alarmPanel"):
+			myArray.append((str(dev.id), dev.name))
+		return myArray
 
+
+	######################################################################################
+	# Pipelined Command Queue
+	######################################################################################
+
+	# Queues a command for the send scheduler in runConcurrentThread and returns
+	# immediately. gap is the minimum time in seconds between sending the previous
+	# command and this one. Entries are (cmdType, data, gap, queuedTime).
+	#
+	def queueCommand(self, data, cmdType=kCmdNormal, gap=0):
+		self.txCmdList.append((cmdType, data, gap, time.perf_counter()))
+		if self.useAsyncTransport is True and self.port is not None:
+			# wake the poll loop so the command goes out without waiting for a read timeout
+			self.port.cancel_read()
+
+
+	# Sends queued commands without waiting for each ACK. Every sent command is kept in
+	# txInFlight as [tx, sentTime, retriesLeft, gap] until rxCommandAck matches its 500
+	# reply. The gap is kept so a requeued command is still paced.
+	# Commands go out in queue order; the window is limited to kTxMaxInFlight commands,
+	# or to a single command while the Keybus needs serialization after an overrun.
+	#
+	def dispatchTxQueue(self):
+		while self.txCmdList:
+			(cmdType, data, gap, queuedTime) = self.txCmdList[0]
+
+			# A paced command waits until everything sent before it has been
+			# acknowledged and its gap after the previous send has elapsed.
+			if gap > 0 and (self.txInFlight or time.time() < self.txLastSendTime + gap):
+				return
+
+			if cmdType == kCmdThermoSet:
+				# Thermostat adjustments are a request/response sequence of their own,
+				# so let everything in flight be acknowledged, and any adjustment in
+				# progress finish, before starting it.
+				if self.txInFlight or self.thermoSteps:
+					return
+				del self.txCmdList[0]
+				self.latencyStats.record('queue', 'thermo', time.perf_counter() - queuedTime)
+				self.setThermostat(data)
+				continue
+
+			if time.time() < self.txSerializeUntil:
+				maxInFlight = 1
 			else:
-				self.closeTheseZonesList.append(zone)
-
-		elif cmd == '616':
-			# cmd is sent after a zone is bypassed or bypass is cancelled.
-			# This dump can be forced with keypress command [1*1#] if partition is not armed. 
-			# If partition is armed, it will switch armed state from stay to away and vice versa.
-			# Routine that identifies bypassed zones and updates zone status kZoneBypassNo 
-			# or kZoneBypassYes via newState (unfortunately for partition 1 only).
-			BypassHexDump = str(dat)       #this is the 16-digit hex string for bypassed zones. Partition 1 only!
-			self.logger.debug(f"Bypass Hex Dump ({BypassHexDump})")
-			BBDump = format(int(BypassHexDump, 16), '0>64b')
-			BypassBinaryDump = "".join(["".join([m[i:i+1] for i in range(8-1, -1, -1)]) for m in [BBDump[i:i+8] for i in range(0, len(BBDump), 8)]])
-			# reordered in 8 bit words to get zones in 1-64 order
-			self.logger.debug(f"Bypass Binary Dump ({BypassBinaryDump})")
-			for i in range(64):
-				if BypassBinaryDump[i-1] == '1':
-					self.updateZoneBypass(i, kZoneBypassYes)
-				elif BypassBinaryDump[i-1] == '0':
-					self.updateZoneBypass(i, kZoneBypassNo)
-
-		elif cmd == '620':
-			self.logger.warning("Duress Alarm Detected")
-			self.sendDuressEmail("Duress Alarm Detected")
-			# This updates all keypads (partitions)
-			self.updateKeypad(0, 'PanicState', kPanicStateDuress)
-
-		elif cmd == '621':
-			self.logger.warning("Fire Key Alarm Detected")
-			self.sendPanicEmail("Fire Key Alarm Detected")
-			# This updates all keypads (partitions)
-			self.updateKeypad(0, 'PanicState', kPanicStateFire)
-
-		elif cmd == '622':
-			self.logger.info("Fire Key Alarm Restored")
-			# This updates all keypads (partitions). Partitions that were Armed will stay Armed. 
-			# Partitions that are "Ready for arming" will show up as Disarmed via cmd 650. 
-			# Otherwise they will show up as Tripped until they become "Ready", e.g. all open windows are closed.
-			self.updateKeypad(0, 'PanicState', kPanicStateNone)
-			
-			# After the fire alarm has been disarmed while it was tripped, update any zone states
-			# that were closed during the fire alarm.  We don't update them during the event
-			# so that Indigo's zone states will represent a zone as tripped during the entire event.
-			if self.repeatAlarmTripped is True:
-				self.repeatAlarmTripped = False
-				for zone in self.closeTheseZonesList:
-					self.updateZoneState(zone, kZoneStateClosed)
-					if self.configUseCustomIcons is True:
-						dev = indigo.devices[self.zoneList[zone]]
-						zoneType = dev.pluginProps['zoneType']
-						if zoneType == "zoneTypeMotion":
-							dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
-						else:
-							dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
-
-				self.closeTheseZonesList = []
-
-		elif cmd == '623':
-			self.logger.warning("Auxiliary/Medical Key Alarm Detected")
-			self.sendPanicEmail("Ambulance/Medical Key Alarm Detected")
-			# This updates all keypads (partitions)
-			self.updateKeypad(0, 'PanicState', kPanicStateAmbulance)
-
-		elif cmd == '624':
-			self.logger.info("Auxiliary/Medical Key Alarm Restored")
-			# This updates all keypads (partitions)
-			self.updateKeypad(0, 'PanicState', kPanicStateNone)
+				maxInFlight = kTxMaxInFlight
+			if len(self.txInFlight) >= maxInFlight:
+				return
 
-		elif cmd == '625':
-			self.logger.warning("Panic/Police Key Alarm Detected")
-			self.sendPanicEmail("Panic/Police Key Alarm Detected")
-			# This updates all keypads (partitions)
-			self.updateKeypad(0, 'PanicState', kPanicStatePanic)
-
-		elif cmd == '626':
-			self.logger.info("Panic/Police Key Alarm Restored")
-			# This updates all keypads (partitions). Partitions that were Armed will stay Armed. 
-			# Partitions that are "Ready for arming" will show up as Disarmed via cmd 650. 
-			# Otherwise they will show up as Tripped until they become "Ready", e.g. all open windows are closed.
-			self.updateKeypad(0, 'PanicState', kPanicStateNone)
+			del self.txCmdList[0]
+			self.latencyStats.record('queue', data[:3], time.perf_counter() - queuedTime)
+			self.sendPacketOnly(data)
+			self.txLastSendTime = time.time()
+			self.txInFlight.append([data, self.txLastSendTime, kTxRetries - 1, gap])
 
-			# After the panic alarm has been disarmed while it was tripped, update any zone states
-			# that were closed during the panic alarm.  We don't update them during the event
-			# so that Indigo's zone states will represent a zone as tripped during the entire event.
-			if self.repeatAlarmTripped is True:
-				self.repeatAlarmTripped = False
-				for zone in self.closeTheseZonesList:
-					self.updateZoneState(zone, kZoneStateClosed)
-					if self.configUseCustomIcons is True:
-						dev = indigo.devices[self.zoneList[zone]]
-						zoneType = dev.pluginProps['zoneType']
-						if zoneType == "zoneTypeMotion":
-							dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
-						else:
-							dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
-
-				self.closeTheseZonesList = []
-				
-		elif cmd == '631':
-			self.logger.warning("Auxiliary/Smoke Input Alarm Detected")
-			self.updateKeypad(0, 'PanicState', kPanicStateSmoke)
 
-		elif cmd == '632':
-			self.logger.info("Auxiliary/Smoke Input Alarm Restored")
-			# This updates all keypads (partitions)
-			self.updateKeypad(0, 'PanicState', kPanicStateNone)
+	# Returns how long the poll loop may block reading the port before the send
+	# scheduler needs to run again.
+	#
+	def getRxPollTimeout(self):
+		if not self.txCmdList:
+			return kRxPollTimeout
+		gap = self.txCmdList[0][2]
+		if gap <= 0 or self.txInFlight:
+			# waiting for an ACK, which wakes the reader anyway
+			return kRxPollTimeout
+		waitTime = self.txLastSendTime + gap - time.time()
+		return min(kRxPollTimeout, max(kRxMinPollTimeout, waitTime))
+
+
+	# Removes and returns the oldest in-flight entry for command code txCmd, or the
+	# oldest in-flight entry of any code if txCmd is None.
+	#
+	def popTxInFlight(self, txCmd=None):
+		for entry in self.txInFlight:
+			if txCmd is None or entry[0][:3] == txCmd:
+				self.txInFlight.remove(entry)
+				return entry
+		return None
 
-		elif cmd == '650':
-			# This reports "Ready" state only for keypads i.e. partitions that are ready to arm.
-			self.logger.debug(f"Partition {int(dat)} Ready")
-			partition = int(dat)
-			self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
-			self.updateKeypad(partition, 'LEDReady', 'on')
-			self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
 
-		elif cmd == '651':
-			self.logger.debug(f"Partition {int(dat)} Not Ready")
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
-			self.updateKeypad(partition, 'LEDReady', 'off')
-			if self.configUseCustomIcons is True:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
-				#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
+	# Resends or drops in-flight commands that have not been acknowledged in time.
+	# Returns True if a 000 ping was dropped, i.e. the connection is half-open.
+	#
+	def checkTxTimeouts(self):
+		pingLost = False
+		timeNow = time.time()
+		for entry in list(self.txInFlight):
+			(tx, sentTime, retriesLeft, gap) = entry
+			if timeNow - sentTime < kTxAckTimeout:
+				continue
+			if tx[:3] in kTxNoResendCmds:
+				# the panel may have run it and only the ACK was lost
+				self.logger.error(f"Timed out after waiting for response to command {tx} for {kTxAckTimeout} seconds, not resending it.")
+				self.txInFlight.remove(entry)
+			elif retriesLeft > 0:
+				if tx[:3] != '000':
+					self.logger.error(f"Timed out after waiting for response to command {tx} for {kTxAckTimeout} seconds, retrying.")
+				entry[1] = timeNow
+				entry[2] = retriesLeft - 1
+				self.sendPacketOnly(tx)
 			else:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+				self.logger.error(f"Resent command {tx} {kTxRetries} times with no success, aborting.")
+				self.txInFlight.remove(entry)
+				if tx[:3] == '000':
+					pingLost = True
+		return pingLost
 
-		elif cmd == '652':
-			if len(dat) == 1:
-				partition = int(dat)
-				dev = indigo.devices[self.keypadList[partition]]
-				keyp = str(dev.pluginProps['partitionName'])
-				self.logger.debug(f"Alarm Panel Armed. (Partition {partition} '{keyp}')")
-				self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
-				self.updateKeypad(partition, 'LEDReady', 'off')
-				self.updateKeypad(partition, 'LEDArmed', 'on')	  # updates LEDs for partitions 1-8
-				self.speak('speakTextArmed')
-				self.trippedZoneList = []
-				if self.configUseCustomIcons is True:
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
-					#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
+
+	# Puts unacknowledged commands back at the front of the queue, with their pacing
+	# gaps, e.g. after the socket closed, so they are sent again once communication is
+	# re-established. Keystrings the panel may already have run are dropped.
+	#
+	def requeueTxInFlight(self):
+		timeNow = time.perf_counter()
+		requeued = []
+		for (tx, sentTime, retriesLeft, gap) in self.txInFlight:
+			if tx[:3] in kTxNoResendCmds:
+				self.logger.error(f"Dropped unacknowledged command {tx}, it is not safe to send again.")
+			else:
+				requeued.append((kCmdNormal, tx, gap, timeNow))
+		self.txCmdList[0:0] = requeued
+		self.txInFlight = []
+
+
+	# Times every received packet through readPacket's stages into latencyStats:
+	# read (socket receive to readPort, when the transport records receive times),
+	# parse, handler, write (flushStates) and total.
+	#
+	def readPacket(self):
+
+		data = self.readPort()
+		readTime = time.perf_counter()
+		if not data:
+			return ('', '')
+		elif data == b'-':
+			self.logger.debug("Socket has closed")
+			# socket has closed, return with signal to re-initialize
+			return ('-', '')
+
+		self.rxLastPacketTime = time.time()
+
+		# This try block catches exceptions when non-ascii characters were received. 
+		# Not sure why they are being received.
+		try:
+			frame = decodeFrame(data)
+		except ValueError:
+			self.logger.error("IT-100/Envisalink Error: Received a response with invalid characters")
+			return ('', '')
+		if frame is None:
+			return ('', '')
+
+		(cmd, dat, checksumOk) = frame
+		self.logger.threaddebug(f"RX: {data.decode('ascii').strip()}")
+		if checksumOk is False:
+			self.rxChecksumErrors += 1
+			self.logger.error("Checksum did not match on a received packet.")
+			return ('', '')
+
+		if self.rxCapture is not None:
+			self.captureRx(cmd, dat)
+
+		latencyStats = self.latencyStats
+		rxTime = getattr(self.port, 'lastRxTime', None)
+		if rxTime is None:
+			rxTime = readTime
+		else:
+			latencyStats.record('read', cmd, readTime - rxTime)
+		parsedTime = time.perf_counter()
+		latencyStats.record('parse', cmd, parsedTime - readTime)
+
+		##################################################################################
+		# Dispatch to the handler registered for the cmd value received from panel
+		##################################################################################
+
+		self.cmdDispatchCount[cmd] = self.cmdDispatchCount.get(cmd, 0) + 1
+		handler = self.cmdHandlers.get(cmd)
+		if self.journal is not None and cmd not in kJournalSkipCodes:
+			self.journalPacket(cmd, dat, handler)
+		if handler is None:
+			#self.logger.debug(f"RX: {data}")
+			self.logger.debug(f"Unrecognized command received (Cmd:{cmd} Dat:{dat})")
+		else:
+			# Panels share zone groups, triggers and variables, so their packets are
+			# handled one at a time
+			with self.handlerLock:
+				try:
+					handler(cmd, dat)
+				finally:
+					# write all device states changed by this packet in one call per device
+					handledTime = time.perf_counter()
+					self.flushStates()
+					flushedTime = time.perf_counter()
+					latencyStats.record('handler', cmd, handledTime - parsedTime)
+					latencyStats.record('write', cmd, flushedTime - handledTime)
+					latencyStats.record('total', cmd, flushedTime - rxTime)
+
+		return (cmd, dat)
+
+
+	######################################################################################
+	# Command Handler Registry
+	######################################################################################
+
+	# Registers the method called by readPacket when a packet with command code cmd
+	# is received. A later registration for the same code replaces the earlier one.
+	#
+	def registerCmdHandler(self, cmd, handler):
+		self.cmdHandlers[cmd] = handler
+
+
+	def registerCmdHandlers(self):
+		self.cmdHandlers = {}
+		self.cmdDispatchCount = {}
+
+		self.registerCmdHandler('500', self.rxCommandAck)
+		self.registerCmdHandler('501', self.rxCommandError)
+		self.registerCmdHandler('502', self.rxSystemError)
+		self.registerCmdHandler('505', self.rxLoginInteraction)
+		self.registerCmdHandler('510', self.rxKeypadLedState)
+		self.registerCmdHandler('511', self.rxKeypadLedFlashState)
+		self.registerCmdHandler('550', self.rxTimeDateBroadcast)
+		self.registerCmdHandler('560', self.rxRingDetected)
+		self.registerCmdHandler('561', self.rxTemperature)
+		self.registerCmdHandler('562', self.rxTemperature)
+		self.registerCmdHandler('563', self.rxThermostatSetPoints)
+		self.registerCmdHandler('601', self.rxZoneAlarm)
+		self.registerCmdHandler('602', self.rxZoneAlarmRestore)
+		self.registerCmdHandler('603', self.rxZoneTamper)
+		self.registerCmdHandler('604', self.rxZoneTamperRestore)
+		self.registerCmdHandler('605', self.rxZoneFault)
+		self.registerCmdHandler('606', self.rxZoneFaultRestore)
+		self.registerCmdHandler('609', self.rxZoneOpen)
+		self.registerCmdHandler('610', self.rxZoneRestored)
+		self.registerCmdHandler('616', self.rxBypassedZonesDump)
+		self.registerCmdHandler('620', self.rxDuressAlarm)
+		self.registerCmdHandler('621', self.rxFireKeyAlarm)
+		self.registerCmdHandler('622', self.rxFireKeyRestore)
+		self.registerCmdHandler('623', self.rxAuxKeyAlarm)
+		self.registerCmdHandler('624', self.rxAuxKeyRestore)
+		self.registerCmdHandler('625', self.rxPanicKeyAlarm)
+		self.registerCmdHandler('626', self.rxPanicKeyRestore)
+		self.registerCmdHandler('631', self.rxSmokeAlarm)
+		self.registerCmdHandler('632', self.rxSmokeRestore)
+		self.registerCmdHandler('650', self.rxPartitionReady)
+		self.registerCmdHandler('651', self.rxPartitionNotReady)
+		self.registerCmdHandler('652', self.rxPartitionArmed)
+		self.registerCmdHandler('653', self.rxPartitionReady)
+		self.registerCmdHandler('654', self.rxPartitionInAlarm)
+		self.registerCmdHandler('655', self.rxPartitionDisarmed)
+		self.registerCmdHandler('656', self.rxExitDelay)
+		self.registerCmdHandler('657', self.rxEntryDelay)
+		self.registerCmdHandler('663', self.rxChimeEnabled)
+		self.registerCmdHandler('664', self.rxChimeDisabled)
+		self.registerCmdHandler('672', self.rxFailedToArm)
+		self.registerCmdHandler('673', self.rxPartitionBusy)
+		self.registerCmdHandler('700', self.rxUserClosing)
+		self.registerCmdHandler('701', self.rxSpecialClosing)
+		self.registerCmdHandler('702', self.rxPartialClosing)
+		self.registerCmdHandler('750', self.rxUserOpening)
+		self.registerCmdHandler('751', self.rxSpecialOpening)
+		for cmd in kTroubleNoticeDict:
+			self.registerCmdHandler(cmd, self.rxTroubleNotice)
+		self.registerCmdHandler('840', self.rxTroubleLedOn)
+		self.registerCmdHandler('841', self.rxTroubleLedOff)
+		self.registerCmdHandler('849', self.rxTroubleStatus)
+		for cmd in kDebugNoticeDict:
+			self.registerCmdHandler(cmd, self.rxDebugNotice)
+		self.registerCmdHandler('900', self.rxCodeRequired)
+		self.registerCmdHandler('901', self.rxLcdUpdate)
+		self.registerCmdHandler('903', self.rxLedStatus)
+		self.registerCmdHandler('908', self.rxSoftwareVersion)
+		self.registerCmdHandler('912', self.rxCommandOutputPressed)
+		self.registerCmdHandler('921', self.rxCodeRequired)
+		self.registerCmdHandler('922', self.rxCodeRequired)
+
+
+	# Logs how often each command code has been dispatched since the plugin started,
+	# most frequent first. Called from the plugin menu.
+	#
+	def menuLogDispatchStats(self, valuesDict=None, typeId=None):
+		if not self.cmdDispatchCount:
+			self.logger.info("No packets have been dispatched yet.")
+			return
+		total = sum(self.cmdDispatchCount.values())
+		stats = f"Dispatched {total} packets since startup:\n"
+		for cmd, count in sorted(self.cmdDispatchCount.items(), key=lambda item: item[1], reverse=True):
+			handler = self.cmdHandlers.get(cmd)
+			handlerName = handler.__name__ if handler is not None else "(unrecognized)"
+			stats += f"{'':35}{cmd}  {count:>8}  {handlerName}\n"
+		self.logger.info(stats)
+
+
+	######################################################################################
+	# TPI Traffic Capture
+	######################################################################################
+
+	# Received packets are written one per line as "<seconds since previous> <cmd><data>",
+	# the event script format of tools/tpi_emulator.py, so a capture can be played back
+	# by the emulator or replayed through readPacket by tools/replay_benchmark.py.
+	#
+	def menuStartCapture(self, valuesDict=None, typeId=None):
+		if self.rxCapture is not None:
+			self.logger.info(f"Already capturing TPI traffic to {self.rxCapture.name}")
+			return
+		fileName = os.path.join(indigo.server.getLogsFolderPath(pluginId=self.pluginId), datetime.now().strftime("tpi_capture_%Y%m%d_%H%M%S.txt"))
+		try:
+			self.rxCapture = open(fileName, "w")
+		except OSError as err:
+			self.logger.error(f"Unable to open capture file: {str(err)}")
+			return
+		self.rxCaptureLast = time.time()
+		self.logger.info(f"Capturing received TPI traffic to {fileName}")
+
+
+	def menuStopCapture(self, valuesDict=None, typeId=None):
+		if self.rxCapture is None:
+			self.logger.info("TPI traffic is not being captured.")
+			return
+		rxCapture = self.rxCapture
+		self.rxCapture = None
+		rxCapture.close()
+		self.logger.info(f"Stopped capturing TPI traffic to {rxCapture.name}")
+
+
+	def captureRx(self, cmd, dat):
+		timeNow = time.time()
+		try:
+			self.rxCapture.write(f"{timeNow - self.rxCaptureLast:.3f}\t{cmd}{dat}\n")
+		except (OSError, ValueError) as err:
+			self.logger.error(f"Unable to write capture file, capture stopped: {str(err)}")
+			self.rxCapture = None
+			return
+		self.rxCaptureLast = timeNow
+
+
+	######################################################################################
+	# Latency Statistics
+	######################################################################################
+
+	def updateQueueGauges(self):
+		latencyStats = self.latencyStats
+		panel = self.currentPanel()
+		suffix = "" if panel is self.defaultPanel else f" {panel.name}"
+		latencyStats.setGauge('txCmdList' + suffix, len(self.txCmdList))
+		latencyStats.setGauge('txInFlight' + suffix, len(self.txInFlight))
+		if self.useAsyncTransport is True and self.port is not None:
+			latencyStats.setGauge('rxQueue' + suffix, self.port.rxPending())
+		for worker in (self.emailWorker, self.speechWorker):
+			if worker is not None:
+				latencyStats.setGauge(f"{worker.name} notifications", len(worker.pending))
+
+
+	# Logs the latency histograms of the last 10 to 20 minutes per stage and command
+	# code, and the queue depth gauges. Called from the plugin menu.
+	#
+	def menuLogLatencyStats(self, valuesDict=None, typeId=None):
+		lines = self.latencyStats.report(kLatencyStages)
+		if not lines:
+			self.logger.info("No latency statistics have been recorded yet.")
+			return
+		self.logger.info("Latency statistics (p50/p90/p99 are bucket upper bounds):\n" + "".join(f"{'':35}{line}\n" for line in lines))
+
+
+	def menuResetLatencyStats(self, valuesDict=None, typeId=None):
+		self.latencyStats.reset()
+		self.logger.info("Latency statistics reset.")
+
+
+	def recordAck(self, txCmd, seconds):
+		self.latencyStats.record('ack', txCmd, seconds)
+		if txCmd == '000':
+			self.lastPingRtt = seconds
+
+
+	######################################################################################
+	# Prometheus Metrics
+	######################################################################################
+
+	# Counters are plain ints and dicts updated on the concurrent thread. The metrics
+	# server thread copies them when a scrape arrives, so nothing is locked.
+	#
+	def countIndigoCall(self, call):
+		self.indigoCallCount[call] = self.indigoCallCount.get(call, 0) + 1
+
+
+	def countConnectionEvent(self, state):
+		self.connectionEventCount[state] = self.connectionEventCount.get(state, 0) + 1
+
+
+	def configureMetricsServer(self, valuesDict):
+		if valuesDict.get('metricsEnabled', False) is not True:
+			self.stopMetricsServer()
+			return
+		address = '127.0.0.1' if valuesDict.get('metricsLocalOnly', True) is True else ''
+		port = int(valuesDict.get('metricsPort', kMetricsPortDefault))
+		if self.metricsServer is not None:
+			if (self.metricsServer.address, self.metricsServer.port) == (address, port):
+				return
+			self.stopMetricsServer()
+
+		metricsServer = MetricsServer(address, port, self.renderMetrics, self.logger)
+		try:
+			metricsServer.start()
+		except OSError as err:
+			self.logger.error(f"Unable to start metrics server on port {port}: {str(err)}")
+			return
+		self.metricsServer = metricsServer
+		self.logger.info(f"Serving Prometheus metrics on port {port}")
+
+
+	def stopMetricsServer(self):
+		if self.metricsServer is not None:
+			self.metricsServer.stop()
+			self.metricsServer = None
+
+
+	def renderMetrics(self):
+		metrics = MetricsText('dsc_')
+		cmdDispatchCount = dict(self.cmdDispatchCount)
+		metrics.counter('packets_received_total', "TPI packets received with a valid checksum, by command code",
+			[({'code': cmd}, count) for (cmd, count) in sorted(cmdDispatchCount.items())])
+		metrics.counter('rx_checksum_errors_total', "Packets received from the TPI with a bad checksum", self.rxChecksumErrors)
+		metrics.counter('tx_checksum_errors_total', "Commands rejected by the TPI for a bad checksum (501)", cmdDispatchCount.get('501', 0))
+		metrics.counter('system_errors_total', "System errors reported by the TPI (502), by sub code",
+			[({'subcode': subcode}, count) for (subcode, count) in sorted(dict(self.systemErrorCount).items())])
+		metrics.counter('connection_events_total', "Connection re-initializations (BOTH_INIT) and retry holds (HOLD_RETRY)",
+			[({'state': state}, count) for (state, count) in sorted(dict(self.connectionEventCount).items())])
+		metrics.counter('indigo_api_calls_total', "Indigo server calls made by the packet, trigger and notification paths",
+			[({'call': call}, count) for (call, count) in sorted(dict(self.indigoCallCount).items())])
+		panels = self.getActivePanels()
+		metrics.gauge('connected', "1 while the plugin is communicating with the panel",
+			[({'panel': panel.name}, int(panel.state == self.States.BOTH_POLL)) for panel in panels])
+		metrics.gauge('connection_uptime_seconds', "Time since the current connection to the panel was established",
+			[({'panel': panel.name}, round(time.time() - panel.connectedSince) if panel.connectedSince else 0) for panel in panels])
+		metrics.gauge('reconnect_attempts', "Failed connection attempts since the last successful one",
+			[({'panel': panel.name}, panel.reconnectAttempts) for panel in panels])
+		pingRtts = [({'panel': panel.name}, round(panel.lastPingRtt, 6)) for panel in panels if panel.lastPingRtt is not None]
+		if pingRtts:
+			metrics.gauge('ping_rtt_seconds', "Round trip time of the last 000 poll command", pingRtts)
+		metrics.gauge('tx_queue_depth', "Commands waiting in txCmdList",
+			[({'panel': panel.name}, len(panel.txCmdList)) for panel in panels])
+		metrics.gauge('tx_in_flight', "Commands sent and waiting for their 500 ACK",
+			[({'panel': panel.name}, len(panel.txInFlight)) for panel in panels])
+		metrics.gauge('start_time_seconds', "Unix time the plugin started", round(self.startTime))
+		return metrics.text()
+
+
+	######################################################################################
+	# Event Journal
+	######################################################################################
+
+	# The journal is an SQLite database next to the plugin's preferences file. It is
+	# written by its own thread; readPacket only queues the events.
+	#
+	def configureJournal(self, valuesDict):
+		if valuesDict.get('journalEnabled', True) is not True:
+			if self.journal is not None:
+				self.journal.stop()
+				self.journal = None
+			return
+		retentionDays = int(valuesDict.get('journalRetentionDays', kJournalRetentionDefault))
+		if self.journal is not None:
+			self.journal.retentionDays = retentionDays
+			return
+
+		fileName = os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins", f"{self.pluginId}.journal.sqlite")
+		journal = EventJournal(fileName, self.logger, retentionDays)
+		try:
+			journal.start()
+		except Exception as err:
+			self.logger.error(f"Unable to open the event journal {fileName}: {str(err)}")
+			return
+		self.journal = journal
+		self.logger.debug(f"Journaling panel events to {fileName}")
+
+
+	def journalPacket(self, cmd, dat, handler):
+		(zone, partition, user) = (None, None, None)
+		try:
+			if cmd in kJournalZoneCodes:
+				zone = int(dat)
+			elif cmd in kJournalPartitionZoneCodes:
+				(partition, zone) = (int(dat[:1]), int(dat[1:]))
+			elif cmd in kJournalUserCodes:
+				(partition, user) = (int(dat[:1]), int(dat[1:]))
+			elif cmd in kJournalPartitionCodes:
+				partition = int(dat[:1])
+		except ValueError:
+			pass
+		description = handler.__name__[2:] if handler is not None else None
+		self.journal.record(time.time(), cmd, dat, zone, partition, user, description, self.currentPanel().devId)
+
+
+	# Logs the matching journal events and puts them in the DSC_Journal_Result variable.
+	# Also returns them, as a list of dicts, to scripts using executeAction.
+	#
+	def methodQueryJournal(self, action):
+		if self.journal is None:
+			self.logger.error("The event journal is not enabled in the plugin configuration.")
+			return []
+		props = action.props
+		try:
+			eventType = props.get('journalEventType', 'all')
+			panelId = int(props.get('panel') or 0)
+			zone = int(props['journalZone']) if str(props.get('journalZone', '')).strip() else None
+			partition = int(props['journalPartition']) if str(props.get('journalPartition', '')).strip() else None
+			days = float(props.get('journalDays', 7) or 0)
+			limit = int(props.get('journalLimit', kJournalQueryLimitDefault) or kJournalQueryLimitDefault)
+		except (TypeError, ValueError) as err:
+			self.logger.error(f"Invalid event journal query: {str(err)}")
+			return []
+
+		since = time.time() - days * 86400 if days > 0 else None
+		try:
+			events = self.journal.query(since=since, panel=panelId, zone=zone, partition=partition, codes=kJournalEventTypes.get(eventType), limit=limit)
+		except Exception as err:
+			self.logger.error(f"Unable to query the event journal: {str(err)}")
+			return []
+
+		lines = [self.formatJournalEvent(event) for event in events]
+		self.logger.info(f"Event journal: {len(events)} {eventType} events" + "".join(f"\n{'':35}{line}" for line in lines))
+		self.countIndigoCall('variable.updateValue')
+		indigo.variable.updateValue("DSC_Journal_Result", value="\n".join(lines))
+		return events
+
+
+	def formatJournalEvent(self, event):
+		text = f"{datetime.fromtimestamp(event['time']).strftime('%Y-%m-%d %H:%M:%S')}  {event['code']} {event['description'] or 'Unrecognized'}"
+		if event['partition'] is not None:
+			text += f", partition {event['partition']}"
+		if event['zone'] is not None:
+			text += f", zone {event['zone']}"
+			# zone numbers are per panel, name the zone of the panel the event came from
+			panel = self.panels.get(event['panel'])
+			if panel is not None:
+				zoneDev = self.devMirror.get(panel.zoneList.get(event['zone']))
+				if zoneDev is not None:
+					text += f" '{zoneDev.name}'"
+		if event['user'] is not None:
+			user = f"{event['user'] % 100:02d}"
+			text += f", user {user}"
+			if self.userLabelDict.get(user):
+				text += f" '{self.userLabelDict[user]}'"
+		return text
+
+
+	######################################################################################
+	# Command Handlers - Acknowledgements and Errors
+	######################################################################################
+
+	def rxCommandAck(self, cmd, dat):
+		self.logger.threaddebug(f"ACK for cmd {dat}.")
+		entry = self.popTxInFlight(dat)
+		if entry is not None:
+			self.recordAck(dat, time.time() - entry[1])
+
+
+	def rxCommandError(self, cmd, dat):
+		self.logger.error("IT-100/Envisalink Error: Received a command with a bad checksum")
+		# The TPI rejected the oldest outstanding command, send it again
+		entry = self.popTxInFlight()
+		if entry is not None:
+			self.txCmdList.insert(0, (kCmdNormal, entry[0], 0, time.perf_counter()))
+
+
+	def rxSystemError(self, cmd, dat):
+		errText = kSystemErrorDict.get(dat, 'Unknown')
+		self.systemErrorCount[dat] = self.systemErrorCount.get(dat, 0) + 1
+
+		# The error only tells which command it refers to when a single command is
+		# waiting for its ACK. Buffer overruns mean we are sending faster than the
+		# TPI/Keybus can take, so only allow one command in flight for a while and
+		# resend the command if it is known and safe to send again. Any other error
+		# aborts a known command. With several in flight, or after an error that
+		# follows the ACK, no command is blamed: unanswered ones are resent or dropped
+		# by checkTxTimeouts.
+		entry = None
+		if dat not in kTxPostAckErrors and len(self.txInFlight) == 1:
+			entry = self.txInFlight[0]
+		if dat in kTxOverrunErrors:
+			self.txSerializeUntil = time.time() + kTxSerializeSeconds
+			if entry is not None and entry[0][:3] not in kTxNoResendCmds:
+				self.txInFlight.remove(entry)
+				self.logger.debug(f"Resending command {entry[0]} one at a time after buffer overrun.")
+				self.txCmdList.insert(0, (kCmdNormal, entry[0], entry[3], time.perf_counter()))
+		elif entry is not None:
+			self.txInFlight.remove(entry)
+			self.logger.error(f"Received system error/warning after sending command {entry[0]}, aborting.")
+		elif self.txInFlight and dat not in kTxPostAckErrors:
+			self.txSerializeUntil = time.time() + kTxSerializeSeconds
+			self.logger.debug(f"Sending commands one at a time, error {dat} does not tell which of {len(self.txInFlight)} commands it refers to.")
+
+		if dat == '024':
+			self.triggerEvent('eventFailToArm')
+			self.speak('speakTextFailedToArm')
+
+		if dat in {'023', '024'}:
+			self.logger.warning(f"IT-100/Envisalink Warning ({dat}): {errText}")
+		else:
+			self.logger.error(f"IT-100/Envisalink Error ({dat}): {errText}")
+
+
+	def rxLoginInteraction(self, cmd, dat):
+		if dat == '3':
+			self.logger.debug("Received login request")
+
+
+	######################################################################################
+	# Command Handlers - Keypad, Time and Thermostats
+	######################################################################################
+
+	def rxKeypadLedState(self, cmd, dat):
+		# Keypad LED State Updates for Partition 1 only
+		leds = int(dat, 16)
+
+		if leds & 1 > 0:
+			self.updateKeypad(1, 'LEDReady', 'on')
+		else:
+			self.updateKeypad(1, 'LEDReady', 'off')
+
+		if leds & 2 > 0:
+			self.updateKeypad(1, 'LEDArmed', 'on')
+		else:
+			self.updateKeypad(1, 'LEDArmed', 'off')
+
+		if leds & 16 > 0:
+			self.updateKeypad(1, 'LEDTrouble', 'on')
+		else:
+			self.updateKeypad(1, 'LEDTrouble', 'off')
+
+		if leds & 4 > 0:
+			self.updateKeypad(1, 'LEDMemory', 'on')
+		else:
+			self.updateKeypad(1, 'LEDMemory', 'off')
+
+		if leds & 8 > 0:
+			self.updateKeypad(1, 'LEDBypass', 'on')
+		else:
+			self.updateKeypad(1, 'LEDBypass', 'off')
+
+
+	def rxKeypadLedFlashState(self, cmd, dat):
+		# Keypad LED Flashing State Update
+		# Same as 510 above but means an LED is flashing
+		# We don't use this right now
+		pass
+
+
+	def rxTimeDateBroadcast(self, cmd, dat):
+		# This command is send by DSC panel every 4 min
+		m = re.search(r'^(\d\d)(\d\d)(\d\d)(\d\d)(\d\d)$', dat)
+		if m:
+			tHour = m.group(1).zfill(2)   #padding str objects to two digits
+			tMin = m.group(2).zfill(2)
+			dMonth = m.group(3).zfill(2)
+			dMonthDay = m.group(4).zfill(2)
+			dYear = m.group(5)
+			self.logger.debug(f"Received alarm panel time and date {tHour}:{tMin} {dMonth}-{dMonthDay}-{dYear}")
+
+			if self.configKeepTimeSynced is True:
+				# Is it around 3 am and the time has not recently been synced?
+				d = datetime.now()
+				if self.timesyncflag is True and (d.hour == 3) and (d.minute in range(0, 6)):
+					self.logger.debug("Syncing alarm panel time and date.")
+					self.queueCommand(f"010{d.strftime('%H%M%m%d%y')}")
+					self.timesyncflag = False
+				else:
+					self.timesyncflag = True
+					self.logger.debug("No time sync necessary.")
+
+			# If this is a 2DS/Envisalink interface then lets insert the time in the virtual keypad 
+			# Time is updated only every 4 minutes, so not very useful to use
+			if self.useSerial is False:
+				tAmPm = 'a'
+				tHour = int(tHour)
+				if tHour >= 12:
+					tAmPm = 'p'
+
+				if tHour > 12:
+					tHour -= 12
+				elif tHour == 0:
+					tHour = 12
+				str(tHour).zfill(2)
+				self.updateKeypad(0, 'LCDLine1', '  Date     Time ')
+				self.updateKeypad(0, 'LCDLine2', f"{kMonthList[int(dMonth)-1]} {dMonthDay}/{dYear} {tHour}:{tMin}{tAmPm}")
+				self.logger.debug(f"{kMonthList[int(dMonth)-1]} {dMonthDay}/{dYear} {tHour}:{tMin}{tAmPm}")
+
+
+	def rxRingDetected(self, cmd, dat):
+		self.logger.info("Telephone Ring Tone Has Been Detected.")
+		self.triggerEvent('eventNoticeTelephone_Ring')
+
+
+	def rxTemperature(self, cmd, dat):
+		m = re.search(r'^(.)(...)$', dat)
+		if m:
+			(sensor, temp) = (int(m.group(1)), int(m.group(2)))
+			if cmd == '562':
+				self.updateSensorTemp(sensor, 'outside', temp)
+			else:
+				self.updateSensorTemp(sensor, 'inside', temp)
+
+
+	def rxThermostatSetPoints(self, cmd, dat):
+		m = re.search(r'^(.)(...)(...)$', dat)
+		if m:
+			(sensor, cool, heat) = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+			self.updateSensorTemp(sensor, 'cool', cool)
+			self.updateSensorTemp(sensor, 'heat', heat)
+			self.continueThermostatAdjustment(sensor)
+
+
+	######################################################################################
+	# Command Handlers - Zones
+	######################################################################################
+
+	def rxZoneAlarm(self, cmd, dat):
+		# a zone goes into alarm/is tripped
+		m = re.search(r'^(.)(...)$', dat)
+		if m:
+			(partition, zone) = (int(m.group(1)), int(m.group(2)))
+			self.updateZoneState(zone, kZoneStateTripped)
+			if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is True:
+				dev = self.getDevice(self.zoneList[zone])
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)
+
+			zoneTable = self.zoneTable
+			if not zoneTable.trippedMask:
+				if "DSC_Alarm_Memory" in indigo.variables:
+					indigo.variable.updateValue("DSC_Alarm_Memory", value="")
+			if zoneTable.setTripped(zone):
+				self.sendZoneTrippedEmail()
+				indigoVar = ""
+				for zoneNum in self.getTrippedZones():
+					zone = self.getDevice(self.zoneList[zoneNum])
+					indigoVar += (zone.name + "; ")
+				if "DSC_Alarm_Memory" in indigo.variables:
+					indigo.variable.updateValue("DSC_Alarm_Memory", indigoVar)
+				self.triggerEvent('eventZoneTripped')
+
+
+	def rxZoneAlarmRestore(self, cmd, dat):
+		m = re.search(r'^(.)(...)$', dat)
+		if m:
+			(partition, zone) = (int(m.group(1)), int(m.group(2)))
+			dev = self.getDevice(self.keypadList[partition])
+			zonedev = self.getDevice(self.zoneList[zone])
+			keyp = str(dev.pluginProps['partitionName'])
+			self.logger.info(f"Zone '{zonedev.name}' Restored. (Partition {partition} '{keyp}')")
+
+
+	def rxZoneTamper(self, cmd, dat):
+		m = re.search(r'^(.)(...)$', dat)
+		if m:
+			(partition, zone) = (int(m.group(1)), int(m.group(2)))
+			self.logger.debug(f"Zone Number {zone} Has a Tamper Condition.")
+
+
+	def rxZoneTamperRestore(self, cmd, dat):
+		m = re.search(r'^(.)(...)$', dat)
+		if m:
+			(partition, zone) = (int(m.group(1)), int(m.group(2)))
+			self.logger.debug(f"Zone Number {zone} Tamper Condition has been Restored.")
+
+
+	def rxZoneFault(self, cmd, dat):
+		zone = int(dat)
+		self.logger.debug(f"Zone Number {zone} Has a Fault Condition.")
+
+
+	def rxZoneFaultRestore(self, cmd, dat):
+		zone = int(dat)
+		self.logger.debug(f"Zone Number {zone} Fault Condition has been Restored.")
+
+
+	def rxZoneOpen(self, cmd, dat):
+		zone = int(dat)
+		self.logger.debug(f"Zone Number {zone} Open.")
+		self.zoneTable.setOpen(zone, True)
+		self.updateZoneState(zone, kZoneStateOpen)
+		if self.repeatAlarmTripped is True:
+			self.zoneTable.setClosePending(zone, False)
+
+		# Custom state image icons are shown in Indigo Touch and Indigo Client UI if selected in Config Prefs.
+		# Not all icons are working yet in Indigo. Feel free to change icons to your liking.
+		if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is True:
+			self.logger.debug("We are using custom state icons.")
+			dev = self.getDevice(self.zoneList[zone])
+			zoneType = dev.pluginProps['zoneType']
+			if zoneType == "zoneTypeMotion":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensorTripped)
+			elif zoneType == "zoneTypeDoor":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.DoorSensorOpened)
+			elif zoneType == "zoneTypeWindow":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.WindowSensorOpened)
+			elif zoneType == "zoneTypeFire":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.HvacHeating)
+			elif zoneType == "zoneTypeWater":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SprinklerOn)
+			elif zoneType == "zoneTypeGas":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.HvacFanOn)
+			elif zoneType == "zoneTypeGlass":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
+			elif zoneType == "zoneTypeShock":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
+			elif zoneType == "zoneTypeCO":
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
+			else:
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)
+
+		# This refreshes image icons after unchecking the custom settings in Config window
+		if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is False:
+			dev = self.getDevice(self.zoneList[zone])
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+
+
+	def rxZoneRestored(self, cmd, dat):
+		zone = int(dat)
+		self.logger.debug(f"Zone Number {zone} Closed.")
+		self.zoneTable.setOpen(zone, False)
+		# Update the zone to closed ONLY if the alarm is not tripped. We want the 
+		# tripped states to be preserved so someone looking at their control page will 
+		# see all the zones that have been opened since the break in.
+		if self.repeatAlarmTripped is False:
+			self.updateZoneState(zone, kZoneStateClosed)
+			if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is True:
+				dev = self.getDevice(self.zoneList[zone])
+				zoneType = dev.pluginProps['zoneType']
+				if zoneType == "zoneTypeMotion":
+					dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
 				else:
 					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
-				
 
-			elif len(dat) == 2:
-				m = re.search(r'^(.)(.)$', dat)
-				if m:
-					(partition, mode) = (int(m.group(1)), int(m.group(2)))
-					dev = indigo.devices[self.keypadList[partition]]
-					keyp = str(dev.pluginProps['partitionName'])
-					self.logger.info(f"Alarm Panel Armed in {kArmedModeList[mode]} Mode. (Partition {partition} '{keyp}')")
-					if (mode == 0) or (mode == 2):
-						armedEvent = 'armedAway'
-						self.updateKeypad(partition, 'state', kAlarmStateArmedAway)
-						self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateAway)
-					else:
-						armedEvent = 'armedStay'
-						self.updateKeypad(partition, 'state', kAlarmStateArmedStay)
-						self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateStay)
-						self.updateKeypad(partition, 'LEDBypass', 'on')   # LED is on since motion sensors are bypassed in Stay mode
-
-					self.triggerEvent(armedEvent)
-					for trig in self.triggerList:
-						trigger = indigo.triggers[trig]
-						if trigger.pluginTypeId == 'eventPartitionArmed':
-							if trigger.pluginProps['partitionNum'] == str(partition):
-								indigo.trigger.execute(trigger.id)
-
-					self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
-					self.updateKeypad(partition, 'LEDReady', 'off')
-					self.updateKeypad(partition, 'LEDArmed', 'on')	  # updates LEDs for partitions 1-8
-					self.speak('speakTextArmed')
-					self.trippedZoneList = []
-					if self.configUseCustomIcons is True:
-						dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
-						#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
+			# This refreshes image icons after unchecking the custom settings in Config window
+			if zone in list(self.zoneList.keys()) and self.configUseCustomIcons is False:
+				dev = self.getDevice(self.zoneList[zone])
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+
+		else:
+			self.zoneTable.setClosePending(zone, True)
+
+
+	def rxBypassedZonesDump(self, cmd, dat):
+		# cmd is sent after a zone is bypassed or bypass is cancelled.
+		# This dump can be forced with keypress command [1*1#] if partition is not armed. 
+		# If partition is armed, it will switch armed state from stay to away and vice versa.
+		# Routine that identifies bypassed zones and updates zone status kZoneBypassNo 
+		# or kZoneBypassYes via newState (unfortunately for partition 1 only).
+		self.logger.debug(f"Bypass Hex Dump ({dat})")       #this is the 16-digit hex string for bypassed zones. Partition 1 only!
+		# 8 bytes for zones 1-8, 9-16, ... with the lowest bit of each byte for the
+		# lowest zone, so read little endian they give bit 0 for zone 1
+		bypassMask = int.from_bytes(bytes.fromhex(dat), 'little')
+		self.logger.debug(f"Bypassed Zones ({maskZones(bypassMask)})")
+		self.updateBypassMask(bypassMask)
+
+
+	# If the alarm has been disarmed while it was tripped, update any zone states
+	# that were closed during the break in.  We don't update them during the event
+	# so that Indigo's zone states will represent a zone as tripped during the entire event.
+	#
+	def closeRepeatTrippedZones(self):
+		if self.repeatAlarmTripped is True:
+			self.repeatAlarmTripped = False
+			for zone in maskZones(self.zoneTable.popClosePending()):
+				self.updateZoneState(zone, kZoneStateClosed)
+				if self.configUseCustomIcons is True and zone in self.zoneList:
+					dev = self.getDevice(self.zoneList[zone])
+					zoneType = dev.pluginProps['zoneType']
+					if zoneType == "zoneTypeMotion":
+						dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
 					else:
 						dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
-	
 
-		elif cmd == '653':
-			# Partition Ready - Forced Arming Enabled
-			# This reports ready state only for keypads i.e. partitions that are ready.
-			self.logger.debug(f"Partition {int(dat)} Ready")
-			partition = int(dat)
-			self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
-			self.updateKeypad(partition, 'LEDReady', 'on')
-			self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
 
-		elif cmd == '654':
-			# partition is in alarm due to zone violations or panic & fire alarm
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.warning(f"Alarm TRIPPED! (Partition {partition} '{keyp}')")
-			self.updateKeypad(partition, 'state', kAlarmStateTripped)
-			self.updateKeypad(partition, 'LEDMemory', 'on')	  # updates LED for partitions 1-8
-			self.triggerEvent('eventAlarmTripped')
-			self.repeatAlarmTrippedNext = time.time()
-			self.repeatAlarmTripped = True
-
-		elif cmd == '655':
-			# This command is send after user disarms an alarm that was not tripped (also see cmd 750, 751).
-			# This is only disarm cmd sent if arming is cancelled during exit delay (which also cancels zone bypass)
-			# If the alarm has been disarmed while it was tripped, update any zone states
-			# that were closed during the break in.  We don't update them during the event
-			# so that Indigo's zone states will represent a zone as tripped during the entire event.
-			if self.repeatAlarmTripped is True:
-				self.repeatAlarmTripped = False
-				for zone in self.closeTheseZonesList:
-					self.updateZoneState(zone, kZoneStateClosed)
-					if self.configUseCustomIcons is True:
-						dev = indigo.devices[self.zoneList[zone]]
-						zoneType = dev.pluginProps['zoneType']
-						if zoneType == "zoneTypeMotion":
-							dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
-						else:
-							dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
-
-
-				self.closeTheseZonesList = []
+	######################################################################################
+	# Command Handlers - Panic, Fire and Duress Alarms
+	######################################################################################
 
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			keypstate = str(dev.states['state'])
-			if keypstate == kAlarmStateExitDelay:
-				self.logger.info(f"Alarm Disarmed during Exit Delay. (Partition {partition} '{keyp}')")
+	def rxDuressAlarm(self, cmd, dat):
+		self.logger.warning("Duress Alarm Detected")
+		self.sendDuressEmail("Duress Alarm Detected")
+		# This updates all keypads (partitions)
+		self.updateKeypad(0, 'PanicState', kPanicStateDuress)
 
-			self.logger.debug("Bypass Cancelled for all Zones by DSC")
-			for i in range(64):
-				self.updateZoneBypass(i, kZoneBypassNo)
 
-			self.trippedZoneList = []
-			self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
-			self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateDisarmed)
-			self.updateKeypad(partition, 'LEDArmed', 'off')
-			self.updateKeypad(0, 'PanicState', kPanicStateNone)
-			self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
-			self.updateKeypad(partition, 'LEDReady', 'on')
-			self.updateKeypad(partition, 'LEDBypass', 'off')
-			if self.configUseCustomIcons is True:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)  # green circle
-				#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
+	def rxFireKeyAlarm(self, cmd, dat):
+		self.logger.warning("Fire Key Alarm Detected")
+		self.sendPanicEmail("Fire Key Alarm Detected")
+		# This updates all keypads (partitions)
+		self.updateKeypad(0, 'PanicState', kPanicStateFire)
 
-			#self.triggerEvent('eventAlarmDisarmed') #use cmd 750 & 751 triggers
-			#self.speak('speakTextDisarmed')  #use cmd 750 & 751 triggers
 
+	def rxFireKeyRestore(self, cmd, dat):
+		self.logger.info("Fire Key Alarm Restored")
+		# This updates all keypads (partitions). Partitions that were Armed will stay Armed. 
+		# Partitions that are "Ready for arming" will show up as Disarmed via cmd 650. 
+		# Otherwise they will show up as Tripped until they become "Ready", e.g. all open windows are closed.
+		self.updateKeypad(0, 'PanicState', kPanicStateNone)
 
-		elif cmd == '656':
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.info(f"Exit Delay. (Partition {partition} '{keyp}')")
-			self.updateKeypad(partition, 'state', kAlarmStateExitDelay)
-			self.updateKeypad(partition, 'LEDArmed', 'on')
-			if self.configUseCustomIcons is True:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.TimerOn)
-			self.updateKeypad(partition, 'LEDMemory', 'off')
-			if "DSC_Alarm_Memory" in indigo.variables:
-				indigo.variable.updateValue("DSC_Alarm_Memory", value="no tripped zones")
-			self.speak('speakTextArming')
+		# After the fire alarm has been disarmed while it was tripped, update any zone states
+		# that were closed during the fire alarm.
+		self.closeRepeatTrippedZones()
 
-		elif cmd == '657':
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.info(f"Entry Delay. (Partition {partition} '{keyp}')")
-			self.updateKeypad(partition, 'state', kAlarmStateEntryDelay)
-			self.speak('speakTextEntryDelay')
-			if self.configUseCustomIcons is True:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.TimerOn)
 
-		elif cmd == '663':
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.info(f"Keypad Chime Enabled. (Partition {partition} '{keyp}')")
-			self.updateKeypad(partition, 'KeypadChime', kKeypadStateChimeEnabled)
+	def rxAuxKeyAlarm(self, cmd, dat):
+		self.logger.warning("Auxiliary/Medical Key Alarm Detected")
+		self.sendPanicEmail("Ambulance/Medical Key Alarm Detected")
+		# This updates all keypads (partitions)
+		self.updateKeypad(0, 'PanicState', kPanicStateAmbulance)
 
-		elif cmd == '664':
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.info(f"Keypad Chime Disabled. (Partition {partition} '{keyp}')")
-			self.updateKeypad(partition, 'KeypadChime', kKeypadStateChimeDisabled)
 
-		elif cmd == '672':
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.warning(f"Alarm Panel Failed to Arm. (Partition {partition} '{keyp}')")
-			self.triggerEvent('eventFailToArm')
-			self.speak('speakTextFailedToArm')
+	def rxAuxKeyRestore(self, cmd, dat):
+		self.logger.info("Auxiliary/Medical Key Alarm Restored")
+		# This updates all keypads (partitions)
+		self.updateKeypad(0, 'PanicState', kPanicStateNone)
+
+
+	def rxPanicKeyAlarm(self, cmd, dat):
+		self.logger.warning("Panic/Police Key Alarm Detected")
+		self.sendPanicEmail("Panic/Police Key Alarm Detected")
+		# This updates all keypads (partitions)
+		self.updateKeypad(0, 'PanicState', kPanicStatePanic)
+
+
+	def rxPanicKeyRestore(self, cmd, dat):
+		self.logger.info("Panic/Police Key Alarm Restored")
+		# This updates all keypads (partitions). Partitions that were Armed will stay Armed. 
+		# Partitions that are "Ready for arming" will show up as Disarmed via cmd 650. 
+		# Otherwise they will show up as Tripped until they become "Ready", e.g. all open windows are closed.
+		self.updateKeypad(0, 'PanicState', kPanicStateNone)
+
+		# After the panic alarm has been disarmed while it was tripped, update any zone states
+		# that were closed during the panic alarm.
+		self.closeRepeatTrippedZones()
+
+
+	def rxSmokeAlarm(self, cmd, dat):
+		self.logger.warning("Auxiliary/Smoke Input Alarm Detected")
+		self.updateKeypad(0, 'PanicState', kPanicStateSmoke)
+
+
+	def rxSmokeRestore(self, cmd, dat):
+		self.logger.info("Auxiliary/Smoke Input Alarm Restored")
+		# This updates all keypads (partitions)
+		self.updateKeypad(0, 'PanicState', kPanicStateNone)
+
 
-		elif cmd == '673':
-			#sends busy reply for partitions that are not defined by the plugin
+	######################################################################################
+	# Command Handlers - Partitions
+	######################################################################################
+
+	def rxPartitionReady(self, cmd, dat):
+		# 650 reports "Ready" state only for keypads i.e. partitions that are ready to arm.
+		# 653 is Partition Ready - Forced Arming Enabled.
+		self.logger.debug(f"Partition {int(dat)} Ready")
+		partition = int(dat)
+		self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
+		self.updateKeypad(partition, 'LEDReady', 'on')
+		self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
+
+
+	def rxPartitionNotReady(self, cmd, dat):
+		self.logger.debug(f"Partition {int(dat)} Not Ready")
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
+		self.updateKeypad(partition, 'LEDReady', 'off')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
+			#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
+		else:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+
+
+	def rxPartitionArmed(self, cmd, dat):
+		if len(dat) == 1:
 			partition = int(dat)
-			self.logger.debug(f"Partition {partition} Busy/Not defined by plugin.")
+			dev = self.getDevice(self.keypadList[partition])
+			keyp = str(dev.pluginProps['partitionName'])
+			self.logger.debug(f"Alarm Panel Armed. (Partition {partition} '{keyp}')")
+			self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
+			self.updateKeypad(partition, 'LEDReady', 'off')
+			self.updateKeypad(partition, 'LEDArmed', 'on')	  # updates LEDs for partitions 1-8
+			self.speak('speakTextArmed')
+			self.zoneTable.clearTripped()
+			if self.configUseCustomIcons is True:
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
+				#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
+			else:
+				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
+			
 
-		elif cmd == '700':
-			# A partition has been armed by a user – sent at the end of exit delay
-			# No info on whether stay armed or away armed, but cmd 652 is also triggered and has this info
-			m = re.search(r'^(.)..(..)$', dat)
+		elif len(dat) == 2:
+			m = re.search(r'^(.)(.)$', dat)
 			if m:
-				(partition, user) = (int(m.group(1)), m.group(2))
-				dev = indigo.devices[self.keypadList[partition]]
+				(partition, mode) = (int(m.group(1)), int(m.group(2)))
+				dev = self.getDevice(self.keypadList[partition])
 				keyp = str(dev.pluginProps['partitionName'])
-				keyu = self.userLabelDict.get(user, "")
-				if keyu:
-					keyu = f" '{keyu}'"
-				self.logger.info(f"Alarm Panel Armed by User {user}{keyu}. (Partition {partition} '{keyp}')")
+				self.logger.info(f"Alarm Panel Armed in {kArmedModeList[mode]} Mode. (Partition {partition} '{keyp}')")
+				if (mode == 0) or (mode == 2):
+					armedEvent = 'armedAway'
+					self.updateKeypad(partition, 'state', kAlarmStateArmedAway)
+					self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateAway)
+				else:
+					armedEvent = 'armedStay'
+					self.updateKeypad(partition, 'state', kAlarmStateArmedStay)
+					self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateStay)
+					self.updateKeypad(partition, 'LEDBypass', 'on')   # LED is on since motion sensors are bypassed in Stay mode
+
+				self.triggerEvent(armedEvent)
+				self.triggerEvent('eventPartitionArmed', partition=partition)
+
 				self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
 				self.updateKeypad(partition, 'LEDReady', 'off')
-				self.updateKeypad(partition, 'LEDArmed', 'on')
+				self.updateKeypad(partition, 'LEDArmed', 'on')	  # updates LEDs for partitions 1-8
 				self.speak('speakTextArmed')
+				self.zoneTable.clearTripped()
 				if self.configUseCustomIcons is True:
 					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
 					#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
-				for trig in self.triggerList:
-					trigger = indigo.triggers[trig]
-					if trigger.pluginTypeId == 'userArmed':
-						if trigger.pluginProps['userCode'] == user:
-							indigo.trigger.execute(trigger.id)
-
-		elif cmd == '701':
-			# Special arming, e.g. IndigoTouch on iPhone, Keyswitch, etc
-			# No info on whether stay armed or away armed, but cmd 652 is also triggered and has this info
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
-			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.debug(f"Alarm Panel Specially Armed. (Partition {partition} '{keyp}')")
-			self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
-			self.updateKeypad(partition, 'LEDReady', 'off')
-			self.updateKeypad(partition, 'LEDArmed', 'on')
-			self.speak('speakTextArmed')
-			if self.configUseCustomIcons is True:
-				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
-				#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
+				else:
+					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
 
 
-		elif cmd == '702':
-			# A partition has been armed but one or more zones have been bypassed
-			# No info on whether stay armed or away armed, but cmd 652 is also triggered and has this info
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
+	def rxPartitionInAlarm(self, cmd, dat):
+		# partition is in alarm due to zone violations or panic & fire alarm
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.warning(f"Alarm TRIPPED! (Partition {partition} '{keyp}')")
+		self.updateKeypad(partition, 'state', kAlarmStateTripped)
+		self.updateKeypad(partition, 'LEDMemory', 'on')	  # updates LED for partitions 1-8
+		self.triggerEvent('eventAlarmTripped')
+		self.repeatAlarmTrippedNext = time.time()
+		self.repeatAlarmTripped = True
+
+
+	def rxPartitionDisarmed(self, cmd, dat):
+		# This command is send after user disarms an alarm that was not tripped (also see cmd 750, 751).
+		# This is only disarm cmd sent if arming is cancelled during exit delay (which also cancels zone bypass)
+		self.closeRepeatTrippedZones()
+
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		keypstate = str(dev.states['state'])
+		if keypstate == kAlarmStateExitDelay:
+			self.logger.info(f"Alarm Disarmed during Exit Delay. (Partition {partition} '{keyp}')")
+
+		self.logger.debug("Bypass Cancelled for all Zones by DSC")
+		self.updateBypassMask(0)
+
+		self.zoneTable.clearTripped()
+		self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
+		self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateDisarmed)
+		self.updateKeypad(partition, 'LEDArmed', 'off')
+		self.updateKeypad(0, 'PanicState', kPanicStateNone)
+		self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
+		self.updateKeypad(partition, 'LEDReady', 'on')
+		self.updateKeypad(partition, 'LEDBypass', 'off')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)  # green circle
+			#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
+
+		#self.triggerEvent('eventAlarmDisarmed') #use cmd 750 & 751 triggers
+		#self.speak('speakTextDisarmed')  #use cmd 750 & 751 triggers
+
+
+	def rxExitDelay(self, cmd, dat):
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.info(f"Exit Delay. (Partition {partition} '{keyp}')")
+		self.updateKeypad(partition, 'state', kAlarmStateExitDelay)
+		self.updateKeypad(partition, 'LEDArmed', 'on')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.TimerOn)
+		self.updateKeypad(partition, 'LEDMemory', 'off')
+		if "DSC_Alarm_Memory" in indigo.variables:
+			indigo.variable.updateValue("DSC_Alarm_Memory", value="no tripped zones")
+		self.speak('speakTextArming')
+
+
+	def rxEntryDelay(self, cmd, dat):
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.info(f"Entry Delay. (Partition {partition} '{keyp}')")
+		self.updateKeypad(partition, 'state', kAlarmStateEntryDelay)
+		self.speak('speakTextEntryDelay')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.TimerOn)
+
+
+	def rxChimeEnabled(self, cmd, dat):
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.info(f"Keypad Chime Enabled. (Partition {partition} '{keyp}')")
+		self.updateKeypad(partition, 'KeypadChime', kKeypadStateChimeEnabled)
+
+
+	def rxChimeDisabled(self, cmd, dat):
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.info(f"Keypad Chime Disabled. (Partition {partition} '{keyp}')")
+		self.updateKeypad(partition, 'KeypadChime', kKeypadStateChimeDisabled)
+
+
+	def rxFailedToArm(self, cmd, dat):
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.warning(f"Alarm Panel Failed to Arm. (Partition {partition} '{keyp}')")
+		self.triggerEvent('eventFailToArm')
+		self.speak('speakTextFailedToArm')
+
+
+	def rxPartitionBusy(self, cmd, dat):
+		#sends busy reply for partitions that are not defined by the plugin
+		partition = int(dat)
+		self.logger.debug(f"Partition {partition} Busy/Not defined by plugin.")
+
+
+	######################################################################################
+	# Command Handlers - Arming and Disarming
+	######################################################################################
+
+	def rxUserClosing(self, cmd, dat):
+		# A partition has been armed by a user – sent at the end of exit delay
+		# No info on whether stay armed or away armed, but cmd 652 is also triggered and has this info
+		m = re.search(r'^(.)..(..)$', dat)
+		if m:
+			(partition, user) = (int(m.group(1)), m.group(2))
+			dev = self.getDevice(self.keypadList[partition])
 			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.info(f"Alarm Panel Armed. (Partition {partition} '{keyp}' with zone(s) bypass)")
+			keyu = self.userLabelDict.get(user, "")
+			if keyu:
+				keyu = f" '{keyu}'"
+			self.logger.info(f"Alarm Panel Armed by User {user}{keyu}. (Partition {partition} '{keyp}')")
 			self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
 			self.updateKeypad(partition, 'LEDReady', 'off')
 			self.updateKeypad(partition, 'LEDArmed', 'on')
-			self.updateKeypad(partition, 'LEDBypass', 'on')
 			self.speak('speakTextArmed')
 			if self.configUseCustomIcons is True:
 				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
 				#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
-
-
-		elif cmd == '750':
-			# this command is send after user disarms an alarm that was tripping or not tripping (vs cmd 655).
-			# this command is not sent after cancelling a fire or panic/police alarm. In fact no commands are sent at all in this case.
-			m = re.search(r'^(.)..(..)$', dat)
-			if m:
-				(partition, user) = (int(m.group(1)), m.group(2))
-				dev = indigo.devices[self.keypadList[partition]]
-				keyp = str(dev.pluginProps['partitionName'])
-				keyu = self.userLabelDict.get(user, "")
-				if keyu:
-					keyu = f" '{keyu}'"
-				self.logger.info(f"Alarm Panel Disarmed by User {user}{keyu}. (Partition {partition} '{keyp}')")
-				self.sendEmailDisarm(f"Alarm Panel Disarmed by User {user}{keyu}. (Partition {partition} '{keyp}')")
-				if "DSC_Last_User_Disarm" in indigo.variables:
-					indigo.variable.updateValue("DSC_Last_User_Disarm", value="User "+user+keyu)
-
-				# self.trippedZoneList = []    # We do not want to delete list of tripped zones here
-				self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
-				self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateDisarmed)
-				self.updateKeypad(partition, 'LEDArmed', 'off')
-				self.updateKeypad(0, 'PanicState', kPanicStateNone)
-				self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
-				self.updateKeypad(partition, 'LEDReady', 'on')
-				self.updateKeypad(partition, 'LEDBypass', 'off')
-				self.triggerEvent('eventAlarmDisarmed')
-				self.speak('speakTextDisarmed')
-				if self.configUseCustomIcons is True:
-					dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
-					#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
-
-				for trig in self.triggerList:
-					trigger = indigo.triggers[trig]
-					if trigger.pluginTypeId == 'userDisarmed':
-						if trigger.pluginProps['userCode'] == user:
-							indigo.trigger.execute(trigger.id)
-
-				for trig in self.triggerList:
-					trigger = indigo.triggers[trig]
-					if trigger.pluginTypeId == 'userDisarmedPartition':
-						if trigger.pluginProps['userCode'] == user and trigger.pluginProps['partitionNum'] == str(partition):
-							indigo.trigger.execute(trigger.id)
-
-				for trig in self.triggerList:
-					trigger = indigo.triggers[trig]
-					if trigger.pluginTypeId == 'eventPartitionDisarmed':
-						if trigger.pluginProps['partitionNum'] == str(partition):
-							indigo.trigger.execute(trigger.id)
-
-			# If the alarm has been disarmed while it was tripped, update any zone states
-			# that were closed during the break in.  We don't update them during the event
-			# so that Indigo's zone states will represent a zone as tripped during the entire event.
-			if self.repeatAlarmTripped is True:
-				self.repeatAlarmTripped = False
-				for zone in self.closeTheseZonesList:
-					self.updateZoneState(zone, kZoneStateClosed)
-					if self.configUseCustomIcons is True:
-						dev = indigo.devices[self.zoneList[zone]]
-						zoneType = dev.pluginProps['zoneType']
-						if zoneType == "zoneTypeMotion":
-							dev.updateStateImageOnServer(indigo.kStateImageSel.MotionSensor)
-						else:
-							dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOff)
-
-				self.closeTheseZonesList = []
-
-			#Disarming cancels all bypassed zones automatically by DSC. So just need to update plugin zone states.
-			self.logger.debug("Bypass Cancelled for all Zones by DSC")
-			for i in range(64):
-				self.updateZoneBypass(i, kZoneBypassNo)
-
-
-		elif cmd == '751':
-			#special opening (triggered by keyswitch but not by Indigo Touch). A DSC/Envisalink bug seems to not send this cmd after key fob opening
-			partition = int(dat)
-			dev = indigo.devices[self.keypadList[partition]]
+			self.triggerEvent('userArmed', user=user)
+
+
+	def rxSpecialClosing(self, cmd, dat):
+		# Special arming, e.g. IndigoTouch on iPhone, Keyswitch, etc
+		# No info on whether stay armed or away armed, but cmd 652 is also triggered and has this info
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.debug(f"Alarm Panel Specially Armed. (Partition {partition} '{keyp}')")
+		self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
+		self.updateKeypad(partition, 'LEDReady', 'off')
+		self.updateKeypad(partition, 'LEDArmed', 'on')
+		self.speak('speakTextArmed')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
+			#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
+
+
+	def rxPartialClosing(self, cmd, dat):
+		# A partition has been armed but one or more zones have been bypassed
+		# No info on whether stay armed or away armed, but cmd 652 is also triggered and has this info
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.info(f"Alarm Panel Armed. (Partition {partition} '{keyp}' with zone(s) bypass)")
+		self.updateKeypad(partition, 'ReadyState', kReadyStateFalse)
+		self.updateKeypad(partition, 'LEDReady', 'off')
+		self.updateKeypad(partition, 'LEDArmed', 'on')
+		self.updateKeypad(partition, 'LEDBypass', 'on')
+		self.speak('speakTextArmed')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorTripped)  # red circle
+			#dev.updateStateImageOnServer(indigo.kStateImageSel.Locked)  # green locked padlock
+
+
+	def rxUserOpening(self, cmd, dat):
+		# this command is send after user disarms an alarm that was tripping or not tripping (vs cmd 655).
+		# this command is not sent after cancelling a fire or panic/police alarm. In fact no commands are sent at all in this case.
+		m = re.search(r'^(.)..(..)$', dat)
+		if m:
+			(partition, user) = (int(m.group(1)), m.group(2))
+			dev = self.getDevice(self.keypadList[partition])
 			keyp = str(dev.pluginProps['partitionName'])
-			self.logger.info(f"Alarm Disarmed by Special Opening (Partition {partition} '{keyp}')")
-			# self.trippedZoneList = []    #We do not want to delete list of tripped zones here
+			keyu = self.userLabelDict.get(user, "")
+			if keyu:
+				keyu = f" '{keyu}'"
+			self.logger.info(f"Alarm Panel Disarmed by User {user}{keyu}. (Partition {partition} '{keyp}')")
+			self.sendEmailDisarm(f"Alarm Panel Disarmed by User {user}{keyu}. (Partition {partition} '{keyp}')")
+			if "DSC_Last_User_Disarm" in indigo.variables:
+				indigo.variable.updateValue("DSC_Last_User_Disarm", value="User "+user+keyu)
+
+			# self.zoneTable.clearTripped()    # We do not want to delete list of tripped zones here
 			self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
 			self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateDisarmed)
 			self.updateKeypad(partition, 'LEDArmed', 'off')
@@ -1803,173 +2826,165 @@ class Plugin(indigo.PluginBase):
 			self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
 			self.updateKeypad(partition, 'LEDReady', 'on')
 			self.updateKeypad(partition, 'LEDBypass', 'off')
+			self.triggerEvent('eventAlarmDisarmed')
+			self.speak('speakTextDisarmed')
 			if self.configUseCustomIcons is True:
 				dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
 				#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
 
-			self.triggerEvent('eventAlarmDisarmed')
-			self.speak('speakTextDisarmed')
-
-			for trig in self.triggerList:
-				trigger = indigo.triggers[trig]
-				if trigger.pluginTypeId == 'eventPartitionDisarmed':
-					if trigger.pluginProps['partitionNum'] == str(partition):
-						indigo.trigger.execute(trigger.id)
+			self.triggerEvent('userDisarmed', user=user)
+			self.triggerEvent('userDisarmedPartition', partition=partition, user=user)
+			self.triggerEvent('eventPartitionDisarmed', partition=partition)
 
-			#Disarming cancels all bypassed zones automatically by DSC. So just need to update plugin zone states.
-			self.logger.debug("Bypass Cancelled for all Zones by DSC")
-			for i in range(64):
-				self.updateZoneBypass(i, kZoneBypassNo)
+		self.closeRepeatTrippedZones()
 
+		#Disarming cancels all bypassed zones automatically by DSC. So just need to update plugin zone states.
+		self.logger.debug("Bypass Cancelled for all Zones by DSC")
+		self.updateBypassMask(0)
 
-		elif cmd == '800':
-			self.logger.warning("Alarm Panel Battery is low.")
-			self.sendTroubleEmail("Alarm panel battery is low.")
 
-		elif cmd == '801':
-			self.logger.info("Alarm Panel Battery is now ok.")
-			self.sendTroubleEmail("Alarm panel battery is now ok.")
+	def rxSpecialOpening(self, cmd, dat):
+		#special opening (triggered by keyswitch but not by Indigo Touch). A DSC/Envisalink bug seems to not send this cmd after key fob opening
+		partition = int(dat)
+		dev = self.getDevice(self.keypadList[partition])
+		keyp = str(dev.pluginProps['partitionName'])
+		self.logger.info(f"Alarm Disarmed by Special Opening (Partition {partition} '{keyp}')")
+		# self.zoneTable.clearTripped()    #We do not want to delete list of tripped zones here
+		self.updateKeypad(partition, 'state', kAlarmStateDisarmed)
+		self.updateKeypad(partition, 'ArmedState', kAlarmArmedStateDisarmed)
+		self.updateKeypad(partition, 'LEDArmed', 'off')
+		self.updateKeypad(0, 'PanicState', kPanicStateNone)
+		self.updateKeypad(partition, 'ReadyState', kReadyStateTrue)
+		self.updateKeypad(partition, 'LEDReady', 'on')
+		self.updateKeypad(partition, 'LEDBypass', 'off')
+		if self.configUseCustomIcons is True:
+			dev.updateStateImageOnServer(indigo.kStateImageSel.SensorOn)   # green circle
+			#dev.updateStateImageOnServer(indigo.kStateImageSel.Unlocked)  # red open padlock
 
-		elif cmd == '802':
-			self.logger.warning("AC Power Lost.")
-			self.sendTroubleEmail("AC Power Lost.")
-			self.triggerEvent('eventNoticeAC_Trouble')
+		self.triggerEvent('eventAlarmDisarmed')
+		self.speak('speakTextDisarmed')
 
-		elif cmd == '803':
-			self.logger.info("AC Power Restored.")
-			self.sendTroubleEmail("AC Power Restored.")
-			self.triggerEvent('eventNoticeAC_Restore')
+		self.triggerEvent('eventPartitionDisarmed', partition=partition)
 
-		elif cmd == '806':
-			self.logger.warning("An open circuit has been detected across the bell terminals.")
-			self.sendTroubleEmail("An open circuit has been detected across the bell terminals.")
+		#Disarming cancels all bypassed zones automatically by DSC. So just need to update plugin zone states.
+		self.logger.debug("Bypass Cancelled for all Zones by DSC")
+		self.updateBypassMask(0)
 
-		elif cmd == '807':
-			self.logger.info("The bell circuit has been restored.")
-			self.sendTroubleEmail("The bell circuit has been restored.")
 
-		elif cmd == '814':
-			self.logger.warning("FTC Trouble.")
-			self.sendTroubleEmail("The panel has failed to communicate successfully to the monitoring station.")
+	######################################################################################
+	# Command Handlers - Trouble and System Status
+	######################################################################################
 
-		elif cmd == '815':
-			self.logger.info("FTC Trouble Restore.")
-			self.sendTroubleEmail("The panel has resumed communications.")
+	def rxTroubleNotice(self, cmd, dat):
+		(level, logText, emailText, eventId) = kTroubleNoticeDict[cmd]
+		self.logger.log(level, logText)
+		self.sendTroubleEmail(emailText)
+		if eventId:
+			self.triggerEvent(eventId)
 
-		elif cmd == '840':
-			partition = int(dat)
-			if partition in self.keypadList:
-				dev = indigo.devices[self.keypadList[partition]]
-				keyp = str(dev.pluginProps['partitionName'])
-				self.logger.warning(f"Trouble Status (LED ON). (Partition {partition} '{keyp}')")
-				self.updateKeypad(partition, 'LEDTrouble', 'on')   # this updates LED for partitions 1-8
-				self.troubleClearedTimer = 0
 
-		elif cmd == '841':
-			#Sends Trouble off for all partitions, including undefined ones.
-			partition = int(dat)
-			self.logger.debug(f"Trouble Status Restore (LED OFF). (Partition {partition})")
-			self.updateKeypad(partition, 'LEDTrouble', 'off')  # this updates LED for partitions 1-8
+	def rxTroubleLedOn(self, cmd, dat):
+		partition = int(dat)
+		if partition in self.keypadList:
+			dev = self.getDevice(self.keypadList[partition])
+			keyp = str(dev.pluginProps['partitionName'])
+			self.logger.warning(f"Trouble Status (LED ON). (Partition {partition} '{keyp}')")
+			self.updateKeypad(partition, 'LEDTrouble', 'on')   # this updates LED for partitions 1-8
+			self.troubleClearedTime = 0
+
+
+	def rxTroubleLedOff(self, cmd, dat):
+		#Sends Trouble off for all partitions, including undefined ones.
+		partition = int(dat)
+		self.logger.debug(f"Trouble Status Restore (LED OFF). (Partition {partition})")
+		self.updateKeypad(partition, 'LEDTrouble', 'off')  # this updates LED for partitions 1-8
+		if self.troubleCode > 0:
+			# If the trouble light goes off, set a 10 second timer.
+			# If the light is still off after 10 seconds we'll clear our status
+			# This is required because the panel turns the light off/on quickly
+			# when the light is actually on.
+			self.troubleClearedTime = time.time() + 10
+
+
+	def rxTroubleStatus(self, cmd, dat):
+		self.logger.debug(f"Received trouble code byte 0x{dat}")
+		newCode = int(dat, 16)
+
+		if newCode != self.troubleCode:
+			self.troubleCode = newCode
 			if self.troubleCode > 0:
-				# If the trouble light goes off, set a 10 second timer.
-				# If the light is still off after 10 seconds we'll clear our status
-				# This is required because the panel turns the light off/on quickly
-				# when the light is actually on.
-				self.troubleClearedTimer = 10
-
-		elif cmd == '849':
-			self.logger.debug(f"Received trouble code byte 0x{dat}")
-			newCode = int(dat, 16)
-
-			if newCode != self.troubleCode:
-				self.troubleCode = newCode
-				if self.troubleCode > 0:
-					body = "Trouble Code Received:\n"
-					if self.troubleCode & 1: body += "- Service is Required. Check Keypad for more Information.\n"
-					if self.troubleCode & 2: body += "- AC Power Lost\n"
-					if self.troubleCode & 4: body += "- Telephone Line Fault\n"
-					if self.troubleCode & 8: body += "- Failure to Communicate\n"
-					if self.troubleCode & 16: body += "- Sensor/Zone Fault\n"
-					if self.troubleCode & 32: body += "- Sensor/Zone Tamper\n"
-					if self.troubleCode & 64: body += "- Sensor/Zone Low Battery\n"
-					if self.troubleCode & 128: body += "- Loss of Time\n"
-					self.sendTroubleEmail(body)
-
-		elif cmd == '851':
-			self.logger.debug(f"Partition Busy Restore. (Partition {int(dat)})")
-		elif cmd == '896':
-			self.logger.debug("Keybus Fault")
-		elif cmd == '897':
-			self.logger.debug("Keybus Fault Restore")
-		elif cmd == '900':
-			self.logger.error("User Access Code Required")
-
-		elif cmd == '901':
-			#this updates the virtual keypad
-			#for char in dat:
-			#	self.logger.debug(f"LCD DEBUG: {ord(char)}")
-			m = re.search(r'^...(..)(.*)$', dat)
-			if m:
-				lcdText = re.sub(r'[^ a-zA-Z0-9_/\:-]+', ' ', m.group(2))
-				half = int(len(lcdText)/2)
-				half1 = lcdText[:half]
-				half2 = lcdText[half:]
-				self.logger.debug(f"LCD Update, Line 1:'{half1}' Line 2:'{half2}'")
-				self.updateKeypad(0, 'LCDLine1', half1)
-				self.updateKeypad(0, 'LCDLine2', half2)
-
-		elif cmd == '903':
-			m = re.search(r'^(.)(.)$', dat)
-			if m:
-				(ledName, ledState) = (kLedIndexList[int(m.group(1))], kLedStateList[int(m.group(2))])
-				self.logger.debug(f"LED '{ledName}' is '{ledState}'.")
-
-				if ledState == 'flashing':
-					ledState = 'on'
+				body = "Trouble Code Received:\n"
+				if self.troubleCode & 1: body += "- Service is Required. Check Keypad for more Information.\n"
+				if self.troubleCode & 2: body += "- AC Power Lost\n"
+				if self.troubleCode & 4: body += "- Telephone Line Fault\n"
+				if self.troubleCode & 8: body += "- Failure to Communicate\n"
+				if self.troubleCode & 16: body += "- Sensor/Zone Fault\n"
+				if self.troubleCode & 32: body += "- Sensor/Zone Tamper\n"
+				if self.troubleCode & 64: body += "- Sensor/Zone Low Battery\n"
+				if self.troubleCode & 128: body += "- Loss of Time\n"
+				self.sendTroubleEmail(body)
+
+
+	def rxDebugNotice(self, cmd, dat):
+		if cmd == '851':
+			self.logger.debug(f"{kDebugNoticeDict[cmd]} (Partition {int(dat)})")
+		else:
+			self.logger.debug(kDebugNoticeDict[cmd])
 
-				if ledName == 'Ready':
-					self.updateKeypad(1, 'LEDReady', ledState)
-				elif ledName == 'Armed':
-					self.updateKeypad(1, 'LEDArmed', ledState)
-				elif ledName == 'Trouble':
-					self.updateKeypad(1, 'LEDTrouble', ledState)
-				elif ledName == 'Bypass':
-					self.updateKeypad(1, 'LEDBypass', ledState)
-				elif ledName == 'Memory':
-					self.updateKeypad(1, 'LEDMemory', ledState)
 
+	def rxCodeRequired(self, cmd, dat):
+		if cmd == '900':
+			self.logger.error("User Access Code Required")
+		elif cmd == '921':
+			self.logger.error("Master Code Required")
+		elif cmd == '922':
+			self.logger.error("Installer Code Required")
 
-		elif cmd == '904':
-			self.logger.debug("Beep Status")
 
-		elif cmd == '905':
-			self.logger.debug("Tone Status")
+	def rxLcdUpdate(self, cmd, dat):
+		#this updates the virtual keypad
+		#for char in dat:
+		#	self.logger.debug(f"LCD DEBUG: {ord(char)}")
+		m = re.search(r'^...(..)(.*)$', dat)
+		if m:
+			lcdText = re.sub(r'[^ a-zA-Z0-9_/\:-]+', ' ', m.group(2))
+			half = int(len(lcdText)/2)
+			half1 = lcdText[:half]
+			half2 = lcdText[half:]
+			self.logger.debug(f"LCD Update, Line 1:'{half1}' Line 2:'{half2}'")
+			self.updateKeypad(0, 'LCDLine1', half1)
+			self.updateKeypad(0, 'LCDLine2', half2)
 
-		elif cmd == '906':
-			self.logger.debug("Buzzer Status")
 
-		elif cmd == '907':
-			self.logger.debug("Door Chime Status")
+	def rxLedStatus(self, cmd, dat):
+		m = re.search(r'^(.)(.)$', dat)
+		if m:
+			(ledName, ledState) = (kLedIndexList[int(m.group(1))], kLedStateList[int(m.group(2))])
+			self.logger.debug(f"LED '{ledName}' is '{ledState}'.")
 
-		elif cmd == '908':
-			m = re.search(r'^(..)(..)(..)$', dat)
-			if m:
-				self.logger.debug(f"DSC Software Version {m.group(1)}.{m.group(2)}")
+			if ledState == 'flashing':
+				ledState = 'on'
 
-		elif cmd == '912':
-			self.logger.error("Command Output Pressed")
+			if ledName == 'Ready':
+				self.updateKeypad(1, 'LEDReady', ledState)
+			elif ledName == 'Armed':
+				self.updateKeypad(1, 'LEDArmed', ledState)
+			elif ledName == 'Trouble':
+				self.updateKeypad(1, 'LEDTrouble', ledState)
+			elif ledName == 'Bypass':
+				self.updateKeypad(1, 'LEDBypass', ledState)
+			elif ledName == 'Memory':
+				self.updateKeypad(1, 'LEDMemory', ledState)
 
-		elif cmd == '921':
-			self.logger.error("Master Code Required")
 
-		elif cmd == '922':
-			self.logger.error("Installer Code Required")
+	def rxSoftwareVersion(self, cmd, dat):
+		m = re.search(r'^(..)(..)(..)$', dat)
+		if m:
+			self.logger.debug(f"DSC Software Version {m.group(1)}.{m.group(2)}")
 
-		else:
-			#self.logger.debug(f"RX: {data}")
-			self.logger.debug(f"Unrecognized command received (Cmd:{cmd} Dat:{dat} Sum:{sum})")
 
-		return (cmd, dat)
+	def rxCommandOutputPressed(self, cmd, dat):
+		self.logger.error("Command Output Pressed")
 
 
 
@@ -1984,41 +2999,66 @@ class Plugin(indigo.PluginBase):
 			temp = 127 - temp
 		self.logger.debug(f"Temp sensor {sensorNum} {key} temp now {temp} degrees.")
 		if sensorNum in list(self.tempList.keys()):
+			sensorId = self.tempList[sensorNum].id
 			if key == 'inside':
-				self.tempList[sensorNum].updateStateOnServer(key="temperatureInside", value=temp)
+				self.bufferState(sensorId, "temperatureInside", temp)
 			elif key == 'outside':
-				self.tempList[sensorNum].updateStateOnServer(key="temperatureOutside", value=temp)
+				self.bufferState(sensorId, "temperatureOutside", temp)
 			elif key == 'cool':
-				self.tempList[sensorNum].updateStateOnServer(key="setPointCool", value=temp)
+				self.bufferState(sensorId, "setPointCool", temp)
 			elif key == 'heat':
-				self.tempList[sensorNum].updateStateOnServer(key="setPointHeat", value=temp)
+				self.bufferState(sensorId, "setPointHeat", temp)
 
 			if self.tempList[sensorNum].pluginProps['zoneLogChanges'] == 1:
 				self.logger.info(f"Temp sensor {sensorNum} {key} temp now {temp} degrees.")
 
 
+	# Adds a zone group to the zone to zone group index and counts how many of
+	# its member zones are currently open or tripped. After this the counts are
+	# kept up to date by updateZoneState as member zones change.
+	#
+	def indexZoneGroup(self, zoneGroupDevId):
+		counts = {kZoneStateOpen: 0, kZoneStateTripped: 0}
+		for zoneId in self.zoneGroupList[zoneGroupDevId]:
+			zoneId = int(zoneId)
+			self.zoneGroupIndex.setdefault(zoneId, set()).add(zoneGroupDevId)
+			try:
+				zoneState = self.getState(zoneId, 'state')
+			except KeyError:
+				self.logger.warning(f"Zone group {zoneGroupDevId} member {zoneId} no longer exists.")
+				continue
+			if zoneState in counts:
+				counts[zoneState] += 1
+		self.zoneGroupCounts[zoneGroupDevId] = counts
+
+
+	def unindexZoneGroup(self, zoneGroupDevId):
+		for zoneId in self.zoneGroupList[zoneGroupDevId]:
+			zoneGroups = self.zoneGroupIndex.get(int(zoneId))
+			if zoneGroups is not None:
+				zoneGroups.discard(zoneGroupDevId)
+				if not zoneGroups:
+					del self.zoneGroupIndex[int(zoneId)]
+		self.zoneGroupCounts.pop(zoneGroupDevId, None)
+
+
 	# Updates zone group
 	#
 	def updateZoneGroup(self, zoneGroupDevId):
 
-		zoneGrp = indigo.devices[zoneGroupDevId]
-
-		zoneGrp.updateStateOnServer(key="AnyMemberLastChangedTimer", value=0)
-		zoneGrp.updateStateOnServer(key="AnyMemberLastChangedShort", value="0m")
+		self.resetTimer(zoneGroupDevId, "AnyMemberLastChangedTimer")
 
-		newState = kZoneGroupStateClosed
-		for zoneId in self.zoneGroupList[zoneGroupDevId]:
-			zoneState = indigo.devices[int(zoneId)].states['state']
-			if (zoneState != kZoneStateClosed) and (newState != kZoneGroupStateTripped):
-				if zoneState == kZoneStateOpen:
-					newState = kZoneGroupStateOpen
-				elif zoneState == kZoneStateTripped:
-					newState = kZoneGroupStateTripped
+		counts = self.zoneGroupCounts[zoneGroupDevId]
+		if counts[kZoneStateTripped] > 0:
+			newState = kZoneGroupStateTripped
+		elif counts[kZoneStateOpen] > 0:
+			newState = kZoneGroupStateOpen
+		else:
+			newState = kZoneGroupStateClosed
 
-		if zoneGrp.states['state'] != newState:
-			zoneGrp.updateStateOnServer(key="EntireGroupLastChangedTimer", value=0)
-			zoneGrp.updateStateOnServer(key="EntireGroupLastChangedShort", value="0m")
-			zoneGrp.updateStateOnServer(key="state", value=newState)
+		if self.getState(zoneGroupDevId, 'state') != newState:
+			self.resetTimer(zoneGroupDevId, "EntireGroupLastChangedTimer")
+			self.bufferState(zoneGroupDevId, "state", newState)
 
 
 	# Updates indigo variable instance var with new value varValue
@@ -2027,27 +3067,32 @@ class Plugin(indigo.PluginBase):
 
 		if zoneKey in list(self.zoneList.keys()):
 			try:
-				zone = indigo.devices[self.zoneList[zoneKey]]
+				zone = self.getDevice(self.zoneList[zoneKey])
 			except:
 				self.logger.warning("possible Server Communication Error")   #catching servercommunicationerror
 				pass
 			zoneType = zone.pluginProps['zoneType']
 			#zonePartition = zone.pluginProps['zonePartition']
+			if zone.id in self.staleStates:
+				self.confirmState(zone.id, 'state')
 
 			# If the new state is different from the old state
 			# then lets update timers and set the new state
-			if zone.states['state'] != newState:
+			oldState = self.getState(zone.id, 'state')
+			if oldState != newState:
 				# This is a new state, update all states and timers
-				zone.updateStateOnServer(key="LastChangedShort", value="0m")
-				zone.updateStateOnServer(key="LastChangedTimer", value=0)
-				zone.updateStateOnServer(key="state", value=newState)
+				self.resetTimer(zone.id, "LastChangedTimer")
+				self.bufferState(zone.id, "state", newState)
 				timeNowFormatted = datetime.now().strftime("%H:%M:%S, %Y-%m-%d")
 
-				# Check if this zone is assigned to a zone group so we can update it
-				for devId in self.zoneGroupList:
-					#self.logger.debug(f"Zone Group ID: {zone.id} contains {zoneGroupList[devId]}")
-					if str(zone.id) in self.zoneGroupList[devId]:
-						self.updateZoneGroup(devId)
+				# Update the open/tripped counts of any zone groups this zone is in
+				for devId in self.zoneGroupIndex.get(zone.id, ()):
+					counts = self.zoneGroupCounts[devId]
+					if oldState in counts:
+						counts[oldState] -= 1
+					if newState in counts:
+						counts[newState] += 1
+					self.updateZoneGroup(devId)
 
 				if 'var' in list(zone.pluginProps.keys()):
 					self.updateVariable(zone.pluginProps['var'], newState)
@@ -2069,11 +3114,29 @@ class Plugin(indigo.PluginBase):
 					indigo.variable.updateValue("DSC_Last_Motion_Active", value=f"{zone.name} at {timeNowFormatted}.")
 
 
+	# Bypassed zones are kept in the zone table's bypassMask, bit 0 for zone 1. Only
+	# the zones whose bit changed are updated.
+	#
+	def updateBypassMask(self, bypassMask):
+		changed = bypassMask ^ self.zoneTable.bypassMask
+		self.zoneTable.bypassMask = bypassMask
+		while changed:
+			bit = changed & -changed
+			changed ^= bit
+			self.updateZoneBypass(bit.bit_length(), kZoneBypassYes if bypassMask & bit else kZoneBypassNo)
+
+
+	# Tripped zones that have a device, in zone order
+	#
+	def getTrippedZones(self):
+		return [zone for zone in maskZones(self.zoneTable.trippedMask) if zone in self.zoneList]
+
+
 	def updateZoneBypass(self, zoneKey, newState):
 
 		if zoneKey in list(self.zoneList.keys()):
 			try:
-				zone = indigo.devices[self.zoneList[zoneKey]]
+				zone = self.getDevice(self.zoneList[zoneKey])
 			except:
 				self.logger.warning("possible Server Communication Error")   #catching servercommunicationerror
 				pass
@@ -2081,9 +3144,9 @@ class Plugin(indigo.PluginBase):
 
 			# If the new bypass state is different from the old state
 			# then lets set the new state
-			if zone.states['bypass'] != newState:
+			if self.getState(zone.id, 'bypass') != newState:
 				# This is a new bypass state, update all states
-				zone.updateStateOnServer(key="bypass", value=newState)
+				self.bufferState(zone.id, "bypass", newState)
 
 				if 'var' in list(zone.pluginProps.keys()):
 					self.updateVariable(zone.pluginProps['var'], newState)
@@ -2098,51 +3161,248 @@ class Plugin(indigo.PluginBase):
 
 		self.logger.threaddebug(f"Updating Custom State {stateName} for Keypad on Partition {partition} to {newState}.")
 
-		# If we're updating the main keypad state, update the variable too
+		# If we're updating the main keypad state, update the variable too. Alarm Panel
+		# devices show it in their own alarmState instead.
 		if stateName == 'state':
-			self.updateVariable(self.pluginPrefs['variableState'], newState)
+			panelId = self.currentPanel().devId
+			if panelId == 0:
+				self.updateVariable(self.pluginPrefs['variableState'], newState)
+			elif panelId in self.stateMirror:
+				self.bufferState(panelId, 'alarmState', newState)
 
 		if partition == 0:
 			for keyk in self.keypadList.keys():
-				try:
-					keyp = indigo.devices[self.keypadList[keyk]]
-				except:
-					self.logger.warning("possible Server Communication Error")   #catching servercommunicationerror
-					pass
-				keyp.updateStateOnServer(key=stateName, value=newState)
+				self.bufferState(self.keypadList[keyk], stateName, newState)
 			return
 
 		if partition in list(self.keypadList.keys()):
+			self.bufferState(self.keypadList[partition], stateName, newState)
+			if self.keypadList[partition] in self.staleStates:
+				self.confirmState(self.keypadList[partition], stateName)
+
+
+	# Collects a device state change. All changes collected for a device are written
+	# with a single updateStatesOnServer call by flushStates, which readPacket calls
+	# after each packet has been handled. Changes to a value the device already has
+	# are dropped.
+	#
+	def bufferState(self, devId, key, value):
+		pending = self.stateBuffer.get(devId)
+		if pending is None or key not in pending:
+			states = self.stateMirror.get(devId)
+			if states is not None and key in states and states[key] == value:
+				return
+		self.stateBuffer.setdefault(devId, {})[key] = value
+
+
+	# Returns the value a state will have once the buffered changes are written.
+	# Mirrored devices are answered locally without asking the Indigo server.
+	#
+	def getState(self, devId, key):
+		pending = self.stateBuffer.get(devId)
+		if pending is not None and key in pending:
+			return pending[key]
+		states = self.stateMirror.get(devId)
+		if states is not None and key in states:
+			return states[key]
+		self.countIndigoCall('devices[]')
+		return indigo.devices[devId].states[key]
+
+
+	def flushStates(self):
+		if not self.stateBuffer:
+			return
+		stateBuffer = self.stateBuffer
+		self.stateBuffer = {}
+		for devId, states in stateBuffer.items():
 			try:
-				keyp = indigo.devices[self.keypadList[partition]]
-			except:
-				self.logger.warning("possible Server Communication Error")   #catching servercommunicationerror
-				pass
-			keyp.updateStateOnServer(key=stateName, value=newState)
+				dev = self.getDevice(devId)
+				self.countIndigoCall('updateStatesOnServer')
+				dev.updateStatesOnServer([{'key': key, 'value': value} for key, value in states.items()])
+			except Exception as err:
+				self.logger.warning(f"possible Server Communication Error: {str(err)}")   #catching servercommunicationerror
+			else:
+				if devId in self.stateMirror:
+					self.stateMirror[devId].update(states)
+
+
+	######################################################################################
+	# Warm Start Snapshot
+	######################################################################################
+
+	# The snapshot is a small JSON file next to the plugin's preferences with the
+	# zone and partition states, the tripped zone list and the trouble code. Indigo
+	# keeps device states itself, but keypads used to be reset to disarmed on every
+	# start, and the file's age tells how long ago the states were last confirmed.
+	#
+	def getSnapshotFileName(self):
+		panelId = self.currentPanel().devId
+		suffix = f".{panelId}" if panelId else ""
+		return os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins", f"{self.pluginId}.snapshot{suffix}.json")
+
+
+	def loadSnapshot(self):
+		self.snapshot = None
+		try:
+			with open(self.getSnapshotFileName()) as snapshotFile:
+				snapshot = json.load(snapshotFile)
+		except FileNotFoundError:
+			return
+		except (OSError, ValueError) as err:
+			self.logger.warning(f"Unable to read the state snapshot, starting cold: {str(err)}")
+			return
+
+		age = time.time() - snapshot.get('savedTime', 0)
+		if not 0 <= age < kWarmStartMaxAge:
+			self.logger.debug(f"State snapshot is {int(age / 60)} minutes old, starting cold.")
+			return
+		self.snapshot = snapshot
+		self.zoneTable.trippedMask = zonesMask(snapshot.get('trippedZoneList', []))
+		self.troubleCode = snapshot.get('troubleCode', 0)
+		self.logger.debug(f"Restoring states from a {int(age)} second old snapshot until the panel confirms them.")
+
+
+	def saveSnapshot(self):
+		snapshot = {
+			'savedTime': time.time(),
+			'zones': {str(zone): {key: self.getState(devId, key) for key in kSnapshotZoneStates} for (zone, devId) in self.zoneList.items() if devId in self.stateMirror},
+			'partitions': {str(partition): {key: self.getState(devId, key) for key in kSnapshotKeypadStates} for (partition, devId) in self.keypadList.items() if devId in self.stateMirror},
+			'trippedZoneList': maskZones(self.zoneTable.trippedMask),
+			'troubleCode': self.troubleCode,
+		}
+		fileName = self.getSnapshotFileName()
+		try:
+			with open(fileName + ".tmp", "w") as snapshotFile:
+				json.dump(snapshot, snapshotFile)
+			os.replace(fileName + ".tmp", fileName)
+		except (OSError, KeyError, TypeError) as err:
+			self.logger.warning(f"Unable to save the state snapshot: {str(err)}")
+
+
+	# Called from deviceStartComm. Writes the snapshot's states for a zone or partition
+	# to its device, marked stale, and returns True, or returns False if there are none.
+	#
+	def restoreSnapshotStates(self, dev, section, number, keys):
+		if self.snapshot is None:
+			if dev.states.get('StaleState') is True:
+				dev.updateStateOnServer(key='StaleState', value=False)
+			return False
+		states = self.snapshot.get(section, {}).get(str(number))
+		if not states:
+			return False
+		states = {key: states[key] for key in keys if key in states}
+		states['StaleState'] = True
+		dev.updateStatesOnServer([{'key': key, 'value': value} for key, value in states.items()])
+		del states['StaleState']
+		self.staleStates[dev.id] = set(states)
+		return True
+
+
+	# A restored state has been reported by the panel. The device is no longer stale
+	# once its main state has been; the other restored states are kept track of
+	# until reconcileSnapshot.
+	#
+	def confirmState(self, devId, key):
+		staleKeys = self.staleStates[devId]
+		if key == 'state' and key in staleKeys:
+			self.bufferState(devId, 'StaleState', False)
+		staleKeys.discard(key)
+		if not staleKeys:
+			del self.staleStates[devId]
+
+
+	def reconcileSnapshot(self):
+		self.reconcileTime = 0
+		if self.staleStates:
+			self.logger.debug(f"The status dump did not confirm the restored states of {len(self.staleStates)} devices.")
+		for (devId, staleKeys) in self.staleStates.items():
+			if devId in self.keypadList.values():
+				for key in staleKeys:
+					if key in kKeypadColdStates:
+						self.bufferState(devId, key, kKeypadColdStates[key])
+			self.bufferState(devId, 'StaleState', False)
+		self.staleStates = {}
+		self.flushStates()
+
+
+	######################################################################################
+	# Local Device Mirror
+	######################################################################################
+
+	# Zone, zone group, keypad and temperature devices are mirrored locally from
+	# deviceStartComm until deviceStopComm, and refreshed by deviceUpdated, so
+	# packet handlers do not need to fetch a device copy from the server.
+	#
+	def mirrorDevice(self, dev):
+		self.devMirror[dev.id] = dev
+		self.stateMirror[dev.id] = dict(dev.states)
+
+
+	def unmirrorDevice(self, devId):
+		self.devMirror.pop(devId, None)
+		self.stateMirror.pop(devId, None)
+
+
+	def getDevice(self, devId):
+		dev = self.devMirror.get(devId)
+		if dev is None:
+			self.countIndigoCall('devices[]')
+			dev = indigo.devices[devId]
+		return dev
 
 
 	######################################################################################
 	# Sending email of tripped zones
 	######################################################################################
 
+	# The first tripped zone is emailed straight away. Zones tripped within the digest
+	# window after that are counted and sent together in one follow up email by
+	# sendZoneTrippedDigest, called from the concurrent thread.
+	#
 	def sendZoneTrippedEmail(self):
 
-		if not self.configEmailUrgent or not self.trippedZoneList:
+		if not self.configEmailUrgent or not self.zoneTable.trippedMask:
+			return
+
+		if self.configEmailDigestWindow > 0:
+			timeNow = time.time()
+			if timeNow < self.trippedEmailHoldUntil:
+				self.trippedEmailSuppressed += 1
+				return
+			self.trippedEmailHoldUntil = timeNow + self.configEmailDigestWindow
+
+		self.queueZoneTrippedEmail()
+
+
+	def sendZoneTrippedDigest(self):
+		suppressed = self.trippedEmailSuppressed
+		self.trippedEmailSuppressed = 0
+
+		if not self.configEmailUrgent or not self.zoneTable.trippedMask:
 			return
 
+		self.trippedEmailHoldUntil = time.time() + self.configEmailDigestWindow
+		self.queueZoneTrippedEmail(suppressed)
+
+
+	def queueZoneTrippedEmail(self, suppressed=0):
+
 		theBody = "The following zone(s) have been tripped:\n\n"
 
-		for zoneNum in self.trippedZoneList:
+		for zoneNum in self.getTrippedZones():
 
-			if zoneNum in self.closeTheseZonesList:
-				stateNow = "closed"
-			else:
+			if self.zoneTable.isOpen(zoneNum):
 				stateNow = "open"
+			else:
+				stateNow = "closed"
 
-			zone = indigo.devices[self.zoneList[zoneNum]]
+			zone = self.getDevice(self.zoneList[zoneNum])
 
 			theBody += f"{zone.name} (currently {stateNow})\n"
 
+		if suppressed > 0:
+			theBody += f"\n{suppressed} zone trip update(s) since the last email were combined into this one.\n"
+
 		theBody += "\n--\nDSC Alarm Plugin\n\n"
 
 		self.logger.info(f"Sending zone tripped email to {self.configEmailUrgent}.")
@@ -2151,7 +3411,8 @@ class Plugin(indigo.PluginBase):
 		if contentPrefix:
 			theBody = contentPrefix + "\n\n" + theBody
 
-		indigo.server.sendEmailTo(self.configEmailUrgent, subject=self.configEmailUrgentSubject, body=theBody)
+		# the body always lists every tripped zone, so it replaces one still waiting to be sent
+		self.queueEmail(self.configEmailUrgent, self.configEmailUrgentSubject, theBody, mergeKey='zoneTripped')
 
 ##########################################################################################
 ############# Kidney514 ##########  Sending email of who is disarming
@@ -2168,7 +3429,7 @@ class Plugin(indigo.PluginBase):
 		if contentPrefix:
 			bodyText = contentPrefix + "\n\n" + bodyText
 
-		indigo.server.sendEmailTo(self.configEmailDisarm, subject=self.configEmailDisarmSubject, body=bodyText)
+		self.queueEmail(self.configEmailDisarm, self.configEmailDisarmSubject, bodyText)
 
 ##########################################################################################
 # sending emails
@@ -2186,7 +3447,7 @@ class Plugin(indigo.PluginBase):
 		if contentPrefix:
 			bodyText = contentPrefix + "\n\n" + bodyText
 
-		indigo.server.sendEmailTo(self.configEmailNotice, subject=self.configEmailNoticeSubject, body=bodyText)
+		self.queueEmail(self.configEmailNotice, self.configEmailNoticeSubject, bodyText)
 
 
 	def sendPanicEmail(self, bodyText):
@@ -2200,7 +3461,7 @@ class Plugin(indigo.PluginBase):
 		if contentPrefix:
 			bodyText = contentPrefix + "\n\n" + bodyText
 
-		indigo.server.sendEmailTo(self.configEmailUrgent, subject=self.configEmailUrgentSubject, body=bodyText)
+		self.queueEmail(self.configEmailUrgent, self.configEmailUrgentSubject, bodyText)
 		# if no email address is specified the speak part does not trigger
 		say = f"{self.pluginPrefs['speakTextPanic']} Keypad: {bodyText}."
 		self.sayThis(say)
@@ -2218,19 +3479,46 @@ class Plugin(indigo.PluginBase):
 		if contentPrefix:
 			bodyText = contentPrefix + "\n\n" + bodyText
 
-		indigo.server.sendEmailTo(self.configEmailUrgent, subject=self.configEmailUrgentSubject, body=bodyText)
+		self.queueEmail(self.configEmailUrgent, self.configEmailUrgentSubject, bodyText)
 		# if no email address specified the speak part does not trigger
 		say = f"{self.pluginPrefs['speakTextPanic']} Keypad: {bodyText}."
 		self.sayThis(say)
 
 
+	def queueEmail(self, address, subject, body, mergeKey=None):
+		if self.emailWorker is None:
+			self.deliverEmail((address, subject, body))
+			return
+		self.emailWorker.post((address, subject, body), mergeKey)
+
+
+	# Called by the email worker thread
+	#
+	def deliverEmail(self, email):
+		(address, subject, body) = email
+		self.countIndigoCall('server.sendEmailTo')
+		indigo.server.sendEmailTo(address, subject=subject, body=body)
+
+
 	def sayThis(self, text):
 		self.logger.debug(f"SAY: {text}")
+		if self.speechWorker is None:
+			self.deliverSpeech(text)
+			return
+		# the same announcement waiting twice only needs saying once
+		self.speechWorker.post(text, mergeKey=text)
+
+
+	# Called by the speech worker thread
+	#
+	def deliverSpeech(self, text):
 		# The default variable is DSC_Alarm_Text
 		if self.configSpeakVariable is not None:
 			if self.configSpeakVariable in indigo.variables:
+				self.countIndigoCall('variable.updateValue')
 				indigo.variable.updateValue(self.configSpeakVariable, value=text)
 		else:
+			self.countIndigoCall('server.speak')
 			indigo.server.speak(text)
 
 
@@ -2245,9 +3533,9 @@ class Plugin(indigo.PluginBase):
 		if textId == 'speakTextFailedToArm':
 			zones = 0
 			zoneText = ''
-			for zoneNum in self.zoneList.keys():
-				zone = indigo.devices[self.zoneList[zoneNum]]
-				if zone.states['state.open'] is True:
+			for zoneNum in maskZones(self.zoneTable.getOpenMask()):
+				if zoneNum in self.zoneList:
+					zone = self.getDevice(self.zoneList[zoneNum])
 					if zones > 0:
 						zoneText += ', '
 					zoneText += zone.name.replace("Alarm_", "")
@@ -2265,8 +3553,8 @@ class Plugin(indigo.PluginBase):
 		elif textId == 'speakTextTripped':
 			zones = 0
 			zoneText = ''
-			for zoneNum in self.trippedZoneList:
-				zone = indigo.devices[self.zoneList[zoneNum]]
+			for zoneNum in self.getTrippedZones():
+				zone = self.getDevice(self.zoneList[zoneNum])
 				if zones > 0:
 					zoneText += ', '
 				zoneText += zone.name.replace("Alarm_", "")
@@ -2305,6 +3593,50 @@ class Plugin(indigo.PluginBase):
 
 	# Converts given time in minutes to a human format e.g. 3m, 5h, 2d, etc.
 	#
+	# Zone and zone group timers are kept as the time they were last reset. The
+	# minute counts and their short display states are worked out from that by
+	# updateTimerStates once a minute.
+	#
+	def startTimer(self, devId, timerKey, minutes=0):
+		self.timerStarted[(devId, timerKey)] = time.time() - minutes * 60
+
+
+	def resetTimer(self, devId, timerKey):
+		self.startTimer(devId, timerKey)
+		self.bufferState(devId, timerKey, 0)
+		self.bufferState(devId, kTimerShortStates[timerKey], "0m")
+
+
+	def updateTimerStates(self):
+		timeNow = time.time()
+		if self.configLazyTimers is True and timeNow >= self.watchedTimersNext:
+			self.watchedTimersNext = timeNow + kWatchedTimersRefresh
+			self.findWatchedTimers()
+
+		for (devId, timerKey), started in list(self.timerStarted.items()):
+			minutes = int((timeNow - started) / 60)
+			shortKey = kTimerShortStates[timerKey]
+			shortTime = self.getShortTime(minutes)
+			if self.configLazyTimers is False or (devId, timerKey) in self.watchedTimers or self.getState(devId, shortKey) != shortTime:
+				self.bufferState(devId, timerKey, minutes)
+				self.bufferState(devId, shortKey, shortTime)
+
+
+	# Find the timer states used by Device State Changed triggers so lazy timer
+	# states still keep those up to date every minute
+	#
+	def findWatchedTimers(self):
+		watchedTimers = set()
+		try:
+			for trigger in indigo.triggers.iter("indigo.devStateChange"):
+				if trigger.enabled and trigger.stateSelector in kTimerShortStates:
+					watchedTimers.add((trigger.deviceId, trigger.stateSelector))
+		except Exception as err:
+			self.logger.warning(f"Unable to read device state triggers: {str(err)}")
+			return
+		self.watchedTimers = watchedTimers
+
+
 	def getShortTime(self, minutes):
 
 		# If time is less than 100 min then show XXm
@@ -2341,203 +3673,244 @@ class Plugin(indigo.PluginBase):
 	# Concurrent Thread
 	######################################################################################
 
-	def runConcurrentThread(self):
-		self.logger.threaddebug("runConcurrentThread called")
-		self.minuteTracker = time.time() + 60
-		self.nextUpdateCheckTime = 0
-
-		# While Indigo hasn't told us to shutdown
-		while self.shutdown is False:
-
-			self.timeNow = time.time()
-
-			if self.state == self.States.STARTUP:
-				self.logger.debug("STATE: Startup")
-
-				if self.configRead is False:
-					if self.getConfiguration(self.pluginPrefs) is True:
-						self.configRead = True
+	# One step of the connection state machine of the current panel. Called in a loop
+	# by runConcurrentThread for the panel in the plugin config, and by runPanelThread
+	# for each Alarm Panel device.
+	#
+	def runStateMachine(self):
+		if self.state == self.States.STARTUP:
+			self.logger.debug("STATE: Startup")
+
+			# Alarm Panel devices wait for the concurrent thread to read the plugin config
+			if self.configRead is False and self.currentPanel() is self.defaultPanel:
+				if self.getConfiguration(self.pluginPrefs) is True:
+					self.configRead = True
+
+			if self.configRead is True:
+				self.state = self.States.BOTH_INIT
+
+			self.sleep(1)
+
+		elif self.state == self.States.HOLD:
+			if self.configRead is False:
+				self.state = self.States.STARTUP
+			self.sleep(1)
+
+		elif self.state == self.States.HOLD_RETRY:
+			self.countConnectionEvent('HOLD_RETRY')
+			self.closePort()
+			self.reconnectAttempts += 1
+			retryDelay = self.getReconnectDelay(self.reconnectAttempts)
+			self.logger.warning(f"Plugin will attempt to re-initialize {self.currentPanel().name} again in {retryDelay:.0f} seconds (attempt {self.reconnectAttempts}).")
+			self.nextRetryTime = self.timeNow + retryDelay
+			self.state = self.States.HOLD_RETRY_LOOP
+
+		elif self.state == self.States.HOLD_RETRY_LOOP:
+			if self.configRead is False:
+				self.state = self.States.STARTUP
+			if self.timeNow >= self.nextRetryTime:
+				self.state = self.States.BOTH_INIT
+			self.sleep(1)
+
+		elif self.state == self.States.BOTH_INIT:
+			self.countConnectionEvent('BOTH_INIT')
+			self.requeueTxInFlight()
+			if self.openPort() is True:
+				if self.useSerial is False:
+					self.state = self.States.SO_CONNECT
+					self.sleep(1)
 
-				if self.configRead is True:
-					self.state = self.States.BOTH_INIT
+					# Enable pinging every 5 minutes
+					self.nextPingTime = self.timeNow + kPingInterval
+				else:
+					self.state = self.States.ENABLE_TIME_BROADCAST
 
-				self.sleep(1)
+			else:
+				self.state = self.States.HOLD_RETRY
 
-			elif self.state == self.States.HOLD:
-				if self.configRead is False:
-					self.state = self.States.STARTUP
-				self.sleep(1)
+		elif self.state == self.States.SO_CONNECT:
+			err = True
 
-			elif self.state == self.States.HOLD_RETRY:
-				self.logger.warning(f"Plugin will attempt to re-initialize again in {self.currentHoldRetryTime} minutes.")
-				self.nextRetryTime = self.timeNow + (kHoldRetryTimeMinutes*60)
-				self.state = self.States.HOLD_RETRY_LOOP
+			# Read packet to clear the port of the 5053 login request
+			self.readPacket()
 
-			elif self.state == self.States.HOLD_RETRY_LOOP:
-				if self.configRead is False:
-					self.state = self.States.STARTUP
-				if self.timeNow >= self.nextRetryTime:
-					self.state = self.States.BOTH_INIT
-				self.sleep(1)
+			attemptLogin = True
+			while attemptLogin is True:
+				attemptLogin = False
+				rx = self.sendPacket('005' + self.panelPrefs['TwoDS_Password'], waitFor='505')
+				if not rx or rx == "-":
+					self.logger.error("Timeout waiting for Envisalink to respond to login request.")
+				else:
+					rx = int(rx)
+					if rx == 0:
+						self.logger.error("Envisalink refused login request.")
+					elif rx == 1:
+						err = False
+						self.logger.info("Connected to Envisalink.")
+					elif rx == 3:
+						# 2DS sent login request, retry (Happens when socket is first opened)
+						self.logger.debug("Received login request, retrying login...")
+						attemptLogin = True
+					else:
+						self.logger.error("Unknown response from Envisalink login request.")
 
-			elif self.state == self.States.BOTH_INIT:
-				if self.openPort() is True:
-					if self.useSerial is False:
-						self.state = self.States.SO_CONNECT
-						self.sleep(1)
+			# This delay is required otherwise 2DS locks up
+			self.sleep(1)
 
-						# Enable pinging every 5 minutes
-						self.nextPingTime = self.timeNow + kPingInterval
-					else:
-						self.state = self.States.ENABLE_TIME_BROADCAST
+			if err is True:
+				self.state = self.States.HOLD_RETRY
+			else:
+				self.state = self.States.ENABLE_TIME_BROADCAST
 
-				else:
-					#self.logger.error(f"Error opening port, will retry in {self.currentHoldRetryTime} minutes.")
-					self.state = self.States.HOLD_RETRY
 
-			elif self.state == self.States.SO_CONNECT:
-				err = True
+		elif self.state == self.States.ENABLE_TIME_BROADCAST:
 
-				# Read packet to clear the port of the 5053 login request
-				self.readPacket()
+			# Enable time broadcast
+			self.logger.debug("Enabling Time Broadcast")
+			rx = self.sendPacket('0561')
+			if rx:
+				self.logger.debug("Time Broadcast enabled.")
+				self.state = self.States.BOTH_PING
+			else:
+				self.logger.error("Error enabling Time Broadcast.")
+				self.state = self.States.HOLD_RETRY
+
+		elif self.state == self.States.BOTH_PING:
+
+			#Ping the panel to confirm we are in communication
+			err = True
+			self.logger.debug("Pinging the panel to test communication...")
+			rx = self.sendPacket('000')
+			if rx:
+				self.logger.debug("Ping was successful.")
+				err = False
+			else:
+				self.logger.error("Error pinging panel, aborting.")
 
-				attemptLogin = True
-				while attemptLogin is True:
-					attemptLogin = False
-					rx = self.sendPacket('005' + self.pluginPrefs['TwoDS_Password'], waitFor='505')
-					if not rx or rx == "-":
-						self.logger.error("Timeout waiting for Envisalink to respond to login request.")
-					else:
-						rx = int(rx)
-						if rx == 0:
-							self.logger.error("Envisalink refused login request.")
-						elif rx == 1:
-							err = False
-							self.logger.info("Connected to Envisalink.")
-						elif rx == 3:
-							# 2DS sent login request, retry (Happens when socket is first opened)
-							self.logger.debug("Received login request, retrying login...")
-							attemptLogin = True
-						else:
-							self.logger.error("Unknown response from Envisalink login request.")
-
-				# This delay is required otherwise 2DS locks up
-				self.sleep(1)
-
-				if err is True:
+			if err is True:
+				self.state = self.States.HOLD_RETRY
+			else:
+				#Request a full state update
+				self.logger.debug("Requesting a full state update.")
+				rx = self.sendPacket('001')
+				if not rx:
+					self.logger.error("Error getting state update.")
 					self.state = self.States.HOLD_RETRY
 				else:
-					self.state = self.States.ENABLE_TIME_BROADCAST
-
+					self.logger.debug("State update request successful, initialization complete, starting normal operation.")
+					self.state = self.States.BOTH_POLL
+					self.connectedSince = time.time()
+					self.reconnectAttempts = 0
+					self.updatePanelDevice(True)
+					# devices started from now on take their states from the panel
+					self.snapshot = None
+					if self.staleStates:
+						self.reconcileTime = time.time() + kReconcileSeconds
+
+		elif self.state == self.States.BOTH_POLL:
+			if self.configRead is False:
+				self.state = self.States.STARTUP
+			else:
 
-			elif self.state == self.States.ENABLE_TIME_BROADCAST:
+				# Ping every 5 minutes, or sooner when the connection has gone quiet
+				if (self.useSerial is False) and (self.timeNow > self.nextPingTime or self.timeNow - self.rxLastPacketTime > kRxIdleProbeSeconds):
+					if not self.isPingPending():
+						#self.logger.debug("Pinging Envisalink")
+						self.queueCommand('000')
+						self.nextPingTime = self.timeNow + kPingInterval
 
-				# Enable time broadcast
-				self.logger.debug("Enabling Time Broadcast")
-				rx = self.sendPacket('0561')
-				if rx:
-					self.logger.debug("Time Broadcast enabled.")
-					self.state = self.States.BOTH_PING
-				else:
-					self.logger.error("Error enabling Time Broadcast.")
-					self.state = self.States.HOLD_RETRY
+				# Send whatever the in-flight window allows, then keep dispatching
+				# received packets. ACKs are matched to commands by rxCommandAck.
+				self.dispatchTxQueue()
+				self.updateQueueGauges()
+				self.setRxTimeout(self.getRxPollTimeout())
+				(rxRsp, rxData) = self.readPacket()
+				# Handle the rest of a burst, such as the status dump after 001, in
+				# this iteration. It was read together with the first packet.
+				while rxRsp != '-' and self.rxBuffer.frames:
+					(rxRsp, rxData) = self.readPacket()
+				if rxRsp == '-':
+					# If we receive - socket has closed, lets re-init
+					self.logger.error("Tried to read data but socket seems to have closed.  Trying to re-initialize.")
+					self.connectionLost()
+					self.state = self.States.BOTH_INIT
+				elif self.checkTxTimeouts() is True:
+					self.logger.error("The panel did not answer keep-alive pings, the connection seems to be down.  Trying to re-initialize.")
+					self.connectionLost()
+					self.state = self.States.BOTH_INIT
 
-			elif self.state == self.States.BOTH_PING:
 
-				#Ping the panel to confirm we are in communication
-				err = True
-				self.logger.debug("Pinging the panel to test communication...")
-				rx = self.sendPacket('000')
-				if rx:
-					self.logger.debug("Ping was successful.")
-					err = False
-				else:
-					self.logger.error("Error pinging panel, aborting.")
+	def runPanelTimers(self):
+		# Abort a thermostat adjustment whose last step was not answered
+		if self.thermoDeadline and self.timeNow >= self.thermoDeadline:
+			self.logger.error(self.thermoSteps[0][1])
+			self.thermoSteps = []
+			self.thermoDeadline = 0
 
-				if err is True:
-					self.state = self.States.HOLD_RETRY
-				else:
-					#Request a full state update
-					self.logger.debug("Requesting a full state update.")
-					rx = self.sendPacket('001')
-					if not rx:
-						self.logger.error("Error getting state update.")
-						self.state = self.States.HOLD_RETRY
-					else:
-						self.logger.debug("State update request successful, initialization complete, starting normal operation.")
-						self.state = self.States.BOTH_POLL
+		# Check if the trouble timer counter is timing
+		# We need to know if the trouble light has remained off
+		# for a few seconds before we assume the trouble is cleared
+		if self.troubleClearedTime > 0 and self.timeNow >= self.troubleClearedTime:
+			self.troubleClearedTime = 0
+			self.troubleCode = 0
+			self.sendTroubleEmail("Trouble Code Cleared.")
 
-			elif self.state == self.States.BOTH_POLL:
-				if self.configRead is False:
-					self.state = self.States.STARTUP
-				else:
+		if self.repeatAlarmTripped is True:
+			#timeNow = time.time()
+			if self.timeNow >= self.repeatAlarmTrippedNext:
+				self.repeatAlarmTrippedNext = self.timeNow + 12
+				self.speak('speakTextTripped')
 
-					if (self.useSerial is False) and (self.timeNow > self.nextPingTime):
-						#self.logger.debug("Pinging Envisalink")
-						self.txCmdList.append((kCmdNormal, '000'))
-						self.nextPingTime = self.timeNow + kPingInterval
+		# Fall back from restored states the 001 status dump did not confirm
+		if self.reconcileTime and self.timeNow >= self.reconcileTime:
+			self.reconcileSnapshot()
 
-					if self.txCmdList:
-						(cmdType, data) = self.txCmdList[0]
-						if cmdType == kCmdNormal:
-							txRsp = self.sendPacket(data)
-							if txRsp == '-':
-								# If we receive - socket has closed, lets re-init
-								self.logger.error("Tried to send data but socket seems to have closed.  Trying to re-initialize.")
-								self.state = self.States.BOTH_INIT
-							else:
-								# send was a success, remove command from queue
-								del self.txCmdList[0]
-
-						elif cmdType == kCmdThermoSet:
-							self.setThermostat(data)
-							del self.txCmdList[0]
-					else:
-						(rxRsp, rxData) = self.readPacket()
-						if rxRsp == '-':
-							# If we receive - socket has closed, lets re-init
-							self.logger.error("Tried to read data but socket seems to have closed.  Trying to re-initialize.")
-							self.state = self.States.BOTH_INIT
+		# Send one email for the zones tripped since the last tripped zone email
+		if self.trippedEmailSuppressed > 0 and self.timeNow >= self.trippedEmailHoldUntil:
+			self.sendZoneTrippedDigest()
 
 
-			# Check if the trouble timer counter is timing
-			# We need to know if the trouble light has remained off
-			# for a few seconds before we assume the trouble is cleared
-			if self.troubleClearedTimer > 0:
-				self.troubleClearedTimer -= 1
-				if self.troubleClearedTimer == 0:
-					self.troubleCode = 0
-					self.sendTroubleEmail("Trouble Code Cleared.")
+	def runConcurrentThread(self):
+		self.logger.threaddebug("runConcurrentThread called")
+		self.minuteTracker = time.time() + 60
+		self.nextUpdateCheckTime = 0
 
-			if self.repeatAlarmTripped is True:
-				#timeNow = time.time()
-				if self.timeNow >= self.repeatAlarmTrippedNext:
-					self.repeatAlarmTrippedNext = self.timeNow + 12
-					self.speak('speakTextTripped')
+		# While Indigo hasn't told us to shutdown
+		while self.shutdown is False:
 
+			self.timeNow = time.time()
+			self.runStateMachine()
+			self.runPanelTimers()
 
 			# If a minute has elapsed
 			if self.timeNow >= self.minuteTracker:
 
-				# Increment all zone changed timers
+				# Update all zone and zone group changed timers. Timers are shared by all
+				# panels, whose handlers reset them under handlerLock.
 				self.minuteTracker += 60
-				for zoneKey in self.zoneList.keys():
-					zone = indigo.devices[self.zoneList[zoneKey]]
-					tmr = zone.states["LastChangedTimer"] + 1
-					zone.updateStateOnServer(key="LastChangedTimer", value=tmr)
-					zone.updateStateOnServer(key="LastChangedShort", value=self.getShortTime(tmr))
-
-				for zoneGroupDeviceId in self.zoneGroupList:
-					zoneGroupDevice = indigo.devices[zoneGroupDeviceId]
-					tmr = zoneGroupDevice.states["AnyMemberLastChangedTimer"] + 1
-					zoneGroupDevice.updateStateOnServer(key="AnyMemberLastChangedTimer", value=tmr)
-					zoneGroupDevice.updateStateOnServer(key="AnyMemberLastChangedShort", value=self.getShortTime(tmr))
-					tmr = zoneGroupDevice.states["EntireGroupLastChangedTimer"] + 1
-					zoneGroupDevice.updateStateOnServer(key="EntireGroupLastChangedTimer", value=tmr)
-					zoneGroupDevice.updateStateOnServer(key="EntireGroupLastChangedShort", value=self.getShortTime(tmr))
-
-
+				with self.handlerLock:
+					self.updateTimerStates()
+					self.flushStates()
+				self.latencyStats.rotate()
+				for panel in list(self.panels.values()):
+					if panel.state == self.States.BOTH_POLL:
+						with self.usePanel(panel):
+							self.saveSnapshot()
+
+
+		for panel in list(self.panels.values()):
+			self.stopPanel(panel)
+		if self.state == self.States.BOTH_POLL:
+			self.saveSnapshot()
 		self.closePort()
+		if self.rxCapture is not None:
+			self.menuStopCapture()
+		for worker in (self.emailWorker, self.speechWorker):
+			if worker is not None:
+				worker.stop()
+		self.stopMetricsServer()
+		if self.journal is not None:
+			self.journal.stop()
 		self.logger.threaddebug("Exiting Concurrent Thread")
 
 
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Encoding and decoding of DSC TPI frames, shared by the serial and socket transports.
+
+A frame is a 3 digit command code, its data, a checksum of two upper case hex digits
+and CR LF. The checksum is the sum of the command and data bytes modulo 256. Frames
+are handled as bytes, which is what the ports read and write: the checksum is a
+sum() over the bytes and decoding is fixed-width slicing, with a single ASCII decode
+for the command and data.
+
+packKeystrings splits the keys for 071 keystring commands into commands.
+
+FrameBuffer collects what the port returns, which may be several frames or part of
+one, and splits it into complete frames.
+"""
+
+import collections
+
+
+kTerminator = b"\r\n"
+
+# command code + checksum
+kMinFrameLength = 5
+
+# keys one 071 keystring command can carry after its partition digit
+kMaxKeystringKeys = 6
+
+
+def checksum(data):
+	return sum(data) & 0xFF
+
+
+# Returns the bytes to send for the command and data in the str data
+#
+def encodeFrame(data):
+	body = data.encode('ascii')
+	return b"%s%02X\r\n" % (body, sum(body) & 0xFF)
+
+
+# Decodes one received line, bytes or memoryview with or without its line end.
+# Returns (cmd, dat, checksumOk) with cmd and dat as str, or None if the line is
+# too short to be a frame. Raises ValueError if it contains characters that are
+# not ASCII or a checksum that is not hex.
+#
+def decodeFrame(line):
+	if not isinstance(line, bytes):
+		line = bytes(line)
+	frame = line.strip()
+	if len(frame) < kMinFrameLength:
+		return None
+	body = frame[:-2]
+	text = body.decode('ascii')
+	return (text[:3], text[3:], int(frame[-2:], 16) == sum(body) & 0xFF)
+
+
+# Packs a sequence of key groups, such as '*1' and the 2 digit zone numbers of a bypass,
+# into as few 071 keystrings as possible. A group is never split between keystrings,
+# so each command leaves the keypad at a clean point in the sequence.
+#
+def packKeystrings(groups, maxKeys=kMaxKeystringKeys):
+	keystrings = []
+	keys = ''
+	for group in groups:
+		if keys and len(keys) + len(group) > maxKeys:
+			keystrings.append(keys)
+			keys = ''
+		keys += group
+	if keys:
+		keystrings.append(keys)
+	return keystrings
+
+
+# Splits the bytes read from a port into frames. A frame that has not been received
+# completely is kept until the rest of it arrives with a later read.
+#
+class FrameBuffer(object):
+
+	# a partial frame longer than this is line noise, not a frame
+	kMaxPartialLength = 1024
+
+	def __init__(self):
+		self.partial = b''
+		self.frames = collections.deque()
+
+	# Adds data read from the port, returns the number of frames now buffered
+	#
+	def feed(self, data):
+		lines = (self.partial + data).split(b"\n")
+		self.partial = lines.pop()
+		if len(self.partial) > self.kMaxPartialLength:
+			self.partial = b''
+		self.frames.extend(lines)
+		return len(self.frames)
+
+	def clear(self):
+		self.partial = b''
+		self.frames.clear()
@@ -0,0 +1,203 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Non-blocking asyncio transport for the Envisalink TPI socket.
+
+AsyncSocketPort runs an asyncio event loop on its own thread. A streaming reader
+task hands the incoming bytes to the plugin thread through a queue as soon as they
+arrive, so a received packet never waits for a read timeout to expire. The class
+mimics the small part of the pyserial port API used by the plugin (isOpen, close,
+flushInput, write and timeout) so it can be used in place of
+serial.serial_for_url('socket://...').
+
+readAvailable() reads everything received so far in one call, from this port or a
+pyserial one, and the plugin splits it into frames with tpi_codec.FrameBuffer. The
+time each chunk arrived is kept, and lastRxTime holds it for the first chunk last
+returned by readAvailable(), so the plugin can measure how long packets wait in the
+queue.
+"""
+
+import asyncio
+import collections
+import queue
+import threading
+import time
+import serial
+
+
+kConnectTimeout = 10
+kWriteTimeout = 1
+kReadSize = 65536
+
+# Marker placed in the receive queue to wake a blocked readAvailable()
+kWakeup = b''
+
+
+class AsyncSocketPort(object):
+
+	def __init__(self, host, port, connectTimeout=kConnectTimeout):
+		self.host = host
+		self.port = int(port)
+		self.timeout = 1
+		self.rxQueue = queue.Queue()
+		# receive time of each line in rxQueue, in the same order
+		self.rxTimes = collections.deque()
+		self.lastRxTime = None
+		self.rxError = None
+		self.reader = None
+		self.writer = None
+		self.readerTask = None
+		self.connected = False
+		self.opened = False
+
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread(target=self.loop.run_forever, name="TPI asyncio transport", daemon=True)
+		self.thread.start()
+
+		future = asyncio.run_coroutine_threadsafe(self._connect(), self.loop)
+		try:
+			future.result(connectTimeout)
+		except Exception:
+			self.close()
+			raise
+		self.opened = True
+
+
+	async def _connect(self):
+		self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+		self.connected = True
+		self.readerTask = self.loop.create_task(self._readChunks())
+
+
+	async def _readChunks(self):
+		try:
+			while True:
+				data = await self.reader.read(kReadSize)
+				if not data:
+					break
+				self.rxTimes.append(time.perf_counter())
+				self.rxQueue.put(data)
+		except asyncio.CancelledError:
+			pass
+		except Exception as err:
+			self.rxError = err
+		finally:
+			self.connected = False
+			# None tells readAvailable() that the connection has gone away
+			self.rxQueue.put(None)
+
+
+	async def _write(self, data):
+		self.writer.write(data)
+		await self.writer.drain()
+
+
+	async def _disconnect(self):
+		if self.readerTask is not None:
+			self.readerTask.cancel()
+		if self.writer is not None:
+			self.writer.close()
+			try:
+				await self.writer.wait_closed()
+			except Exception:
+				pass
+
+
+	def isOpen(self):
+		# Like pyserial this stays True until close() is called. A connection
+		# dropped by the remote end is reported by readAvailable() and write().
+		return self.opened
+
+
+	def close(self):
+		self.opened = False
+		self.connected = False
+		if self.loop.is_running():
+			try:
+				asyncio.run_coroutine_threadsafe(self._disconnect(), self.loop).result(kConnectTimeout)
+			except Exception:
+				pass
+			self.loop.call_soon_threadsafe(self.loop.stop)
+			self.thread.join(kConnectTimeout)
+		if not self.loop.is_running():
+			self.loop.close()
+
+
+	def flushInput(self):
+		try:
+			while True:
+				data = self.rxQueue.get_nowait()
+				if data is None:
+					# keep the disconnect marker for the next readAvailable()
+					self.rxQueue.put(None)
+					break
+				if data:
+					self.rxTimes.popleft()
+		except queue.Empty:
+			pass
+
+
+	def cancel_read(self):
+		self.rxQueue.put(kWakeup)
+
+
+	# Waits up to timeout for data, then returns it together with everything else
+	# received so far. A closed connection is raised once the data received before
+	# it has been returned.
+	#
+	def readAvailable(self):
+		try:
+			data = self.rxQueue.get(timeout=self.timeout)
+		except queue.Empty:
+			return b''
+		chunks = []
+		while True:
+			if data is None:
+				self.rxQueue.put(None)
+				if chunks:
+					break
+				if self.rxError is not None:
+					raise ConnectionError(f"TPI socket error: {self.rxError}")
+				raise ConnectionError("TPI socket closed by remote host")
+			if data:
+				rxTime = self.rxTimes.popleft()
+				if not chunks:
+					self.lastRxTime = rxTime
+				chunks.append(data)
+			try:
+				data = self.rxQueue.get_nowait()
+			except queue.Empty:
+				break
+		return b''.join(chunks)
+
+
+	def rxPending(self):
+		return self.rxQueue.qsize()
+
+
+	def write(self, data):
+		if self.connected is False:
+			raise ConnectionError("TPI socket is not connected")
+		asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result(kWriteTimeout)
+
+
+# Reads everything port has received so far, waiting up to its timeout for the first
+# byte. Serial ports report how many bytes they hold. pyserial socket ports only
+# report whether there is any, so they are drained with a non-blocking read.
+#
+def readAvailable(port):
+	if isinstance(port, AsyncSocketPort):
+		return port.readAvailable()
+	data = port.read(1)
+	if not data:
+		return data
+	if isinstance(port, serial.Serial):
+		return data + port.read(port.in_waiting)
+	timeout = port.timeout
+	port.timeout = 0
+	try:
+		return data + port.read(kReadSize)
+	finally:
+		port.timeout = timeout
@@ -0,0 +1,140 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Zone and partition state of one DSC panel, as reported by the panel.
+
+ZoneTable keeps each zone flag as an integer bitmask with bit 0 for zone 1: open,
+tripped during the current alarm, bypassed, and closed again while the alarm was
+tripped. The partition of each zone is kept in a bytearray and the zones of each
+partition as a mask, so questions such as "open zones in partition 2 that are not
+bypassed" or "is any zone tripped" are a few integer operations instead of a pass
+over the zone devices. Zone devices still show the states; the table is what the
+plugin asks.
+"""
+
+from array import array
+import time
+
+
+# PC1616/1832/1864 panels have up to 64 zones, pass 128 for larger panels
+kMaxZones = 64
+kMaxPartitions = 8
+
+
+# Zone numbers of the bits set in mask, lowest first
+#
+def maskZones(mask):
+	zones = []
+	while mask:
+		bit = mask & -mask
+		zones.append(bit.bit_length())
+		mask ^= bit
+	return zones
+
+
+def zonesMask(zones):
+	mask = 0
+	for zone in zones:
+		mask |= 1 << (zone - 1)
+	return mask
+
+
+class ZoneTable(object):
+
+	__slots__ = ('maxZones', 'openMask', 'trippedMask', 'bypassMask', 'closePendingMask',
+		'partitionOf', 'partitionMasks', 'lastChange')
+
+	def __init__(self, maxZones=kMaxZones):
+		self.maxZones = maxZones
+		self.openMask = 0
+		self.trippedMask = 0
+		self.bypassMask = 0
+		# zones that closed while the alarm was tripped, their devices are closed on disarm
+		self.closePendingMask = 0
+		# partition number of each zone, 0 if unknown, and the zones of each partition
+		self.partitionOf = bytearray(maxZones + 1)
+		self.partitionMasks = [0] * (kMaxPartitions + 1)
+		# time.time() of the last open, close or trip of each zone
+		self.lastChange = array('d', bytes(8 * (maxZones + 1)))
+
+
+	def hasZone(self, zone):
+		return 0 < zone <= self.maxZones
+
+
+	def setPartition(self, zone, partition):
+		if not self.hasZone(zone) or not 0 <= partition <= kMaxPartitions:
+			return
+		bit = 1 << (zone - 1)
+		self.partitionMasks[self.partitionOf[zone]] &= ~bit
+		self.partitionOf[zone] = partition
+		if partition:
+			self.partitionMasks[partition] |= bit
+
+
+	# Returns True if the zone was not already open, or closed
+	#
+	def setOpen(self, zone, isOpen):
+		if not self.hasZone(zone):
+			return False
+		bit = 1 << (zone - 1)
+		if bool(self.openMask & bit) == isOpen:
+			return False
+		self.openMask ^= bit
+		self.lastChange[zone] = time.time()
+		return True
+
+
+	# Returns True if the zone was not already tripped in this alarm
+	#
+	def setTripped(self, zone):
+		if not self.hasZone(zone):
+			return False
+		bit = 1 << (zone - 1)
+		if self.trippedMask & bit:
+			return False
+		self.trippedMask |= bit
+		self.lastChange[zone] = time.time()
+		return True
+
+
+	def clearTripped(self):
+		self.trippedMask = 0
+
+
+	def setClosePending(self, zone, isPending):
+		if not self.hasZone(zone):
+			return
+		if isPending:
+			self.closePendingMask |= 1 << (zone - 1)
+		else:
+			self.closePendingMask &= ~(1 << (zone - 1))
+
+
+	# Returns the zones that were pending and forgets them
+	#
+	def popClosePending(self):
+		mask = self.closePendingMask
+		self.closePendingMask = 0
+		return mask
+
+
+	def isOpen(self, zone):
+		return bool(self.openMask >> (zone - 1) & 1)
+
+
+	# Open zones of the partition, or of the whole panel for partition 0
+	#
+	def getOpenMask(self, partition=0):
+		if partition:
+			return self.openMask & self.partitionMasks[partition]
+		return self.openMask
+
+
+	# Open zones of the partition that have not been bypassed, the zones that keep a
+	# forced arm from arming
+	#
+	def getUnbypassedOpenMask(self, partition):
+		return self.openMask & ~self.bypassMask & self.partitionMasks[partition]
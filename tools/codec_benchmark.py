@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Microbenchmark of TPI frame encoding and decoding: the str based code readPacket and
+sendPacketOnly used before tpi_codec (utf-8 decode, a regex per line and a checksum
+loop with ord() per character) against tpi_codec working on bytes.
+
+Examples:
+	python codec_benchmark.py
+	python codec_benchmark.py --frames 200000 --rounds 5
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+kToolsDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(kToolsDir, os.pardir, "DSC Alarm.indigoPlugin", "Contents", "Server Plugin"))
+
+from tpi_codec import decodeFrame, encodeFrame
+
+
+def legacyChecksum(s):
+	calcSum = 0
+	for c in s:
+		calcSum += ord(c)
+	calcSum %= 256
+	return calcSum
+
+
+def legacyDecode(line):
+	data = line.decode("utf-8").strip()
+	m = re.search(r'^(...)(.*)(..)$', data)
+	if not m:
+		return None
+	(cmd, dat, checksum) = (m.group(1), m.group(2), int(m.group(3), 16))
+	return (cmd, dat, checksum == legacyChecksum("".join([cmd, dat])))
+
+
+def legacyEncode(data):
+	return "{}{:02X}\r\n".format(data, legacyChecksum(data)).encode("utf-8")
+
+
+# A status dump and zone storm mix of received frames, and typical commands
+#
+def makeFrames(count):
+	frames = []
+	for i in range(count):
+		kind = random.random()
+		if kind < 0.8:
+			frames.append(encodeFrame(f"{random.choice(('609', '610'))}{random.randint(1, 64):03d}"))
+		elif kind < 0.9:
+			frames.append(encodeFrame(f"{random.choice(('650', '651', '652', '673'))}{random.randint(1, 8)}"))
+		else:
+			frames.append(encodeFrame(f"550{time.strftime('%H%M%m%d%y')}"))
+	commands = [random.choice(('000', '0561', '0301', '0401123456', '0711*101#', '001')) for i in range(count)]
+	return (frames, commands)
+
+
+def timeRun(func, items, rounds):
+	best = None
+	for _ in range(rounds):
+		startTime = time.perf_counter()
+		for item in items:
+			func(item)
+		elapsed = time.perf_counter() - startTime
+		best = elapsed if best is None else min(best, elapsed)
+	return len(items) / best
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark TPI frame encoding and decoding")
+	parser.add_argument('--frames', type=int, default=100000)
+	parser.add_argument('--rounds', type=int, default=3, help="best of this many runs is reported")
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args()
+
+	random.seed(args.seed)
+	(frames, commands) = makeFrames(args.frames)
+	assert [legacyDecode(frame) for frame in frames] == [decodeFrame(frame) for frame in frames]
+	assert [legacyEncode(data) for data in commands] == [encodeFrame(data) for data in commands]
+
+	print(f"{'':10}{'before':>16}{'after':>16}{'speedup':>10}")
+	for (name, before, after, items) in (
+			('decode', legacyDecode, decodeFrame, frames),
+			('encode', legacyEncode, encodeFrame, commands)):
+		beforeRate = timeRun(before, items, args.rounds)
+		afterRate = timeRun(after, items, args.rounds)
+		print(f"{name:<10}{beforeRate:>12,.0f} f/s{afterRate:>12,.0f} f/s{afterRate / beforeRate:>9.1f}x")
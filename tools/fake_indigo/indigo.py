@@ -0,0 +1,506 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+In-process stand-in for the "indigo" module the Indigo host process provides to plugins.
+
+It covers the parts of the API used by the DSC Alarm plugin closely enough to import
+plugin.py and run deviceStartComm, readPacket and the timer loop outside Indigo, e.g.
+under cProfile on a Linux machine:
+
+  - indigo.devices[id] returns a copy of the server's device, like the real API
+  - device states are read only and are changed with updateStateOnServer and
+    updateStatesOnServer, which also keep the "state.open" style booleans of
+    enumerated states up to date
+  - state lists and their defaults are read from the plugin's Devices.xml
+  - the plugin's deviceUpdated is called after every change to one of its devices,
+    from self.sleep or deliverDeviceUpdates rather than from the calling thread
+  - self.sleep raises StopThread once stopConcurrentThread has been called
+
+Every call that would go to the Indigo server is counted and timed in apiStats.
+setServerLatency adds a delay to each of those calls to model the round trip to the
+Indigo server.
+"""
+
+import copy
+import functools
+import logging
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ElementTree
+
+
+# Indigo adds a THREADDEBUG level below DEBUG
+logging.THREADDEBUG = 5
+logging.addLevelName(logging.THREADDEBUG, "THREADDEBUG")
+
+def _threaddebug(self, msg, *args, **kwargs):
+	if self.isEnabledFor(logging.THREADDEBUG):
+		self._log(logging.THREADDEBUG, msg, args, **kwargs)
+
+logging.Logger.threaddebug = _threaddebug
+
+
+kPluginDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "DSC Alarm.indigoPlugin", "Contents", "Server Plugin")
+
+
+######################################################################################
+# Call Statistics
+######################################################################################
+
+class ApiStat(object):
+
+	def __init__(self):
+		self.count = 0
+		self.totalTime = 0.0
+		self.maxTime = 0.0
+
+
+apiStats = {}
+serverLatency = 0.0
+_hostPlugin = None
+_pendingUpdates = []
+
+
+def resetCounters():
+	apiStats.clear()
+
+
+def setServerLatency(seconds):
+	global serverLatency
+	serverLatency = seconds
+
+
+def totalApiCalls():
+	return sum(stat.count for stat in apiStats.values())
+
+
+# Counts and times a call that would be a round trip to the Indigo server
+#
+def _serverCall(name):
+	def decorate(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			startTime = time.perf_counter()
+			if serverLatency:
+				time.sleep(serverLatency)
+			try:
+				return func(*args, **kwargs)
+			finally:
+				elapsed = time.perf_counter() - startTime
+				stat = apiStats.get(name)
+				if stat is None:
+					stat = apiStats[name] = ApiStat()
+				stat.count += 1
+				stat.totalTime += elapsed
+				if elapsed > stat.maxTime:
+					stat.maxTime = elapsed
+		return wrapper
+	return decorate
+
+
+def logApiStats(out=sys.stdout):
+	total = totalApiCalls()
+	out.write(f"{total} Indigo API calls\n")
+	out.write(f"  {'call':<40}{'count':>9}{'total ms':>11}{'mean us':>11}{'max us':>11}\n")
+	for (name, stat) in sorted(apiStats.items(), key=lambda item: item[1].totalTime, reverse=True):
+		out.write(f"  {name:<40}{stat.count:>9}{stat.totalTime * 1e3:>11.1f}{stat.totalTime / stat.count * 1e6:>11.1f}{stat.maxTime * 1e6:>11.1f}\n")
+
+
+######################################################################################
+# Basic Types
+######################################################################################
+
+class Dict(dict):
+	pass
+
+
+class List(list):
+	pass
+
+
+class _StateImageSel(object):
+	def __getattr__(self, name):
+		return name
+
+kStateImageSel = _StateImageSel()
+
+
+class States(Dict):
+
+	def __setitem__(self, key, value):
+		raise TypeError("device states are read only, use updateStateOnServer")
+
+	def __deepcopy__(self, memo):
+		states = States()
+		dict.update(states, self)
+		return states
+
+	def _update(self, key, value, enumerations):
+		dict.__setitem__(self, key, value)
+		for option in enumerations.get(key, ()):
+			dict.__setitem__(self, f"{key}.{option}", value == option)
+
+
+######################################################################################
+# Devices
+######################################################################################
+
+# Reads the state ids, value types and enumerations of each device type in Devices.xml
+#
+def loadDeviceTypes(fileName=os.path.join(kPluginDir, "Devices.xml")):
+	deviceTypes = {}
+	for deviceElem in ElementTree.parse(fileName).getroot().iter('Device'):
+		states = {}
+		for stateElem in deviceElem.iter('State'):
+			valueType = stateElem.find('ValueType')
+			options = [option.get('value') for option in valueType.iter('Option')]
+			states[stateElem.get('id')] = (valueType.text.strip() if valueType.text and not options else 'Enumeration', options)
+		deviceTypes[deviceElem.get('id')] = states
+	return deviceTypes
+
+
+deviceTypes = {}
+
+
+def _defaultValue(valueType, options):
+	if options:
+		return options[0]
+	if valueType in ('Integer', 'Number'):
+		return 0
+	if valueType == 'Boolean':
+		return False
+	return ""
+
+
+# A copy of a device with its own states and props, like the ones Indigo passes to
+# deviceUpdated, without the cost of a deepcopy for every state change
+#
+def _snapshot(dev):
+	devCopy = copy.copy(dev)
+	devCopy.states = copy.deepcopy(dev.states)
+	devCopy.pluginProps = Dict(dev.pluginProps)
+	return devCopy
+
+
+# Not part of the Indigo API. Indigo calls the plugin's deviceUpdated on its main
+# thread after a state change reaches the server; here the calls are queued and made
+# by PluginBase.sleep or by calling this. Returns the number of calls made.
+#
+def deliverDeviceUpdates():
+	delivered = 0
+	while _pendingUpdates:
+		(origDev, newDev) = _pendingUpdates.pop(0)
+		_hostPlugin.deviceUpdated(origDev, newDev)
+		delivered += 1
+	return delivered
+
+
+class Device(object):
+
+	def __init__(self, id, name, deviceTypeId, pluginProps=None, states=None, pluginId=None):
+		if not deviceTypes:
+			deviceTypes.update(loadDeviceTypes())
+		self.id = id
+		self.name = name
+		self.deviceTypeId = deviceTypeId
+		self.pluginId = pluginId if pluginId is not None else getattr(_hostPlugin, 'pluginId', None)
+		self.pluginProps = Dict(pluginProps or {})
+		self.enabled = True
+		self.states = States()
+		self.enumerations = {}
+		for (stateId, (valueType, options)) in deviceTypes.get(deviceTypeId, {}).items():
+			if options:
+				self.enumerations[stateId] = options
+			self.states._update(stateId, _defaultValue(valueType, options), self.enumerations)
+		for (key, value) in (states or {}).items():
+			self.states._update(key, value, self.enumerations)
+
+	def _applyStates(self, keyValueList):
+		serverDev = devices._devices.get(self.id)
+		origDev = _snapshot(serverDev) if serverDev is not None else None
+		for (key, value) in keyValueList:
+			self.states._update(key, value, self.enumerations)
+			if serverDev is not None and serverDev is not self:
+				serverDev.states._update(key, value, self.enumerations)
+		return (origDev, serverDev)
+
+	def _notifyUpdated(self, origDev, serverDev):
+		if origDev is not None and _hostPlugin is not None and serverDev.pluginId == _hostPlugin.pluginId:
+			_pendingUpdates.append((origDev, _snapshot(serverDev)))
+
+	def updateStateOnServer(self, key, value, **kwargs):
+		(origDev, serverDev) = self._updateStateOnServer(key, value)
+		self._notifyUpdated(origDev, serverDev)
+
+	@_serverCall('dev.updateStateOnServer')
+	def _updateStateOnServer(self, key, value):
+		return self._applyStates([(key, value)])
+
+	def updateStatesOnServer(self, keyValueList, **kwargs):
+		(origDev, serverDev) = self._updateStatesOnServer(keyValueList)
+		self._notifyUpdated(origDev, serverDev)
+
+	@_serverCall('dev.updateStatesOnServer')
+	def _updateStatesOnServer(self, keyValueList):
+		return self._applyStates([(item['key'], item['value']) for item in keyValueList])
+
+	@_serverCall('dev.updateStateImageOnServer')
+	def updateStateImageOnServer(self, image):
+		pass
+
+	@_serverCall('dev.stateListOrDisplayStateIdChanged')
+	def stateListOrDisplayStateIdChanged(self):
+		pass
+
+	@_serverCall('dev.replacePluginPropsOnServer')
+	def replacePluginPropsOnServer(self, props):
+		self.pluginProps = Dict(props)
+		if self.id in devices._devices:
+			devices._devices[self.id].pluginProps = Dict(props)
+
+
+class _Devices(object):
+
+	def __init__(self):
+		self._devices = {}
+
+	# Not part of the Indigo API, adds a device to the fake server and returns a copy
+	# the way Indigo passes one to deviceStartComm
+	def add(self, dev):
+		self._devices[dev.id] = dev
+		return copy.deepcopy(dev)
+
+	@_serverCall('devices[]')
+	def __getitem__(self, devId):
+		if devId not in self._devices:
+			for dev in self._devices.values():
+				if dev.name == devId:
+					return copy.deepcopy(dev)
+		return copy.deepcopy(self._devices[devId])
+
+	def __contains__(self, devId):
+		return devId in self._devices or any(dev.name == devId for dev in self._devices.values())
+
+	def __len__(self):
+		return len(self._devices)
+
+	@_serverCall('devices.iter')
+	def iter(self, filter=None):
+		# only plugin device type filters, "self.<deviceTypeId>"
+		deviceTypeId = filter[5:] if filter and filter.startswith("self.") else None
+		return iter([copy.deepcopy(dev) for dev in self._devices.values() if deviceTypeId is None or dev.deviceTypeId == deviceTypeId])
+
+devices = _Devices()
+
+
+######################################################################################
+# Variables
+######################################################################################
+
+class Variable(object):
+
+	def __init__(self, id, name, value="", folderId=0):
+		self.id = id
+		self.name = name
+		self.value = value
+		self.folderId = folderId
+
+
+class _VariableFolders(dict):
+
+	def __contains__(self, key):
+		return dict.__contains__(self, key) or key in self.values()
+
+
+class _VariableFolderCommands(object):
+
+	@_serverCall('variables.folder.create')
+	def create(self, name):
+		variables.folders[name] = len(variables.folders) + 1
+		return variables.folders[name]
+
+
+class _Variables(object):
+
+	folder = _VariableFolderCommands()
+
+	def __init__(self):
+		self._variables = {}
+		self.folders = _VariableFolders()
+
+	def _find(self, key):
+		if key in self._variables:
+			return self._variables[key]
+		for var in self._variables.values():
+			if var.name == key:
+				return var
+		raise KeyError(key)
+
+	@_serverCall('variables[]')
+	def __getitem__(self, key):
+		return copy.copy(self._find(key))
+
+	def __contains__(self, key):
+		try:
+			self._find(key)
+		except KeyError:
+			return False
+		return True
+
+	def __len__(self):
+		return len(self._variables)
+
+variables = _Variables()
+
+
+class _VariableCommands(object):
+
+	@_serverCall('variable.create')
+	def create(self, name, value="", folder=0):
+		var = Variable(1000000 + len(variables._variables), name, value, variables.folders.get(folder, folder))
+		variables._variables[var.id] = var
+		return copy.copy(var)
+
+	@_serverCall('variable.updateValue')
+	def updateValue(self, var, value=""):
+		variables._find(getattr(var, 'id', var)).value = value
+
+variable = _VariableCommands()
+
+
+######################################################################################
+# Triggers
+######################################################################################
+
+class Trigger(object):
+
+	def __init__(self, id, name, pluginTypeId="", pluginProps=None, filterType=None, **kwargs):
+		self.id = id
+		self.name = name
+		self.pluginTypeId = pluginTypeId
+		self.pluginProps = Dict(pluginProps or {})
+		self.filterType = filterType
+		self.enabled = True
+		self.__dict__.update(kwargs)
+
+
+class _Triggers(object):
+
+	def __init__(self):
+		self._triggers = {}
+
+	# Not part of the Indigo API
+	def add(self, trigger):
+		self._triggers[trigger.id] = trigger
+		return copy.deepcopy(trigger)
+
+	@_serverCall('triggers[]')
+	def __getitem__(self, trigId):
+		return copy.deepcopy(self._triggers[trigId])
+
+	def __contains__(self, trigId):
+		return trigId in self._triggers
+
+	@_serverCall('triggers.iter')
+	def iter(self, filter=None):
+		return iter([copy.deepcopy(trigger) for trigger in self._triggers.values() if filter is None or trigger.filterType == filter])
+
+triggers = _Triggers()
+
+
+class _TriggerCommands(object):
+
+	def __init__(self):
+		self.executed = []
+
+	@_serverCall('trigger.execute')
+	def execute(self, trigger):
+		self.executed.append(getattr(trigger, 'id', trigger))
+
+trigger = _TriggerCommands()
+
+
+######################################################################################
+# Server
+######################################################################################
+
+class _Server(object):
+
+	version = "2023.2.0"
+	apiVersion = "3.4"
+
+	def __init__(self):
+		self.emails = []
+		self.spoken = []
+
+	@_serverCall('server.sendEmailTo')
+	def sendEmailTo(self, address, subject="", body=""):
+		self.emails.append((address, subject, body))
+
+	@_serverCall('server.speak')
+	def speak(self, text, waitUntilDone=False):
+		self.spoken.append(text)
+
+	@_serverCall('server.log')
+	def log(self, message, **kwargs):
+		pass
+
+	def getLogsFolderPath(self, pluginId=None):
+		return tempfile.gettempdir()
+
+	def getInstallFolderPath(self):
+		return tempfile.gettempdir()
+
+server = _Server()
+
+
+######################################################################################
+# Plugin Base Class
+######################################################################################
+
+class PluginBase(object):
+
+	class StopThread(Exception):
+		pass
+
+	def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+		global _hostPlugin
+		_hostPlugin = self
+		self.pluginId = pluginId
+		self.pluginDisplayName = pluginDisplayName
+		self.pluginVersion = pluginVersion
+		self.pluginPrefs = pluginPrefs
+		self.stopThread = False
+
+		# Indigo logs to the event log and to the plugin's own log file
+		self.logger = logging.getLogger("Plugin")
+		self.logger.setLevel(logging.THREADDEBUG)
+		self.indigo_log_handler = logging.StreamHandler(sys.stderr)
+		self.indigo_log_handler.setLevel(logging.INFO)
+		self.plugin_file_handler = logging.NullHandler()
+		self.logger.handlers = [self.indigo_log_handler, self.plugin_file_handler]
+		self.logger.propagate = False
+
+	def __del__(self):
+		pass
+
+	def sleep(self, seconds):
+		if self.stopThread is True:
+			raise self.StopThread()
+		deliverDeviceUpdates()
+		time.sleep(seconds)
+		if self.stopThread is True:
+			raise self.StopThread()
+
+	def stopConcurrentThread(self):
+		self.stopThread = True
+
+	def deviceUpdated(self, origDev, newDev):
+		pass
+
+	def substitute(self, inString, validateOnly=False):
+		return inString
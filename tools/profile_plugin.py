@@ -0,0 +1,92 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Profiles the plugin's hot paths outside Indigo with cProfile, using the stand-in
+indigo module in fake_indigo:
+
+  - startup: Plugin.__init__ and deviceStartComm for every zone, keypad and zone group
+  - packets: Plugin.readPacket over a generated zone storm or a trace
+  - timers:  the minute tick of runConcurrentThread (updateTimerStates and flushStates)
+
+Each phase prints the top functions by cumulative time and the Indigo API calls it
+made with their timing. --latency adds a delay to every Indigo API call to show the
+cost of the round trips to the Indigo server.
+
+Examples:
+	python profile_plugin.py
+	python profile_plugin.py --phase packets --storm 50000 --sort tottime
+	python profile_plugin.py --zones 256 --latency 0.0005 --trace sample_alarm.tpi
+"""
+
+import argparse
+import cProfile
+import logging
+import pstats
+import random
+
+from replay_benchmark import indigo, loadTrace, makePlugin, makeStorm, replay
+
+
+kPhases = ('startup', 'packets', 'timers')
+
+
+def runPhase(name, args, func, *funcArgs):
+	indigo.resetCounters()
+	profiler = cProfile.Profile()
+	result = profiler.runcall(func, *funcArgs)
+
+	print(f"\n######## {name} ########\n")
+	stats = pstats.Stats(profiler)
+	stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+	indigo.logApiStats()
+	if args.save:
+		stats.dump_stats(f"{args.save}_{name}.prof")
+	return result
+
+
+# Runs the minute tick of runConcurrentThread as if the given number of minutes had passed
+#
+def timerTicks(dscPlugin, minutes):
+	for minute in range(minutes):
+		for timer in dscPlugin.timerStarted:
+			dscPlugin.timerStarted[timer] -= 60
+		dscPlugin.updateTimerStates()
+		dscPlugin.flushStates()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Profile the DSC Alarm plugin's hot paths outside Indigo")
+	parser.add_argument('--phase', choices=kPhases, action='append', help="phase to profile, default all")
+	parser.add_argument('--trace', action='append', default=[], help="capture file, emulator script or plugin log to replay")
+	parser.add_argument('--storm', type=int, default=20000, help="generated zone transitions to replay")
+	parser.add_argument('--minutes', type=int, default=60, help="minute ticks to run")
+	parser.add_argument('--zones', type=int, default=64)
+	parser.add_argument('--partitions', type=int, default=1)
+	parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every Indigo API call")
+	parser.add_argument('--sort', default='cumulative', help="pstats sort key")
+	parser.add_argument('--top', type=int, default=25, help="functions to print per phase")
+	parser.add_argument('--save', help="also save the profiles as <SAVE>_<phase>.prof")
+	parser.add_argument('--seed', type=int, default=1)
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.ERROR)
+	random.seed(args.seed)
+	indigo.setServerLatency(args.latency)
+	phases = args.phase or kPhases
+
+	if 'startup' in phases:
+		dscPlugin = runPhase('startup', args, makePlugin, args.zones, args.partitions)
+	else:
+		dscPlugin = makePlugin(args.zones, args.partitions)
+
+	if 'packets' in phases:
+		packets = []
+		for fileName in args.trace:
+			packets += loadTrace(fileName)
+		packets += makeStorm(args.storm, args.zones)
+		runPhase('packets', args, replay, dscPlugin, packets)
+
+	if 'timers' in phases:
+		runPhase('timers', args, timerTicks, dscPlugin, args.minutes)
@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Replays recorded TPI traffic through Plugin.readPacket outside Indigo and reports
+throughput, per command code latency percentiles and the number of Indigo API calls.
+
+Traces can be:
+  - captures made with the plugin's "Start TPI Traffic Capture" menu item
+  - tools/tpi_emulator.py event scripts (same format)
+  - Indigo plugin logs at "Detailed Debug" level, using their "RX:" lines
+
+Examples:
+	python replay_benchmark.py tpi_capture_20240101_120000.txt
+	python replay_benchmark.py --repeat 100 sample_alarm.tpi
+	python replay_benchmark.py --storm 100000
+"""
+
+import argparse
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+kToolsDir = os.path.dirname(os.path.abspath(__file__))
+kPluginDir = os.path.join(kToolsDir, os.pardir, "DSC Alarm.indigoPlugin", "Contents", "Server Plugin")
+sys.path.insert(0, os.path.join(kToolsDir, "fake_indigo"))
+sys.path.insert(0, kPluginDir)
+
+import indigo
+import plugin
+from tpi_emulator import makePacket, parseScriptLine
+
+
+kZoneGroupDevId = 900
+kPercentiles = (50, 90, 99)
+
+
+# Returns the packets of a trace as (cmd, data) tuples
+#
+def loadTrace(fileName):
+	packets = []
+	with open(fileName, errors='replace') as traceFile:
+		for line in traceFile:
+			m = re.search(r'RX: (\w{5,})', line)
+			if m:
+				# logged packets still have their checksum
+				packets.append((m.group(1)[:3], m.group(1)[3:-2]))
+				continue
+			try:
+				entry = parseScriptLine(line)
+			except ValueError:
+				continue
+			if entry is not None:
+				packets.append(entry[1:])
+	return packets
+
+
+# An alarm storm: random zones opening and restoring, some in alarm
+#
+def makeStorm(count, zones):
+	packets = []
+	zoneOpen = [False] * (zones + 1)
+	for i in range(count):
+		zone = random.randint(1, zones)
+		zoneOpen[zone] = not zoneOpen[zone]
+		if zoneOpen[zone] and random.random() < 0.1:
+			packets.append(('601', f"1{zone:03d}"))
+		else:
+			packets.append(('609' if zoneOpen[zone] else '610', f"{zone:03d}"))
+	return packets
+
+
+class ReplayPort(object):
+
+	def __init__(self, packets):
+		self.data = b"".join(makePacket(cmd, data) for (cmd, data) in packets)
+		self.offset = 0
+		self.timeout = 1
+
+	def isOpen(self):
+		return True
+
+	# Like a socket port, returns what has been received, up to size bytes
+	#
+	def read(self, size=1):
+		data = self.data[self.offset:self.offset + size]
+		self.offset += len(data)
+		return data
+
+	def write(self, data):
+		pass
+
+	def flushInput(self):
+		pass
+
+	def close(self):
+		pass
+
+
+def makePlugin(zones, partitions):
+	prefs = indigo.Dict({
+		'configInterface': 'twods', 'TwoDS_Address': '127.0.0.1', 'TwoDS_Port': '4025', 'TwoDS_Password': 'user',
+		'code': '1234', 'variableState': '', 'speakingEnabled': False, 'emailUrgent': '', 'emailNotice': '',
+		'EmailDisarm': '', 'customStateIcons': True, 'logLevel': 40,
+	})
+	dscPlugin = plugin.Plugin("com.frightideas.indigoplugin.dscAlarm", "DSC Alarm", "benchmark", prefs)
+	dscPlugin.configRead = dscPlugin.getConfiguration(prefs)
+
+	for zone in range(1, zones + 1):
+		dev = indigo.devices.add(indigo.Device(1000 + zone, f"Zone {zone}", 'alarmZone',
+			{'zoneNumber': str(zone), 'zoneType': 'zoneTypeMotion' if zone % 3 == 0 else 'zoneTypeDoor', 'zonePartition': '1',
+			'zoneLogChanges': 0, 'occupancyGroup': 0, 'var': None},
+			{'state': 'closed', 'bypass': 'nobypass', 'LastChangedTimer': 0, 'LastChangedShort': '0m'}))
+		dscPlugin.deviceStartComm(indigo.devices[dev.id])
+
+	for partition in range(1, partitions + 1):
+		dev = indigo.devices.add(indigo.Device(2000 + partition, f"Keypad {partition}", 'alarmKeypad',
+			{'partitionNumber': str(partition), 'partitionName': f"Partition {partition}"},
+			{'state': 'disarmed', 'ArmedState': 'disarmed', 'ReadyState': 'ready', 'PanicState': 'none', 'KeypadChime': 'disabled'}))
+		dscPlugin.deviceStartComm(indigo.devices[dev.id])
+
+	dev = indigo.devices.add(indigo.Device(kZoneGroupDevId, "Zone Group", 'alarmZoneGroup',
+		{'devList': [str(1000 + zone) for zone in range(1, min(zones, 8) + 1)]},
+		{'state': 'allZonesClosed', 'AnyMemberLastChangedTimer': 0, 'AnyMemberLastChangedShort': '0m',
+		'EntireGroupLastChangedTimer': 0, 'EntireGroupLastChangedShort': '0m'}))
+	dscPlugin.deviceStartComm(indigo.devices[dev.id])
+
+	return dscPlugin
+
+
+def percentile(sortedTimes, pct):
+	return sortedTimes[min(len(sortedTimes) - 1, int(len(sortedTimes) * pct / 100))]
+
+
+def replay(dscPlugin, packets):
+	dscPlugin.port = ReplayPort(packets)
+	latency = {}
+	perfCounter = time.perf_counter
+	startTime = perfCounter()
+	for (cmd, data) in packets:
+		packetStart = perfCounter()
+		dscPlugin.readPacket()
+		latency.setdefault(cmd, []).append(perfCounter() - packetStart)
+		indigo.deliverDeviceUpdates()
+	return (perfCounter() - startTime, latency)
+
+
+def report(packetCount, elapsed, latency):
+	print(f"\n{packetCount} packets in {elapsed:.3f} s, {packetCount / elapsed:,.0f} packets/sec\n")
+	print(f"{'cmd':<5}{'count':>9}" + "".join(f"{'p' + str(pct) + ' us':>11}" for pct in kPercentiles) + f"{'max us':>11}")
+	for cmd in sorted(latency, key=lambda cmd: len(latency[cmd]), reverse=True):
+		times = sorted(latency[cmd])
+		print(f"{cmd:<5}{len(times):>9}" + "".join(f"{percentile(times, pct) * 1e6:>11.1f}" for pct in kPercentiles) + f"{times[-1] * 1e6:>11.1f}")
+
+	print(f"\n{indigo.totalApiCalls() / packetCount:.2f} Indigo API calls per packet")
+	indigo.logApiStats()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Replay TPI traffic through Plugin.readPacket and report throughput")
+	parser.add_argument('trace', nargs='*', help="capture file, emulator script or plugin log")
+	parser.add_argument('--storm', type=int, default=0, help="add this many generated zone transitions")
+	parser.add_argument('--repeat', type=int, default=1, help="replay the traces this many times")
+	parser.add_argument('--zones', type=int, default=64)
+	parser.add_argument('--partitions', type=int, default=1)
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every Indigo API call")
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.ERROR)
+	random.seed(args.seed)
+	indigo.setServerLatency(args.latency)
+
+	packets = []
+	for fileName in args.trace:
+		packets += loadTrace(fileName)
+	if args.storm:
+		packets += makeStorm(args.storm, args.zones)
+	packets *= args.repeat
+	if not packets:
+		parser.error("nothing to replay, give a trace file or --storm")
+
+	dscPlugin = makePlugin(args.zones, args.partitions)
+	indigo.resetCounters()
+	(elapsed, latency) = replay(dscPlugin, packets)
+	report(len(packets), elapsed, latency)
@@ -0,0 +1,265 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+
+"""
+Offline DSC panel emulator speaking the Envisalink / IT-100 TPI protocol over TCP.
+
+Point the plugin's Envisalink address at the machine running this script to exercise
+runConcurrentThread, sendPacket and readPacket without a panel. The emulator:
+
+  - asks for the password with 5053 and answers the 005 login with 505 (skipped with --it100)
+  - acknowledges every command with 500, and answers bad checksums with 501
+  - answers 001 with a status dump (609/610 for every zone, 650 or 652 for every partition)
+  - arms (030-033) through exit delay, disarms (040) and sends 550 time broadcasts after 0561
+  - plays scripted event streams, one "<delay seconds> <command><data>" per line
+  - generates zone open/restore storms at a fixed rate for load testing
+
+Examples:
+	python tpi_emulator.py --password user
+	python tpi_emulator.py --script sample_alarm.tpi --repeat
+	python tpi_emulator.py --storm-rate 5000 --storm-seconds 30 --zones 64
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+kToolsDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(kToolsDir, os.pardir, "DSC Alarm.indigoPlugin", "Contents", "Server Plugin"))
+
+from tpi_codec import decodeFrame, encodeFrame
+
+
+kDefaultPort = 4025
+kDefaultPassword = 'user'
+kTimeBroadcastInterval = 240
+kExitDelay = 3
+kStormTicksPerSecond = 100
+
+log = logging.getLogger('tpi_emulator')
+
+
+# Frames are built and checked with the plugin's own codec
+#
+def makePacket(cmd, data=''):
+	return encodeFrame(cmd + data)
+
+
+# Parses one "<delay seconds> <command><data>" script line
+#
+def parseScriptLine(line):
+	line = line.split('#', 1)[0].strip()
+	if not line:
+		return None
+	(delay, pkt) = line.split(None, 1)
+	pkt = pkt.replace(' ', '')
+	return (float(delay), pkt[:3], pkt[3:])
+
+
+def loadScript(fileName):
+	with open(fileName) as scriptFile:
+		return [entry for entry in map(parseScriptLine, scriptFile) if entry is not None]
+
+
+class PanelEmulator(object):
+
+	def __init__(self, password=kDefaultPassword, zones=64, partitions=1, requireLogin=True, errorRate=0.0):
+		self.password = password
+		self.zones = zones
+		self.partitions = partitions
+		self.requireLogin = requireLogin
+		self.errorRate = errorRate
+		self.zoneOpen = [False] * (zones + 1)
+		self.partitionArmed = [False] * (partitions + 1)
+		self.writer = None
+		self.loggedIn = False
+		self.timeBroadcast = False
+		self.txCount = 0
+		self.rxCount = 0
+
+
+	def send(self, cmd, data=''):
+		if self.writer is None or self.writer.is_closing():
+			return
+		self.writer.write(makePacket(cmd, data))
+		self.txCount += 1
+
+
+	async def handleClient(self, reader, writer):
+		peer = writer.get_extra_info('peername')
+		if self.writer is not None and not self.writer.is_closing():
+			log.warning(f"Refusing second TPI session from {peer}")
+			writer.close()
+			return
+
+		log.info(f"TPI session opened by {peer}")
+		self.writer = writer
+		self.loggedIn = not self.requireLogin
+		if self.requireLogin:
+			self.send('505', '3')
+		broadcaster = asyncio.ensure_future(self.broadcastTime())
+
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				self.rxCount += 1
+				self.handleLine(line)
+				await writer.drain()
+		except ConnectionError as err:
+			log.info(f"TPI session error: {err}")
+		finally:
+			broadcaster.cancel()
+			log.info(f"TPI session closed by {peer} (rx {self.rxCount}, tx {self.txCount})")
+			writer.close()
+			self.writer = None
+
+
+	def handleLine(self, line):
+		try:
+			frame = decodeFrame(line)
+		except ValueError:
+			frame = (None, None, False)
+		if frame is None:
+			return
+		(cmd, data, checksumOk) = frame
+		if not checksumOk:
+			log.warning(f"Bad checksum: {line!r}")
+			self.send('501')
+			return
+
+		log.debug(f"RX: {cmd} {data}")
+
+		if not self.loggedIn and cmd != '005':
+			self.send('505', '3')
+			return
+
+		if self.errorRate and random.random() < self.errorRate:
+			self.send('500', cmd)
+			self.send('502', '010')
+			return
+
+		self.send('500', cmd)
+
+		if cmd == '005':
+			self.loggedIn = (data == self.password)
+			self.send('505', '1' if self.loggedIn else '0')
+		elif cmd == '001':
+			self.sendStatusDump()
+		elif cmd == '056':
+			self.timeBroadcast = (data == '1')
+		elif cmd in ('030', '031', '032', '033'):
+			asyncio.ensure_future(self.arm(int(data[:1] or '1'), cmd))
+		elif cmd == '040':
+			self.disarm(int(data[:1] or '1'))
+
+
+	def sendStatusDump(self):
+		for zone in range(1, self.zones + 1):
+			self.send('609' if self.zoneOpen[zone] else '610', f"{zone:03d}")
+		for partition in range(1, self.partitions + 1):
+			if self.partitionArmed[partition]:
+				self.send('652', f"{partition}0")
+			else:
+				self.send('650', str(partition))
+
+
+	async def arm(self, partition, cmd):
+		self.send('656', str(partition))
+		await asyncio.sleep(kExitDelay)
+		self.partitionArmed[partition] = True
+		self.send('700', f"{partition}0001")
+		self.send('652', f"{partition}{0 if cmd in ('030', '032') else 1}")
+
+
+	def disarm(self, partition):
+		self.partitionArmed[partition] = False
+		self.send('750', f"{partition}0001")
+		self.send('655', str(partition))
+		self.send('650', str(partition))
+
+
+	async def broadcastTime(self):
+		while True:
+			if self.timeBroadcast:
+				self.send('550', time.strftime('%H%M%m%d%y'))
+			await asyncio.sleep(kTimeBroadcastInterval)
+
+
+	async def playScript(self, script, repeat=False):
+		while True:
+			for (delay, cmd, data) in script:
+				await asyncio.sleep(delay)
+				self.send(cmd, data)
+			if not repeat:
+				return
+
+
+	# Opens and restores random zones at rate transitions per second
+	#
+	async def zoneStorm(self, rate, seconds):
+		sent = 0
+		startTime = time.time()
+		endTime = startTime + seconds if seconds else None
+		while endTime is None or time.time() < endTime:
+			# catch up with the requested rate, however long the last sleep took
+			due = int((time.time() - startTime) * rate) - sent
+			if due > 0 and self.writer is not None and self.loggedIn:
+				for i in range(due):
+					zone = random.randint(1, self.zones)
+					self.zoneOpen[zone] = not self.zoneOpen[zone]
+					self.send('609' if self.zoneOpen[zone] else '610', f"{zone:03d}")
+				sent += due
+				await self.writer.drain()
+			await asyncio.sleep(1 / kStormTicksPerSecond)
+		elapsed = time.time() - startTime
+		log.info(f"Zone storm finished: {sent} transitions in {elapsed:.1f} s ({sent / elapsed:.0f}/s)")
+
+
+async def main(args):
+	emulator = PanelEmulator(password=args.password, zones=args.zones, partitions=args.partitions, requireLogin=not args.it100, errorRate=args.error_rate)
+	server = await asyncio.start_server(emulator.handleClient, args.host, args.port)
+	log.info(f"DSC TPI emulator listening on {args.host}:{args.port}")
+
+	tasks = []
+	if args.script:
+		tasks.append(emulator.playScript(loadScript(args.script), args.repeat))
+	if args.storm_rate:
+		tasks.append(emulator.zoneStorm(args.storm_rate, args.storm_seconds))
+
+	async with server:
+		if tasks:
+			# wait for the plugin to connect before starting the event streams
+			while emulator.writer is None or not emulator.loggedIn:
+				await asyncio.sleep(0.1)
+			await asyncio.gather(*tasks)
+		await server.serve_forever()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Offline DSC Envisalink/IT-100 TPI panel emulator")
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=kDefaultPort)
+	parser.add_argument('--password', default=kDefaultPassword)
+	parser.add_argument('--it100', action='store_true', help="no login handshake, like the IT-100 serial interface")
+	parser.add_argument('--zones', type=int, default=64)
+	parser.add_argument('--partitions', type=int, default=1)
+	parser.add_argument('--script', help="event script, one '<delay seconds> <command><data>' per line")
+	parser.add_argument('--repeat', action='store_true', help="play the script in a loop")
+	parser.add_argument('--storm-rate', type=int, default=0, help="zone transitions per second")
+	parser.add_argument('--storm-seconds', type=float, default=0, help="length of the zone storm, 0 runs forever")
+	parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of commands answered with 502 010")
+	parser.add_argument('--debug', action='store_true')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+	try:
+		asyncio.run(main(args))
+	except KeyboardInterrupt:
+		pass